@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import datetime
+import subprocess
+
+# The core functions live next to compress_vid.py, one folder up; compress_core doesn't need PyQt5
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compress_core import *
+
+# Frame size of each resolution bucket in ffmpeg_settings, landscape
+RESOLUTIONS = {'4k': (3840, 2160), '2.7k': (2704, 1520), '1080p': (1920, 1080)}
+# Extra portrait clips (phone footage), resolution bucket and frame rate
+PORTRAIT_BUCKETS = [('4k', '30'), ('1080p', '30'), ('1080p', '60')]
+# testsrc2 is flat motion graphics, mandelbrot fine detail that is much harder to compress
+PATTERNS = ['testsrc2', 'mandelbrot']
+
+# How often the planning step is repeated per clip, one call is too quick to time on its own
+PLAN_REPEATS = 1000
+
+
+def list_buckets(portrait=True):
+    # One (name, width, height, fps) per resolution and frame rate in ffmpeg_settings
+    buckets = []
+    for resolution, frame_rates in ffmpeg_settings.items():
+        width, height = RESOLUTIONS[resolution]
+        for frame_rate in frame_rates:
+            buckets.append((f"{resolution}/{frame_rate}", width, height, int(frame_rate)))
+    if portrait:
+        for resolution, frame_rate in PORTRAIT_BUCKETS:
+            width, height = RESOLUTIONS[resolution]
+            buckets.append((f"{resolution}/{frame_rate}/portrait", height, width, int(frame_rate)))
+    return buckets
+
+
+def make_clip(path, pattern, width, height, fps, seconds):
+    """
+    Writes a synthetic camera-like clip: the lavfi pattern plus a sine tone, as H.264 at the
+    HQ table bitrate times two so there is something to compress. Lavfi sources are deterministic,
+    so every host benchmarks the same pictures. An existing clip is reused.
+    """
+    if os.path.exists(path):
+        return path
+    resolution = next(name for name, size in RESOLUTIONS.items() if size in ((width, height), (height, width)))
+    source_bitrate = ffmpeg_settings[resolution][str(fps)]['vt_h265']['HQ'] * 2
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"{pattern}=size={width}x{height}:rate={fps}",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(seconds),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f"{source_bitrate}M", '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        path + '.tmp.mp4'
+    ]
+    print(" ".join(cmd))
+    subprocess.run(cmd, check=True)
+    os.replace(path + '.tmp.mp4', path)
+    return path
+
+
+def timed(func, *args, **kwargs):
+    # Returns (func's result, seconds it took)
+    started = time.perf_counter()
+    value = func(*args, **kwargs)
+    return value, time.perf_counter() - started
+
+
+def tool_version(cmd):
+    try:
+        output = subprocess.run(cmd, capture_output=True, text=True, errors='replace').stdout
+    except OSError:
+        return None
+    return output.splitlines()[0].strip() if output else None
+
+
+def host_info():
+    return {
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'ffmpeg': tool_version(['ffmpeg', '-version']),
+        'handbrake': tool_version(['HandBrakeCLI', '--version']) if shutil.which('HandBrakeCLI') else None,
+    }
+
+
+def bench_scan(library_dir, work_dir):
+    # parse_videos with a plain walk, then with a library index cold and warm
+    index_path = os.path.join(work_dir, 'index.sqlite')
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    videos, walk_seconds = timed(parse_videos, library_dir)
+    index = LibraryIndex(index_path)
+    _, cold_seconds = timed(parse_videos, library_dir, index)
+    _, warm_seconds = timed(parse_videos, library_dir, index)
+    index.close()
+    return sorted(videos), {'videos': len(videos), 'walk_seconds': walk_seconds,
+                            'index_cold_seconds': cold_seconds, 'index_warm_seconds': warm_seconds}
+
+
+def bench_probe(videos, work_dir):
+    # get_video_info one file at a time without a cache, then probe_videos with a cache cold and warm
+    infos = {}
+    per_file = {}
+    for video_path in videos:
+        infos[video_path], per_file[os.path.basename(video_path)] = timed(get_video_info, video_path)
+    cache_path = os.path.join(work_dir, 'probe_cache.sqlite')
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    cache = ProbeCache(cache_path)
+    _, cold_seconds = timed(lambda: list(probe_videos(videos, cache=cache)))
+    _, warm_seconds = timed(lambda: list(probe_videos(videos, cache=cache)))
+    cache.close()
+    return infos, {'serial_seconds': sum(per_file.values()), 'per_file_seconds': per_file,
+                   'parallel_cold_seconds': cold_seconds, 'parallel_warm_seconds': warm_seconds}
+
+
+def bench_plan(infos):
+    # get_export_bitrate plus estimate_new_file_size, the per-file planning the GUI and server do
+    def plan_all():
+        for video_info in infos.values():
+            estimate_new_file_size(video_info, get_export_bitrate(video_info))
+    _, seconds = timed(lambda: [plan_all() for _ in range(PLAN_REPEATS)])
+    # plan_exports over one long list, how a server run or a table change re-plans a library
+    batch = list(infos.values()) * PLAN_REPEATS
+    _, batch_seconds = timed(plan_exports, batch)
+    return {'files': len(infos), 'repeats': PLAN_REPEATS, 'seconds': seconds,
+            'microseconds_per_file': seconds / (PLAN_REPEATS * max(len(infos), 1)) * 1e6,
+            'batch_seconds': batch_seconds, 'batch_microseconds_per_file': batch_seconds / max(len(batch), 1) * 1e6}
+
+
+def bench_encode(video_path, video_info, backend, use_codec, run_dir, threads=None):
+    """
+    Encodes a copy of the clip with convert_selected_video, then times copy_exif_data,
+    update_timestamp and rename_with_rollback on the result, like process_video_job.
+    """
+    work_copy = os.path.join(run_dir, os.path.basename(video_path))
+    shutil.copy2(video_path, work_copy)
+    export_settings = get_export_bitrate(video_info, use_codec=use_codec)
+    output_file = os.path.join(run_dir, f"{os.path.splitext(os.path.basename(video_path))[0]}_new.mp4")
+    entry = {'tier': export_settings['tier'], 'bitrate': export_settings['new_bitrate']}
+    try:
+        _, entry['encode_seconds'] = timed(
+            convert_selected_video, work_copy, export_settings, use_ffmpeg=backend == 'ffmpeg',
+            use_codec=use_codec, output_file=output_file, threads=threads, video_info=video_info,
+        )
+    except (subprocess.CalledProcessError, RuntimeError, OSError) as e:
+        entry['error'] = str(e)
+        return entry
+    frames = (video_info.fps or 0) * (video_info.duration or 0)
+    entry['fps'] = frames / entry['encode_seconds'] if entry['encode_seconds'] else None
+    entry['realtime'] = video_info.duration / entry['encode_seconds'] if entry['encode_seconds'] else None
+    entry['output_mb'] = os.path.getsize(output_file) / 1e6
+    entry['compression'] = (1 - entry['output_mb'] / video_info.size_mb) * 100
+
+    _, entry['exif_seconds'] = timed(copy_exif_data, work_copy, output_file)
+    _, entry['timestamp_seconds'] = timed(update_timestamp, work_copy, output_file)
+    _, entry['rename_seconds'] = timed(rename_with_rollback, work_copy, old_file_new_name(work_copy), output_file)
+    return entry
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time scanning, probing, planning, encoding and metadata/rename on synthetic clips, "
+                    "one per resolution and frame rate bucket, and write the results as JSON."
+    )
+    parser.add_argument('--out', default=None,
+                        help="Results file ('-' for stdout, default benchmark_<host>_<time>.json in the current folder)")
+    parser.add_argument('--clips-dir', default=os.path.join(tempfile.gettempdir(), 'compress_vid_benchmark'),
+                        help="Where the synthetic clips are kept between runs (default: in the temp folder)")
+    parser.add_argument('--seconds', type=float, default=2.0, help="Clip length (default 2)")
+    parser.add_argument('--buckets', nargs='*', default=None,
+                        help="Only these buckets, e.g. 1080p/30 4k/60 1080p/30/portrait (default all)")
+    parser.add_argument('--patterns', nargs='*', choices=PATTERNS, default=PATTERNS, help="Lavfi sources to use (default both)")
+    parser.add_argument('--no-portrait', action='store_true', help="Leave out the portrait clips")
+    parser.add_argument('--backends', nargs='*', choices=['ffmpeg', 'handbrake'], default=None,
+                        help="Encoders to time (default: every one installed)")
+    parser.add_argument('--codec', choices=CODEC_CHOICES, default=AUTO_BACKEND,
+                        help="Encoder backend, auto picks the best one installed (default auto)")
+    parser.add_argument('--threads', type=int, default=None, help="Cap on threads per encode")
+    parser.add_argument('--no-encode', action='store_true', help="Only time scanning, probing and planning")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    buckets = list_buckets(not args.no_portrait)
+    if args.buckets:
+        unknown = set(args.buckets) - set(name for name, _, _, _ in buckets)
+        if unknown:
+            print(f"Unknown buckets: {', '.join(sorted(unknown))}")
+            return 2
+        buckets = [bucket for bucket in buckets if bucket[0] in args.buckets]
+    backends = args.backends
+    if backends is None:
+        backends = ['ffmpeg'] + (['handbrake'] if shutil.which('HandBrakeCLI') else [])
+
+    # Clips live in a library folder of their own so the scan only sees them
+    library_dir = os.path.join(args.clips_dir, 'library')
+    os.makedirs(library_dir, exist_ok=True)
+    clips = {}
+    for name, width, height, fps in buckets:
+        for pattern in args.patterns:
+            file_name = f"{name.replace('/', '_')}_{pattern}_{args.seconds:g}s.mp4"
+            clips[make_clip(os.path.join(library_dir, file_name), pattern, width, height, fps, args.seconds)] = (name, pattern)
+
+    results = dict(host_info(), started=datetime.datetime.now().isoformat(timespec='seconds'),
+                   settings={'seconds': args.seconds, 'patterns': args.patterns, 'codec': args.codec,
+                             'threads': args.threads, 'backends': backends})
+    work_dir = tempfile.mkdtemp(prefix='compress_vid_benchmark_')
+    try:
+        print("Timing library scan...")
+        videos, results['scan'] = bench_scan(library_dir, work_dir)
+        videos = [video for video in videos if video in clips]
+        print("Timing probes...")
+        infos, results['probe'] = bench_probe(videos, work_dir)
+        print("Timing planning...")
+        results['plan'] = bench_plan(infos)
+
+        results['encode'] = []
+        if not args.no_encode:
+            for backend in backends:
+                for video_path in videos:
+                    bucket, pattern = clips[video_path]
+                    print(f"Timing {backend} encode of {bucket} {pattern}...")
+                    run_dir = tempfile.mkdtemp(dir=work_dir)
+                    entry = bench_encode(video_path, infos[video_path], backend, args.codec, run_dir, args.threads)
+                    results['encode'].append(dict(entry, backend=backend, bucket=bucket, pattern=pattern))
+                    shutil.rmtree(run_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+
+    for entry in results['encode']:
+        if 'error' in entry:
+            print(f"{entry['backend']:9} {entry['bucket']:18} {entry['pattern']:10} failed: {entry['error']}")
+        else:
+            print(f"{entry['backend']:9} {entry['bucket']:18} {entry['pattern']:10} {entry['fps']:7.1f} fps "
+                  f"{entry['realtime']:5.2f}x realtime {entry['compression']:6.1f}% smaller")
+
+    out = args.out or f"benchmark_{platform.node() or 'host'}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    if out == '-':
+        print(json.dumps(results, indent=2))
+    else:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
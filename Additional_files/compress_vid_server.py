@@ -1,118 +1,428 @@
-import subprocess
-import datetime
 import os
-from compress_vid import *
-
-
-ffmpeg_settings = {
-    '4k': {
-        '30': {
-            'vt_h265': {
-                'LQ': '25',
-                'HQ': '60'
-            },
-        },
-        '60': {
-            'vt_h265': {
-                'LQ': '30',
-                'HQ': '70'
-            },
-        },
-        '120': {
-            'vt_h265': {
-                'LQ': '50',  # These are hypothetical values
-                'HQ': '100'  # Adjust them as per the actual quality settings required
-            },
-        },
-    },
-    '1080p': {
-        '30': {
-            'vt_h265': {
-                'LQ': '8',
-                'HQ': '15'
-            },
-        },
-        '60': {
-            'vt_h265': {
-                'LQ': '10',
-                'HQ': '20'
-            },
-        },
-        '120': {
-            'vt_h265': {
-                'LQ': '20',  # These are hypothetical values
-                'HQ': '40'   # Adjust them as per the actual quality settings required
-            },
-        },
-    }
-}
+import sys
+import json
+import argparse
 
+# The core functions live next to compress_vid.py, one folder up; compress_core doesn't need PyQt5
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compress_core import *
+
+# Exit codes, so cron and schedulers can tell a clean run from a partial one
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+
+
+def codec_rule(text):
+    # FOLDER=BACKEND or STARS=BACKEND for --folder-codec and --rating-codec
+    key, sep, backend = text.rpartition('=')
+    if not sep or not key or backend not in ENCODER_BACKENDS:
+        raise argparse.ArgumentTypeError(f"expected X=BACKEND with BACKEND one of {', '.join(ENCODER_BACKENDS)}, got {text!r}")
+    return key, backend
+
+
+def add_codec_rule_args(parser):
+    # Shared with encode_farm.py's coordinator, whose plans come from plan_video
+    parser.add_argument('--folder-codec', type=codec_rule, action='append', default=[], metavar='FOLDER=BACKEND',
+                        help="Encode videos under FOLDER with BACKEND instead of --codec, the closest folder wins (repeatable)")
+    parser.add_argument('--rating-codec', type=codec_rule, action='append', default=[], metavar='STARS=BACKEND',
+                        help="Encode videos rated STARS or more with BACKEND, e.g. 5=plain to keep 5-star videos in HEVC "
+                             "while --codec svtav1 archives the rest; --folder-codec comes first (repeatable)")
+
+
+def codec_rules(args):
+    # --folder-codec and --rating-codec as the dicts codec_for_video takes, ValueError if a rating isn't a number
+    folder_codecs = {os.path.abspath(folder): backend for folder, backend in args.folder_codec}
+    try:
+        rating_codecs = {int(stars): backend for stars, backend in args.rating_codec}
+    except ValueError:
+        raise ValueError("--rating-codec takes a whole number of stars, e.g. 5=plain")
+    return folder_codecs, rating_codecs
+
+
+def set_codec_rules(parser, args):
+    # Done while parsing, so every caller of parse_args (e.g. process_video_server) has args.folder_codecs and args.rating_codecs
+    try:
+        args.folder_codecs, args.rating_codecs = codec_rules(args)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def video_codec(video_path, video_info, args):
+    # The backend to plan and encode this video with, 'auto' resolved once here for the encoder program
+    # so the table column, CRF and encode all belong to the same encoder
+    return backend_for(codec_for_video(video_path, video_info, args.codec, args.folder_codecs, args.rating_codecs),
+                       args.backend == 'ffmpeg')
 
-def main():
-    input_folder = input("Enter the path to the folder containing videos: ")
-    if not os.path.exists(input_folder):
-        print("The specified folder does not exist.")
-        return
 
-    videos = parse_videos(input_folder)
-    if not videos:
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Batch compress videos without the GUI. Probes, plans and encodes every video under the given folders."
+    )
+    parser.add_argument('roots', nargs='*', help="Library folders to scan (prompted for if none are given)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help=f"Concurrent encodes (default {ENCODE_JOBS}, or the tuned count with --codec plain, see tune_x265.py)")
+    parser.add_argument('--threads', type=int, default=None, help="Cap on threads per encode (default: encoder decides)")
+    parser.add_argument('--split-long', type=int, default=None, metavar='N',
+                        help=f"Encode videos of {SPLIT_MIN_DURATION // 60} minutes or more as N segments at a time (uses ffmpeg)")
+    parser.add_argument('--probe-workers', type=int, default=PROBE_WORKERS, help=f"Concurrent probes (default {PROBE_WORKERS})")
+    parser.add_argument('--backend', choices=['handbrake', 'ffmpeg'], default='handbrake', help="Encoder program (default handbrake)")
+    parser.add_argument('--codec', choices=CODEC_CHOICES, default=AUTO_BACKEND,
+                        help="Encoder backend: VideoToolbox, NVENC, x265, SVT-AV1, x264 or libaom; auto picks the first "
+                             "of those this host can encode with (default auto)")
+    add_codec_rule_args(parser)
+    parser.add_argument('--force-hq', action='store_true', help="Use the HQ bitrate for every file")
+    parser.add_argument('--bitrate', type=float, default=None, help="Override the target bitrate in Mb/s for every file")
+    parser.add_argument('--rate-control', choices=RATE_CONTROLS, default='abr',
+                        help="abr: one pass at the table bitrate; crf: constant quality per LQ/HQ, sizes vary with the "
+                             "content; twopass: two passes at the table bitrate, for an exact size (default abr)")
+    parser.add_argument('--max-bitrate-factor', type=float, default=None, metavar='F',
+                        help="With --rate-control crf, cap the bitrate at F times the table bitrate (VBV max rate)")
+    parser.add_argument('--target-quality', choices=['ssim', 'psnr'], default=None,
+                        help="Pick each file's bitrate by sample encodes against a per-rating quality floor instead of the table")
+    parser.add_argument('--min-compression', type=float, default=10.0,
+                        help="Skip files whose estimated compression is below this percentage (default 10)")
+    parser.add_argument('--predict', action='store_true',
+                        help="Estimate output size and encode time from short trial encodes instead of bitrate x duration")
+    parser.add_argument('--min-mb-saved-per-minute', type=float, default=None,
+                        help="With --predict, skip files that would save less than this many MB per minute of encoding")
+    parser.add_argument('--abort-below', type=float, default=5.0, metavar='PCT',
+                        help="Stop an encode once its projected savings drop below this percentage and skip the file "
+                             "on later runs (default 5)")
+    parser.add_argument('--no-early-abort', action='store_true', help="Always let encodes run to the end")
+    parser.add_argument('--hevc-sources', choices=['remux', 'skip', 'encode'], default='remux',
+                        help="HEVC files already at or below the target bitrate: copy the streams into an mp4 "
+                             "(mp4 files are left alone), skip them, or re-encode them anyway (default remux)")
+    parser.add_argument('--delete-originals', action='store_true', help="Delete the _OLD file after a successful conversion")
+    parser.add_argument('--dry-run', action='store_true', help="Probe and plan only, don't encode")
+    parser.add_argument('--results', default=None, help="Write one JSON result per file to this path ('-' for stdout)")
+    parser.add_argument('--no-cache', action='store_true', help="Don't use the on-disk probe cache")
+    parser.add_argument('--watch', action='store_true',
+                        help="After the first pass keep running and compress new videos once they stop changing")
+    parser.add_argument('--settle-seconds', type=float, default=SETTLE_SECONDS,
+                        help=f"With --watch, how long a file's size and mtime must stay the same (default {SETTLE_SECONDS})")
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS,
+                        help=f"With --watch, rescan interval when inotify isn't available (default {POLL_SECONDS})")
+    parser.add_argument('--no-inotify', action='store_true', help="With --watch, poll even on Linux (e.g. for NFS/SMB mounts)")
+    parser.add_argument('--no-index', action='store_true',
+                        help="List every folder again instead of trusting the library index (for filesystems that don't update folder mtimes)")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL_PATH,
+                        help="Job journal used to resume after a crash (default: next to compress_core.py)")
+    parser.add_argument('--no-journal', action='store_true', help="Don't record or resume from the job journal")
+    return set_codec_rules(parser, parser.parse_args(argv))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    roots = args.roots
+    if not roots:
+        roots = [input("Enter the path to the folder containing videos: ")]
+    missing = [root for root in roots if not os.path.isdir(root)]
+    if missing:
+        for root in missing:
+            print(f"The specified folder does not exist: {root}")
+        return EXIT_USAGE
+    problem = backend_problem(args.codec)
+    if problem and not args.dry_run:
+        print(f"--codec {args.codec}: {problem}")
+        return EXIT_USAGE
+    for backend in set(args.folder_codecs.values()) | set(args.rating_codecs.values()):
+        if backend_problem(backend) and not args.dry_run:
+            print(f"{backend}: {backend_problem(backend)}")
+            return EXIT_USAGE
+    if args.rate_control == 'crf' and (args.bitrate is not None or args.target_quality):
+        print("--rate-control crf picks its own bitrate, it can't be combined with --bitrate or --target-quality")
+        return EXIT_USAGE
+    if not problem:
+        backend, use_ffmpeg = resolve_backend(args.codec, args.backend == 'ffmpeg')
+        print(f"Encoding with {ENCODER_BACKENDS[backend]['ffmpeg' if use_ffmpeg else 'handbrake']}")
+    if args.jobs is None:
+        args.jobs = default_encode_jobs(args.codec)
+    if args.jobs < 1:
+        print("--jobs must be at least 1")
+        return EXIT_USAGE
+
+    journal = None
+    if not args.no_journal and not args.dry_run:
+        journal = JobJournal(args.journal)
+        # Outputs of encodes that were running when an earlier run died are incomplete,
+        # encodes that finished only need their metadata and renames
+        journal.clean_partial_outputs()
+        resume_unfinished_jobs(journal)
+
+    # The index only lists folders that changed since the last run and pairs up the _OLD files as it goes
+    videos = []
+    old_pairs = {}
+    index = LibraryIndex()
+    for root in roots:
+        root_videos, root_pairs = index.scan(root, full=args.no_index)
+        videos.extend(root_videos)
+        old_pairs.update(root_pairs)
+    index.close()
+    if not videos and not args.watch:
         print("No video files found in the specified folder.")
-        return
+        return EXIT_OK
+
+    results_file = None
+    if args.results == '-':
+        results_file = sys.stdout
+    elif args.results:
+        results_file = open(args.results, 'a')
+
+    def write_result(result):
+        if results_file is not None:
+            results_file.write(json.dumps(result) + "\n")
+            results_file.flush()
+
+    if not args.watch:
+        encoded, failed, skipped = run_batch(videos, old_pairs, args, journal, write_result)
+        print(f"{encoded} encoded, {failed} failed, {skipped} skipped")
+    else:
+        # Files already in the library are handled first, then new ones as they land
+        encoded, failed, skipped = run_batch(videos, old_pairs, args, journal, write_result)
+        watcher = FolderWatcher(roots, args.settle_seconds, poll_seconds=args.poll_seconds,
+                                use_inotify=not args.no_inotify, ignore=is_reserved_output)
+        print("Watching for new videos, Ctrl+C to stop")
+        try:
+            for batch in watcher.batches():
+                print(f"{len(batch)} new videos ready")
+                batch_old_pairs = find_old_pairs(list_folder_videos(batch))
+                batch_encoded, batch_failed, batch_skipped = run_batch(batch, batch_old_pairs, args, journal, write_result)
+                encoded += batch_encoded
+                failed += batch_failed
+                skipped += batch_skipped
+                print(f"{encoded} encoded, {failed} failed, {skipped} skipped since start")
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        watcher.close()
+
+    if journal is not None:
+        journal.close()
+    if results_file is not None and results_file is not sys.stdout:
+        results_file.close()
+    return EXIT_FAILURES if failed else EXIT_OK
+
 
-    for video in videos:
-        process_video_server(video)
+def run_batch(videos, old_pairs, args, journal=None, write_result=None):
+    """
+    Skips, probes, plans and encodes a list of videos with the same steps process_video_server runs for one file.
+    Returns (encoded, failed, skipped) counts.
+    """
+    write_result = write_result or (lambda result: None)
 
-def process_video_server(video_path):
+    cache = None if args.no_cache else ProbeCache()
+
+    # Skip _OLD files and files that already have one before spending time probing them
+    to_probe = []
+    for video_path in videos:
+        reason = skip_reason(video_path, journal, old_pairs, cache)
+        if reason:
+            print(f"Skipping {video_path}: {reason}")
+            write_result({'input_file': video_path, 'status': 'skipped', 'reason': reason})
+        else:
+            to_probe.append(video_path)
+
+    probed = list(probe_videos(to_probe, args.probe_workers, cache=cache))
+    exports = table_exports(probed, args)
+    jobs = []
+    for video_path, video_info in probed:
+        job, reason = plan_video(video_path, video_info, args, cache, exports.get(video_path))
+        if job is None:
+            print(f"Skipping {video_path}: {reason}")
+            write_result({'input_file': video_path, 'status': 'skipped', 'reason': reason,
+                          'video_info': video_info.to_dict() if video_info else None})
+        else:
+            jobs.append(job)
+    if cache is not None:
+        cache.print_stats()
+        cache.evict(PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_MAX_AGE_DAYS)
+
+    jobs.sort(key=lambda job: job['input_file'])
+    for counter, job in enumerate(jobs, 1):
+        job['label'] = f"{os.path.basename(job['input_file'])} - {counter}/{len(jobs)}"
+
+    if args.dry_run:
+        for job in jobs:
+            if job['export_settings'].get('stream_copy'):
+                print(f"Would remux {job['input_file']} into an mp4 without re-encoding")
+            else:
+                export_settings = job['export_settings']
+                if export_settings.get('rate_control') == 'crf':
+                    how = f"at {describe_rate_control(export_settings)}"
+                else:
+                    how = f"at {export_settings['new_bitrate']:.1f} Mb/s"
+                    if export_settings.get('rate_control') == 'twopass':
+                        how += " in two passes"
+                print(f"Would encode {job['input_file']} with {export_settings['new_codec']} {how} "
+                      f"({job['compression_ratio']:.1f}% estimated compression)")
+            write_result(job_result(job, 'planned'))
+        if cache is not None:
+            cache.close()
+        return 0, 0, len(videos) - len(jobs)
+
+    failures = 0
+    not_worth_it = 0
+    tracker = ProgressTracker(ConsoleProgressPrinter())
+    for job, result in encode_videos(jobs, args.jobs, args.threads, tracker=tracker, journal=journal):
+        if result['success']:
+            print(f"Successfully processed and renamed {job['input_file']}")
+            status = 'encoded'
+        elif result.get('not_worth_it'):
+            # Remembered so later runs don't spend the same time finding out again
+            not_worth_it += 1
+            if cache is not None:
+                cache.mark_not_worth_it(job['input_file'], result['error'])
+            status = 'not_worth_it'
+        else:
+            failures += 1
+            print(f"Failed to process {job['input_file']}")
+            status = 'failed'
+        write_result(job_result(job, status, result))
+    print_tier_summary(tracker)
+    if cache is not None:
+        cache.close()
+    return len(jobs) - failures - not_worth_it, failures, len(videos) - len(jobs) + not_worth_it
+
+
+def skip_reason(video_path, journal=None, old_pairs=None, cache=None):
     # Check if the video filename contains "_OLD"
-    if '_OLD' in os.path.basename(video_path):
-        print(f"Skipping {video_path} as it is marked as an _OLD file.")
-        return
+    if is_old_name(video_path):
+        return "marked as an _OLD file"
+
+    # Check if a corresponding _OLD file exists, old_pairs comes from LibraryIndex.scan or find_old_pairs
+    if old_pairs is None:
+        old_pairs = find_old_pairs(list_folder_videos([video_path]))
+    if video_path in old_pairs:
+        return "an _OLD version already exists"
+
+    # Converted by an earlier run whose original has since been deleted
+    if journal is not None and journal.is_finished(video_path):
+        return "already converted (job journal)"
+
+    # An earlier encode of this exact file was stopped because it wasn't saving enough
+    if cache is not None:
+        reason = cache.not_worth_it(video_path)
+        if reason:
+            return f"not worth converting ({reason})"
+    return None
 
-    # Check if a corresponding _OLD file exists
-    base, ext = os.path.splitext(video_path)
-    old_file = base + '_OLD' + ext
-    if os.path.exists(old_file):
-        print(f"Skipping {video_path} as an _OLD version already exists.")
-        return
 
-    # Extract video information
-    video_info = get_video_info(video_path)
+def table_exports(probed, args):
+    # Table export settings for every probed file in one pass, {video_path: export_settings}
+    if args.target_quality:
+        return {}
+    probed = [(video_path, video_info) for video_path, video_info in probed if video_info]
+    exports = plan_exports([video_info for _, video_info in probed], args.force_hq,
+                           [video_codec(video_path, video_info, args) for video_path, video_info in probed])
+    return {video_path: export_settings for (video_path, _), export_settings in zip(probed, exports)}
+
+
+def plan_video(video_path, video_info, args, cache=None, export_settings=None):
+    # Returns (job, None), or (None, reason) if the file should be skipped.
+    # export_settings, if given, are the table settings from table_exports
     if not video_info:
-        print(f"Failed to retrieve info for {video_path}. Skipping.")
-        return
+        return None, "failed to retrieve video info"
+    use_codec = video_codec(video_path, video_info, args)
 
-    # Get export settings
-    export_settings = get_export_bitrate(video_info)
+    # Get export settings, measured from sample encodes if asked for
+    if args.target_quality:
+        export_settings = get_quality_export_bitrate(video_path, video_info, use_codec, args.target_quality, args.threads)
+    elif export_settings is None:
+        export_settings = get_export_bitrate(video_info, args.force_hq, use_codec)
+    if args.bitrate is not None:
+        export_settings['new_bitrate'] = args.bitrate
+    if export_settings['new_bitrate'] is None:
+        return None, export_settings['reason']
+    if export_settings.get('stream_copy'):
+        if args.bitrate is not None or args.hevc_sources == 'encode':
+            # Encoded like any other file
+            del export_settings['stream_copy']
+        elif args.hevc_sources == 'skip' or not needs_remux(video_path):
+            return None, f"already {video_info.video_codec} at {video_info.video_bitrate:.1f} Mb/s, no smaller than the target"
+    set_rate_control(export_settings, args.rate_control, use_codec, args.max_bitrate_factor)
 
-    # Estimate new file size and compression ratio
-    converted_file_data = estimate_new_file_size(video_info, export_settings)
-    if converted_file_data == "N/A":
-        print(f"Failed to estimate file size for {video_path}. Skipping.")
-        return
+    # Estimate new file size and compression ratio, from trial encodes if asked for
+    if args.predict:
+        converted_file_data = predict_new_file_size(video_path, video_info, export_settings, use_codec, cache, args.threads)
+    else:
+        converted_file_data = estimate_new_file_size(video_info, export_settings)
+    if converted_file_data is None:
+        return None, "failed to estimate file size"
 
-    compression_ratio = converted_file_data['compression_ratio'].rstrip('%')
-    if compression_ratio and float(compression_ratio) < 10:
-        print(f"Skipping {video_path} due to low compression ratio ({compression_ratio}%).")
-        return
+    compression_ratio = converted_file_data['compression_ratio']
+    # A remux saves nothing but only takes seconds, so the savings thresholds don't apply to it
+    if compression_ratio < args.min_compression and not export_settings.get('stream_copy'):
+        return None, f"low compression ratio ({compression_ratio:.1f}%)"
 
-    # Convert the video
-    new_file_path = convert_selected_video(video_path, export_settings, use_ffmpeg=False, use_codec='mac')
+    if args.min_mb_saved_per_minute is not None and converted_file_data.get('predicted'):
+        saved_mb = converted_file_data['size_mb'] - converted_file_data['new_file_size_mb']
+        per_minute = saved_mb / max(converted_file_data['encode_seconds'] / 60, 1e-6)
+        if per_minute < args.min_mb_saved_per_minute:
+            return None, f"saves only {per_minute:.1f} MB per minute of encoding"
 
-    # Copy EXIF data to the new file
-    copy_exif_data(video_path, new_file_path)
+    return {
+        'input_file': video_path,
+        'video_info': video_info,
+        'export_settings': export_settings,
+        'compression_ratio': compression_ratio,
+        'predicted_encode_seconds': converted_file_data.get('encode_seconds'),
+        'renamed_old_file_path': old_file_new_name(video_path),
+        'use_ffmpeg': args.backend == 'ffmpeg',
+        'use_codec': use_codec,
+        'split_workers': args.split_long,
+        'abort_below': None if args.no_early_abort else args.abort_below,
+        'delete_original': args.delete_originals,
+    }, None
 
-    # Update the timestamp of the new file
-    update_timestamp(video_path, new_file_path)
 
-    # Rename the original file with a backup name
-    renamed_old_file_path = old_file_new_name(video_path)
+def list_folder_videos(paths):
+    # Every video in the folders of paths, so new files can be paired with _OLD files already there
+    videos = []
+    for folder in sorted(set(os.path.dirname(path) for path in paths)):
+        try:
+            videos.extend(os.path.join(folder, name) for name in os.listdir(folder) if is_video_name(name))
+        except OSError:
+            continue
+    return videos
 
-    # Rename files with rollback on failure
-    if rename_with_rollback(video_path, renamed_old_file_path, new_file_path):
+
+def job_result(job, status, result=None):
+    return {
+        'input_file': job['input_file'],
+        'status': status,
+        'output_file': result['output_file'] if result else None,
+        'error': result['error'] if result else None,
+        'video_info': job['video_info'].to_dict(),
+        'export_settings': job['export_settings'],
+        'estimated_compression': job['compression_ratio'],
+        'predicted_encode_seconds': job.get('predicted_encode_seconds'),
+        'new_size_mb': os.path.getsize(result['output_file']) / 1e6 if result and result['success'] else None,
+        'elapsed_seconds': result['elapsed_seconds'] if result else None,
+    }
+
+
+def process_video_server(video_path, cache=None, args=None, journal=None):
+    # Plans and converts a single file, for use from other scripts
+    args = args or parse_args([])
+    reason = skip_reason(video_path, journal, cache=cache)
+    if reason:
+        print(f"Skipping {video_path}: {reason}")
+        return
+    job, reason = plan_video(video_path, get_video_info(video_path, cache), args)
+    if job is None:
+        print(f"Skipping {video_path}: {reason}")
+        return
+    result = process_video_job(job, journal=journal)
+    if result['success']:
         print(f"Successfully processed and renamed {video_path}")
+    elif result.get('not_worth_it'):
+        if cache is not None:
+            cache.mark_not_worth_it(video_path, result['error'])
     else:
         print(f"Failed to process {video_path}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -1,33 +1,22 @@
 import subprocess
 import datetime
 import os
+import sys
 import json
 import tkinter as tk
 from tkinter import filedialog
-from compress_vid import copy_exif_data, update_timestamp
+
+# The core functions live next to compress_vid.py, one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compress_core import copy_exif_data, update_timestamp, parse_videos
+from old_pairs import find_old_pairs
 
 
 
 def parse_videos_old(input_path):
-    print("Parsing videos in folder...")
-    extensions = ['.mp4', '.mkv', '.avi', '.mov']
-    videos_dict = {}
-
-    for root, dirs, files in os.walk(input_path):
-        for f in files:
-            if not f.startswith('.') and any(f.lower().endswith(ext) for ext in extensions):
-                video_path = os.path.join(root, f)
-                base_name, ext = os.path.splitext(f)
-
-                # Check if a video with "_OLD" exists without considering the extension
-                old_base_name = base_name + "_OLD"
-                for file in os.listdir(root):
-                    if file.startswith(old_base_name):
-                        old_version = os.path.join(root, file)
-                        videos_dict[video_path] = old_version
-                        break
-
-    return videos_dict
+    # Converted video -> its first _OLD file, the original from the camera (any extension on either side)
+    videos = parse_videos(input_path)
+    return {video: old_paths[0] for video, old_paths in find_old_pairs(videos).items()}
 
 
 
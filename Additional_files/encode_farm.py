@@ -0,0 +1,454 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The core functions live next to compress_vid.py, one folder up; compress_core doesn't need PyQt5
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compress_core import *
+from compress_vid_server import EXIT_OK, EXIT_FAILURES, EXIT_USAGE, skip_reason, plan_video, table_exports, \
+    add_codec_rule_args, set_codec_rules
+
+# A leased job goes back in the queue if its worker hasn't checked in for this long
+LEASE_SECONDS = 120
+# Jobs that fail or lose their worker this many times are given up on
+MAX_ATTEMPTS = 3
+# Coordinator options a worker needs to plan a job again for its own encoder, see replan_job
+PLAN_OPTIONS = ('force_hq', 'bitrate', 'rate_control', 'max_bitrate_factor', 'target_quality', 'min_compression',
+                'hevc_sources', 'no_early_abort', 'abort_below', 'delete_originals')
+
+
+class JobBoard:
+    """
+    The coordinator's job list. Workers lease jobs, renew the lease while they encode
+    and report back; leases that expire are handed out again.
+    """
+
+    def __init__(self, jobs, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.lock = threading.Lock()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.entries = {
+            str(job_id): {'job': job, 'state': 'pending', 'worker': None, 'expires': None, 'attempts': 0, 'result': None}
+            for job_id, job in enumerate(jobs)
+        }
+        self.finished = threading.Event()
+        if not self.entries:
+            self.finished.set()
+
+    def expire_leases_locked(self):
+        now = time.time()
+        for job_id, entry in self.entries.items():
+            if entry['state'] == 'leased' and entry['expires'] < now:
+                print(f"Lease on job {job_id} from {entry['worker']} expired")
+                self.retry_or_fail_locked(job_id, entry, "lease expired")
+
+    def retry_or_fail_locked(self, job_id, entry, error):
+        entry['worker'] = None
+        entry['expires'] = None
+        if entry['attempts'] >= self.max_attempts:
+            entry['state'] = 'failed'
+            entry['result'] = {'input_file': entry['job']['input_file'], 'success': False, 'error': error}
+            self.check_finished_locked()
+        else:
+            entry['state'] = 'pending'
+
+    def check_finished_locked(self):
+        if all(entry['state'] in ('done', 'failed') for entry in self.entries.values()):
+            self.finished.set()
+
+    def lease(self, worker):
+        # Returns (job_id, job), or (None, None) if nothing is available right now
+        with self.lock:
+            self.expire_leases_locked()
+            for job_id, entry in self.entries.items():
+                if entry['state'] == 'pending':
+                    entry['state'] = 'leased'
+                    entry['worker'] = worker
+                    entry['expires'] = time.time() + self.lease_seconds
+                    entry['attempts'] += 1
+                    print(f"Leased job {job_id} ({os.path.basename(entry['job']['input_file'])}) to {worker}")
+                    return job_id, entry['job']
+        return None, None
+
+    def renew(self, job_id, worker):
+        # False if the lease was lost, in which case the worker should give the job up
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry is None or entry['state'] != 'leased' or entry['worker'] != worker:
+                return False
+            entry['expires'] = time.time() + self.lease_seconds
+            return True
+
+    def complete(self, job_id, worker, result):
+        with self.lock:
+            entry = self.entries.get(job_id)
+            if entry is None or entry['state'] != 'leased' or entry['worker'] != worker:
+                return False
+            if result.get('success') or result.get('not_worth_it') or result.get('skipped'):
+                # A file that isn't worth converting won't become worth it on another node, nor will one a worker skipped
+                entry['state'] = 'done'
+                entry['result'] = result
+                entry['worker'] = None
+                self.check_finished_locked()
+            else:
+                print(f"Job {job_id} failed on {worker}: {result.get('error')}")
+                self.retry_or_fail_locked(job_id, entry, result.get('error'))
+                if entry['state'] == 'failed':
+                    entry['result'] = result
+            return True
+
+    def status(self):
+        with self.lock:
+            self.expire_leases_locked()
+            counts = {}
+            for entry in self.entries.values():
+                counts[entry['state']] = counts.get(entry['state'], 0) + 1
+            return {'jobs': len(self.entries), 'counts': counts, 'finished': self.finished.is_set()}
+
+
+def job_to_wire(job):
+    # VideoInfo isn't JSON, workers rebuild it with VideoInfo.from_dict
+    return dict(job, video_info=job['video_info'].to_dict())
+
+def job_from_wire(job):
+    return dict(job, video_info=VideoInfo.from_dict(job['video_info']))
+
+
+def make_handler(board):
+    class CoordinatorHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload=None):
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def do_GET(self):
+            if self.path == '/status':
+                self.send_json(200, board.status())
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            try:
+                request = self.read_json()
+            except ValueError:
+                self.send_json(400, {'error': 'invalid JSON'})
+                return
+            worker = request.get('worker', self.client_address[0])
+            if self.path == '/lease':
+                job_id, job = board.lease(worker)
+                if job is None:
+                    self.send_json(200, {'job_id': None, 'finished': board.finished.is_set()})
+                else:
+                    self.send_json(200, {'job_id': job_id, 'job': job_to_wire(job), 'lease_seconds': board.lease_seconds})
+            elif self.path == '/renew':
+                self.send_json(200, {'ok': board.renew(request.get('job_id'), worker)})
+            elif self.path == '/complete':
+                self.send_json(200, {'ok': board.complete(request.get('job_id'), worker, request.get('result', {}))})
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            # Leases and completions are printed by the JobBoard, skip the per-request access log
+            pass
+
+    return CoordinatorHandler
+
+
+def build_jobs(roots, args):
+    videos = []
+    old_pairs = {}
+    index = LibraryIndex()
+    for root in roots:
+        root_videos, root_pairs = index.scan(root)
+        videos.extend(root_videos)
+        old_pairs.update(root_pairs)
+    index.close()
+    cache = ProbeCache()
+    to_probe = []
+    for video_path in videos:
+        reason = skip_reason(video_path, old_pairs=old_pairs, cache=cache)
+        if reason:
+            print(f"Skipping {video_path}: {reason}")
+        else:
+            to_probe.append(video_path)
+
+    probed = list(probe_videos(to_probe, args.probe_workers, cache=cache))
+    exports = table_exports(probed, args)
+    jobs = []
+    plan_options = {option: getattr(args, option) for option in PLAN_OPTIONS}
+    for video_path, video_info in probed:
+        job, reason = plan_video(video_path, video_info, args, cache, exports.get(video_path))
+        if job is None:
+            print(f"Skipping {video_path}: {reason}")
+        else:
+            # The coordinator may not have the encoders, 'auto' is resolved again by each worker
+            job['requested_codec'] = codec_for_video(video_path, video_info, args.codec, args.folder_codecs, args.rating_codecs)
+            job['plan_options'] = plan_options
+            jobs.append(job)
+    cache.print_stats()
+    cache.close()
+    jobs.sort(key=lambda job: job['input_file'])
+    return jobs
+
+
+def run_coordinator(args):
+    missing = [root for root in args.roots if not os.path.isdir(root)]
+    if missing:
+        for root in missing:
+            print(f"The specified folder does not exist: {root}")
+        return EXIT_USAGE
+    # Backends are checked by the workers, the coordinator may not have any encoder installed
+    if args.rate_control == 'crf' and (args.bitrate is not None or args.target_quality):
+        print("--rate-control crf picks its own bitrate, it can't be combined with --bitrate or --target-quality")
+        return EXIT_USAGE
+
+    jobs = build_jobs(args.roots, args)
+    board = JobBoard(jobs, args.lease_seconds)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(board))
+    print(f"Coordinating {len(jobs)} jobs on http://{args.host}:{server.server_address[1]}")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Wait for every job to finish, printing a status line now and then
+    while not board.finished.wait(30):
+        print(f"Status: {board.status()['counts']}")
+    # Give workers a moment to see that the batch is finished before shutting down
+    time.sleep(2)
+    server.shutdown()
+
+    failures = 0
+    not_worth_it = 0
+    skipped = 0
+    cache = ProbeCache()
+    results_file = open(args.results, 'a') if args.results else None
+    for entry in board.entries.values():
+        status = 'encoded' if entry['state'] == 'done' else 'failed'
+        if entry['state'] != 'done':
+            failures += 1
+        elif entry['result'].get('not_worth_it'):
+            # Marked under the coordinator's path, which is what the next build_jobs looks up
+            not_worth_it += 1
+            cache.mark_not_worth_it(entry['job']['input_file'], entry['result']['error'])
+            status = 'not_worth_it'
+        elif entry['result'].get('skipped'):
+            skipped += 1
+            status = 'skipped'
+        if results_file is not None:
+            results_file.write(json.dumps({
+                'input_file': entry['job']['input_file'],
+                'status': status,
+                'attempts': entry['attempts'],
+                'result': entry['result'],
+            }) + "\n")
+    cache.close()
+    if results_file is not None:
+        results_file.close()
+    print(f"{len(jobs) - failures - not_worth_it - skipped} encoded, {not_worth_it} stopped early, {skipped} skipped by workers, "
+          f"{failures} failed")
+    return EXIT_FAILURES if failures else EXIT_OK
+
+
+def post_json(url, payload, timeout=30):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def map_path(path, path_maps):
+    # Translates the coordinator's paths to this node's mount point, e.g. /volume1/videos=/mnt/nas/videos
+    for coordinator_prefix, worker_prefix in path_maps:
+        if path.startswith(coordinator_prefix):
+            return worker_prefix + path[len(coordinator_prefix):]
+    return path
+
+
+def replan_job(job, use_codec, use_ffmpeg, args):
+    """
+    Plans a job again for the backend this worker encodes with: the table bitrates, the stream
+    copy decision and the CRF all depend on the encoder, the coordinator planned for its own.
+    Returns (job, None), or (None, reason) if the file isn't worth encoding with this backend.
+    """
+    options = argparse.Namespace(
+        codec=use_codec, folder_codecs={}, rating_codecs={}, backend='ffmpeg' if use_ffmpeg else 'handbrake',
+        predict=False, min_mb_saved_per_minute=None, threads=args.threads, split_long=args.split_long,
+        **job['plan_options'],
+    )
+    replanned, reason = plan_video(job['input_file'], job['video_info'], options)
+    if replanned is None:
+        return None, reason
+    return dict(replanned, renamed_old_file_path=job['renamed_old_file_path']), None
+
+
+def worker_slot(args, worker, path_maps):
+    # One encode at a time per slot; run --jobs slots to encode several files on this node
+    failures = 0
+    while True:
+        try:
+            response = post_json(f"{args.coordinator}/lease", {'worker': worker})
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Coordinator unreachable ({e}), stopping")
+            return failures
+        if response['job_id'] is None:
+            if response.get('finished'):
+                return failures
+            time.sleep(args.poll_seconds)
+            continue
+
+        job_id = response['job_id']
+        job = job_from_wire(response['job'])
+        job['input_file'] = map_path(job['input_file'], path_maps)
+        job['renamed_old_file_path'] = map_path(job['renamed_old_file_path'], path_maps)
+        use_ffmpeg = args.backend == 'ffmpeg' if args.backend else job['use_ffmpeg']
+        use_codec = backend_for(args.codec or job.get('requested_codec', job['use_codec']), use_ffmpeg)
+
+        # A worker that lost its lease may have finished the file after all, don't encode it twice
+        input_file = job['input_file']
+        reason = skip_reason(input_file)
+        if reason is None and use_codec != job['use_codec']:
+            print(f"Planning {os.path.basename(job['input_file'])} again for {use_codec} (planned for {job['use_codec']})")
+            job, reason = replan_job(job, use_codec, use_ffmpeg, args)
+        if reason:
+            print(f"Skipping {input_file}: {reason}")
+            try:
+                post_json(f"{args.coordinator}/complete", {'worker': worker, 'job_id': job_id, 'result': {
+                    'input_file': input_file, 'success': False, 'skipped': True, 'error': reason}})
+            except (urllib.error.URLError, OSError) as e:
+                print(f"Could not report {input_file} to the coordinator: {e}")
+            continue
+        job['use_ffmpeg'] = use_ffmpeg
+        if args.threads:
+            job['threads'] = args.threads
+        if args.split_long:
+            job['split_workers'] = args.split_long
+
+        # Renew the lease in the background for as long as the encode runs. Once it is lost the job
+        # belongs to another worker, so the encode is stopped and nothing is renamed or reported
+        done = threading.Event()
+        lost = threading.Event()
+        def renew():
+            while not done.wait(response['lease_seconds'] / 3):
+                try:
+                    if not post_json(f"{args.coordinator}/renew", {'worker': worker, 'job_id': job_id})['ok']:
+                        print(f"Lost the lease on {job['input_file']}, stopping")
+                        lost.set()
+                        return
+                except (urllib.error.URLError, OSError):
+                    pass
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            result = process_video_job(job, stop_event=lost)
+        finally:
+            done.set()
+            renewer.join()
+        if result.get('cancelled'):
+            continue
+        if not result['success']:
+            failures += 1
+        try:
+            post_json(f"{args.coordinator}/complete", {'worker': worker, 'job_id': job_id, 'result': result})
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Could not report {job['input_file']} to the coordinator: {e}")
+
+
+def run_worker(args):
+    path_maps = [tuple(mapping.split('=', 1)) for mapping in args.path_map]
+    host = args.name or socket.gethostname()
+    problem = backend_problem(args.codec or AUTO_BACKEND)
+    if problem:
+        print(f"Can't encode here: {problem}")
+        return EXIT_USAGE
+    if args.jobs is None:
+        # The coordinator picks the codec per job, a tuned profile only exists where x265 is used
+        args.jobs = default_encode_jobs(args.codec or AUTO_BACKEND)
+    failures = []
+    slots = [
+        threading.Thread(target=lambda slot=slot: failures.append(worker_slot(args, f"{host}:{os.getpid()}:{slot}", path_maps)))
+        for slot in range(args.jobs)
+    ]
+    for slot in slots:
+        slot.start()
+    for slot in slots:
+        slot.join()
+    return EXIT_FAILURES if sum(failures) else EXIT_OK
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Spread batch compression over several machines sharing the same library.")
+    subparsers = parser.add_subparsers(dest='role', required=True)
+
+    coordinator = subparsers.add_parser('coordinator', help="Plan the jobs and hand them out to workers")
+    coordinator.add_argument('roots', nargs='+', help="Library folders to scan")
+    coordinator.add_argument('--host', default='127.0.0.1', help="Address to listen on (default 127.0.0.1, use 0.0.0.0 for other nodes)")
+    coordinator.add_argument('--port', type=int, default=8765, help="Port to listen on (default 8765)")
+    coordinator.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS, help=f"Lease length (default {LEASE_SECONDS})")
+    coordinator.add_argument('--probe-workers', type=int, default=PROBE_WORKERS, help=f"Concurrent probes (default {PROBE_WORKERS})")
+    coordinator.add_argument('--backend', choices=['handbrake', 'ffmpeg'], default='handbrake', help="Default encoder program")
+    coordinator.add_argument('--codec', choices=CODEC_CHOICES, default=AUTO_BACKEND,
+                             help="Default encoder backend, auto lets each worker pick its best (default auto)")
+    add_codec_rule_args(coordinator)
+    coordinator.add_argument('--force-hq', action='store_true', help="Use the HQ bitrate for every file")
+    coordinator.add_argument('--bitrate', type=float, default=None, help="Override the target bitrate in Mb/s for every file")
+    coordinator.add_argument('--rate-control', choices=RATE_CONTROLS, default='abr',
+                             help="abr: one pass at the table bitrate; crf: constant quality; twopass: exact size (default abr)")
+    coordinator.add_argument('--max-bitrate-factor', type=float, default=None, metavar='F',
+                             help="With --rate-control crf, cap the bitrate at F times the table bitrate")
+    coordinator.add_argument('--target-quality', choices=['ssim', 'psnr'], default=None,
+                             help="Pick each file's bitrate by sample encodes against a per-rating quality floor")
+    coordinator.add_argument('--min-compression', type=float, default=10.0,
+                             help="Skip files whose estimated compression is below this percentage (default 10)")
+    coordinator.add_argument('--predict', action='store_true', help="Estimate output size and encode time from short trial encodes")
+    coordinator.add_argument('--min-mb-saved-per-minute', type=float, default=None,
+                             help="With --predict, skip files that would save less than this many MB per minute of encoding")
+    coordinator.add_argument('--abort-below', type=float, default=5.0, metavar='PCT',
+                             help="Stop an encode once its projected savings drop below this percentage (default 5)")
+    coordinator.add_argument('--no-early-abort', action='store_true', help="Always let encodes run to the end")
+    coordinator.add_argument('--hevc-sources', choices=['remux', 'skip', 'encode'], default='remux',
+                             help="HEVC files already at or below the target bitrate: copy the streams into an mp4, "
+                                  "skip them, or re-encode them anyway (default remux)")
+    coordinator.add_argument('--delete-originals', action='store_true', help="Delete the _OLD file after a successful conversion")
+    coordinator.add_argument('--results', default=None, help="Append one JSON result per file to this path")
+    # Splitting long files and thread caps depend on the worker's cores, so they are worker options
+    coordinator.set_defaults(split_long=None, threads=None)
+
+    worker = subparsers.add_parser('worker', help="Lease jobs from a coordinator and encode them")
+    worker.add_argument('coordinator', help="Coordinator URL, e.g. http://encode-head:8765")
+    worker.add_argument('-j', '--jobs', type=int, default=None,
+                        help=f"Concurrent encodes on this node (default {ENCODE_JOBS}, or the count tune_x265.py found for this node)")
+    worker.add_argument('--threads', type=int, default=None, help="Cap on threads per encode")
+    worker.add_argument('--split-long', type=int, default=None, metavar='N',
+                        help=f"Encode videos of {SPLIT_MIN_DURATION // 60} minutes or more as N segments at a time (uses ffmpeg)")
+    worker.add_argument('--backend', choices=['handbrake', 'ffmpeg'], default=None, help="Override the coordinator's encoder program")
+    worker.add_argument('--codec', choices=CODEC_CHOICES, default=None, help="Override the coordinator's encoder backend")
+    worker.add_argument('--path-map', action='append', default=[], metavar='COORDINATOR_PREFIX=LOCAL_PREFIX',
+                        help="Rewrite path prefixes when the library is mounted elsewhere on this node")
+    worker.add_argument('--poll-seconds', type=float, default=10, help="Wait between lease attempts when no job is free")
+    worker.add_argument('--name', default=None, help="Worker name reported to the coordinator (default: hostname)")
+    args = parser.parse_args(argv)
+    return set_codec_rules(parser, args) if args.role == 'coordinator' else args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.role == 'coordinator':
+        return run_coordinator(args)
+    args.coordinator = args.coordinator.rstrip('/')
+    return run_worker(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,13 @@
 import os
+import sys
 import tkinter as tk
 from tkinter import filedialog
 
+# The shared modules live next to compress_vid.py, one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library_index import is_video_name
+from old_pairs import find_old_pairs, is_old_name
+
 def format_size(size_in_bytes):
     # Convert to GB for sizes 1GB or more
     if size_in_bytes >= 1024 * 1024 * 1024:
@@ -44,14 +50,12 @@ def prompt_and_calculate_video_sizes():
         input_path = os.path.dirname(input_path)
 
 
-    extensions = ['.mp4', '.mkv', '.avi', '.mov']
-    # videos = [os.path.join(input_path, f) for f in os.listdir(input_path) if not f.startswith('.') and any(f.lower().endswith(ext) for ext in extensions)]
     videos = []
 
     # Recursively walk through folder and subfolders
     for root, dirs, files in os.walk(input_path):
         for file in files:
-            if not file.startswith('.') and any(file.lower().endswith(ext) for ext in extensions):
+            if is_video_name(file):
                 videos.append(os.path.join(root, file))
 
 
@@ -59,17 +63,12 @@ def prompt_and_calculate_video_sizes():
     size_compressed = 0
     count_converted = 0
 
-    # Process each video file
-    for video in videos:
-        if "_OLD" in video:
-            # print(video)
-            base_name = video.rsplit("_OLD", 1)[0]
-            new_version = base_name + ".mp4"
-            print(f"new_version: {new_version}")
-            if new_version in videos:
-                size_old += os.path.getsize(video)
-                size_compressed += os.path.getsize(new_version)
-                count_converted += 1
+    # Compare each converted video with its original, the first of its _OLD files
+    for new_version, old_versions in find_old_pairs(videos).items():
+        print(f"new_version: {new_version}")
+        size_old += os.path.getsize(old_versions[0])
+        size_compressed += os.path.getsize(new_version)
+        count_converted += 1
     
     try:
         compression_ratio = f'{round((1 - size_compressed / size_old) * 100, 1)}%' if size_old > 0 else "N/A"
@@ -82,7 +81,7 @@ def prompt_and_calculate_video_sizes():
     if delete_option == "y":
         count=0
         for video in videos:
-            if "_OLD" in video:
+            if is_old_name(video):
                 os.remove(video)
                 count+=1
         print(f"Deleted {count} '_OLD' files.")
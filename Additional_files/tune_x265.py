@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import datetime
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# The core functions live next to compress_vid.py, one folder up; compress_core doesn't need PyQt5
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compress_core import *
+from sample_encode import measure_quality
+from x265_profile import X265_PRESETS, host_profile_path, save_host_profile
+from benchmark import list_buckets, make_clip
+
+DEFAULT_BUCKETS = ['1080p/30', '4k/30']
+DEFAULT_PRESETS = ['veryfast', 'faster', 'fast', 'medium']
+# Frame threads of 0 leaves it to x265, which picks from the core count
+DEFAULT_FRAME_THREADS = [0, 1, 2, 4]
+# A faster preset is only taken if it loses at most this much SSIM against the slowest one tried
+MAX_SSIM_LOSS = 0.002
+
+
+def encode_clip(clip, video_info, output_file, preset, frame_threads, pools):
+    # Same video settings as convert_selected_video's ffmpeg command, without audio so only x265 is timed
+    export_settings = get_export_bitrate(video_info, use_codec='plain')
+    params = [f"pools={pools}"] + ([f"frame-threads={frame_threads}"] if frame_threads else [])
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-i', clip,
+        '-an',
+        '-c:v', 'libx265',
+        '-b:v', f"{float(export_settings['new_bitrate']) * 1000}k",
+        '-preset', preset,
+        '-x265-params', ':'.join(params + ['log-level=error']),
+        '-g', '60',
+        '-f', 'mp4',
+        output_file
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    return output_file
+
+
+def run_config(clips, infos, tmp_dir, preset, frame_threads, jobs, cpu_count, quality=False):
+    """
+    Encodes every clip once per job slot, jobs slots at a time, each with an equal share of the cores.
+    Returns aggregate frames per second over all slots, the output size against the target size
+    and, if quality is set, the lowest SSIM of the first slot's outputs.
+    """
+    pools = max(1, cpu_count // jobs)
+
+    def slot(index):
+        outputs = []
+        for clip_index, clip in enumerate(clips):
+            output_file = os.path.join(tmp_dir, f"slot{index}_clip{clip_index}.mp4")
+            outputs.append(encode_clip(clip, infos[clip], output_file, preset, frame_threads, pools))
+        return outputs
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        outputs = list(executor.map(slot, range(jobs)))[0]
+    elapsed = time.time() - started
+
+    frames = sum(infos[clip].fps * infos[clip].duration for clip in clips) * jobs
+    target_mb = sum(bitrate_to_size(infos[clip].duration, get_export_bitrate(infos[clip], use_codec='plain')['new_bitrate']) for clip in clips)
+    result = {
+        'preset': preset, 'frame_threads': frame_threads, 'pools': pools, 'jobs': jobs,
+        'fps': frames / elapsed,
+        'output_mb': sum(os.path.getsize(output) for output in outputs) / 1e6,
+        'target_mb': target_mb,
+    }
+    if quality:
+        result['ssim'] = min(
+            measure_quality(clip, 0, infos[clip].duration, output, 'ssim') for clip, output in zip(clips, outputs)
+        )
+    print(f"  {preset:9} frame-threads {frame_threads or 'auto':4} pools {pools:3} jobs {jobs}: "
+          f"{result['fps']:7.1f} fps, {result['output_mb']:.1f}/{target_mb:.1f} MB"
+          + (f", ssim {result['ssim']:.4f}" if quality else ""))
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find the libx265 preset, frame threads, thread pool size and number of concurrent encodes "
+                    "that get the most frames per second out of this machine, and save them as its profile. "
+                    "Software x265 encodes ('plain' codec) load the profile automatically."
+    )
+    parser.add_argument('--buckets', nargs='*', default=DEFAULT_BUCKETS,
+                        help=f"Sample clip buckets, see benchmark.py (default {' '.join(DEFAULT_BUCKETS)})")
+    parser.add_argument('--seconds', type=float, default=2.0, help="Sample clip length (default 2)")
+    parser.add_argument('--clips-dir', default=os.path.join(tempfile.gettempdir(), 'compress_vid_benchmark'),
+                        help="Where the sample clips are kept, shared with benchmark.py")
+    parser.add_argument('--presets', nargs='*', choices=X265_PRESETS, default=DEFAULT_PRESETS,
+                        help=f"Presets to try (default {' '.join(DEFAULT_PRESETS)})")
+    parser.add_argument('--max-ssim-loss', type=float, default=MAX_SSIM_LOSS,
+                        help=f"Largest SSIM drop accepted for a faster preset (default {MAX_SSIM_LOSS})")
+    parser.add_argument('--frame-threads', nargs='*', type=int, default=DEFAULT_FRAME_THREADS,
+                        help="Frame thread counts to try, 0 for x265's own choice (default 0 1 2 4)")
+    parser.add_argument('--jobs', nargs='*', type=int, default=None,
+                        help="Concurrent encode counts to try (default 1, 2, 4, ... up to half the cores)")
+    parser.add_argument('--out', default=None, help=f"Profile path (default {host_profile_path()})")
+    parser.add_argument('--dry-run', action='store_true', help="Measure and print, don't save the profile")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cpu_count = os.cpu_count() or 1
+    jobs_options = args.jobs
+    if not jobs_options:
+        jobs_options = [1]
+        while jobs_options[-1] * 2 <= max(1, cpu_count // 2):
+            jobs_options.append(jobs_options[-1] * 2)
+
+    buckets = {name: (width, height, fps) for name, width, height, fps in list_buckets()}
+    unknown = [name for name in args.buckets if name not in buckets]
+    if unknown:
+        print(f"Unknown buckets: {', '.join(unknown)}")
+        return 2
+    library_dir = os.path.join(args.clips_dir, 'library')
+    os.makedirs(library_dir, exist_ok=True)
+    # mandelbrot is the harder of the two patterns, closer to real footage for rate control
+    clips = [
+        make_clip(os.path.join(library_dir, f"{name.replace('/', '_')}_mandelbrot_{args.seconds:g}s.mp4"),
+                  'mandelbrot', *buckets[name], args.seconds)
+        for name in args.buckets
+    ]
+    infos = {clip: get_video_info(clip) for clip in clips}
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='compress_vid_tune_') as tmp_dir:
+        # Presets first, one encode at a time with x265's default threading
+        print("Presets:")
+        presets = sorted(args.presets, key=X265_PRESETS.index)
+        preset_results = [run_config(clips, infos, tmp_dir, preset, 0, 1, cpu_count, quality=True) for preset in presets]
+        results.extend(preset_results)
+        reference = preset_results[-1]['ssim']
+        preset = next(result['preset'] for result in preset_results if result['ssim'] >= reference - args.max_ssim_loss)
+        print(f"Using preset {preset} (ssim within {args.max_ssim_loss} of {presets[-1]})")
+
+        # Then how to split the cores between frame threads and concurrent encodes
+        print("Threading:")
+        threading_results = [
+            run_config(clips, infos, tmp_dir, preset, frame_threads, jobs, cpu_count)
+            for jobs in jobs_options
+            for frame_threads in args.frame_threads
+        ]
+        results.extend(threading_results)
+    best = max(threading_results, key=lambda result: result['fps'])
+
+    profile = {
+        'host': socket.gethostname(),
+        'cpu_count': cpu_count,
+        'tuned_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'clips': [os.path.basename(clip) for clip in clips],
+        'preset': preset,
+        'frame_threads': best['frame_threads'],
+        'pools': best['pools'],
+        'jobs': best['jobs'],
+        'fps': best['fps'],
+        'results': results,
+    }
+    print(f"Best: preset {preset}, frame-threads {best['frame_threads'] or 'auto'}, pools {best['pools']}, "
+          f"{best['jobs']} concurrent encodes, {best['fps']:.1f} fps")
+    if args.dry_run:
+        return 0
+    print(f"Profile saved to {save_host_profile(profile, args.out)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1150 @@
+import subprocess
+import datetime
+import os
+import sys
+import json
+import time
+import threading
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from probe_cache import ProbeCache
+from exiftool_client import get_exiftool
+from encode_progress import ProgressTracker, ConsoleProgressPrinter, format_progress, parse_ffmpeg_progress, parse_handbrake_progress
+from sample_encode import predict_encode, quality_floor, search_bitrate
+from segment_encode import SPLIT_MIN_DURATION, encode_in_segments
+from library_index import LibraryIndex, is_video_name
+from old_pairs import find_old_pairs, is_old_name
+from folder_watch import FolderWatcher, SETTLE_SECONDS, POLL_SECONDS
+from job_journal import DEFAULT_JOURNAL_PATH, JobJournal, remove_partial_output, stage_done
+from export_planner import ExportPlanner
+from x265_profile import load_host_profile, x265_ffmpeg_args, x265_params
+from rate_control import RATE_CONTROLS, TWO_PASS_ENCODERS, NVENC_MULTIPASS, CrfSizeModel, describe_rate_control, ffmpeg_rate_args, \
+    handbrake_rate_args
+from encoder_registry import ENCODER_BACKENDS, AUTO_BACKEND, CODEC_CHOICES, backend_problem, best_backend, backend_for, resolve_backend, \
+    table_codec, table_formats, usable_backends
+
+# Bitrates in Mb/s per encoder (table_codec names), encoders without a column use one with the same output
+# (libaom-av1 uses svt_av1's). SVT-AV1 needs about two thirds of vt_h265's bitrate for the same quality, x264 half as much again
+ffmpeg_settings = {
+    '4k': {
+        '30': {'vt_h265': { 'LQ': 25, 'HQ': 60 }, 'svt_av1': { 'LQ': 16, 'HQ': 40 }, 'x264': { 'LQ': 38, 'HQ': 90 }, },
+        '60': {'vt_h265': { 'LQ': 30, 'HQ': 70 }, 'svt_av1': { 'LQ': 20, 'HQ': 46 }, 'x264': { 'LQ': 45, 'HQ': 105 }, },
+        '120': {'vt_h265': { 'LQ': 50, 'HQ': 100 }, 'svt_av1': { 'LQ': 32, 'HQ': 65 }, 'x264': { 'LQ': 75, 'HQ': 150 }, },
+    },
+    '2.7k': { 
+        '30': {'vt_h265': {'LQ': 16, 'HQ': 37 }, 'svt_av1': { 'LQ': 10, 'HQ': 24 }, 'x264': { 'LQ': 24, 'HQ': 55 }, },
+        '60': {'vt_h265': { 'LQ': 20, 'HQ': 45 }, 'svt_av1': { 'LQ': 13, 'HQ': 29 }, 'x264': { 'LQ': 30, 'HQ': 68 }, },
+        '120': {'vt_h265': { 'LQ': 35, 'HQ': 70 }, 'svt_av1': { 'LQ': 23, 'HQ': 45 }, 'x264': { 'LQ': 52, 'HQ': 105 }, },
+    },
+    '1080p': {
+        '30': {'vt_h265': {'LQ': 8,'HQ': 15 }, 'svt_av1': { 'LQ': 5, 'HQ': 10 }, 'x264': { 'LQ': 12, 'HQ': 22 }, },
+        '60': {'vt_h265': { 'LQ': 10, 'HQ': 20 }, 'svt_av1': { 'LQ': 6.5, 'HQ': 13 }, 'x264': { 'LQ': 15, 'HQ': 30 }, },
+        '120': {'vt_h265': { 'LQ': 20, 'HQ': 40 }, 'svt_av1': { 'LQ': 13, 'HQ': 26 }, 'x264': { 'LQ': 30, 'HQ': 60 }, },
+    }
+}
+
+
+class VideoInfo:
+    """
+    Probe result for one video, kept numeric from ffprobe through planning and encoding.
+    Bitrates are in Mb/s, sizes in MB and durations in seconds; text is only produced for display.
+    """
+    __slots__ = ('video_codec', 'width', 'height', 'video_bitrate', 'fps', 'duration', 'size_mb', 'rating', 'mtime')
+
+    def __init__(self, video_codec, width, height, video_bitrate, fps, duration, size_mb, rating, mtime):
+        self.video_codec = video_codec
+        self.width = width
+        self.height = height
+        self.video_bitrate = video_bitrate  # None if the stream doesn't report one
+        self.fps = fps
+        self.duration = duration
+        self.size_mb = size_mb
+        self.rating = rating  # None if the file has no XMP rating
+        self.mtime = mtime
+
+    @property
+    def dimensions(self):
+        return f"{self.width}x{self.height}"
+
+    @property
+    def duration_str(self):
+        # HH:MM:SS without the fractional seconds
+        return str(datetime.timedelta(seconds=int(self.duration)))
+
+    @property
+    def date_modified(self):
+        return datetime.datetime.fromtimestamp(self.mtime).strftime('%-d %b %Y')
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def __repr__(self):
+        return f"VideoInfo({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+def parse_frame_rate(fps_frac):
+    # ffprobe reports frame rates as fractions, e.g. "30000/1001"
+    try:
+        numerator, denominator = map(int, fps_frac.split('/'))
+        return float(numerator) / float(denominator)
+    except ValueError:
+        # Handle the case where the FPS is not a fraction (which is rare)
+        return float(fps_frac)
+    except ZeroDivisionError:
+        return None
+
+
+def get_video_info(input_path, cache=None):
+    # Skip ffprobe and exiftool entirely if the file hasn't changed since it was last probed
+    if cache is not None:
+        cached = cache.get(input_path)
+        if cached is not None:
+            return VideoInfo.from_dict(cached)
+
+    ## FFPROBE INFO
+    # One ffprobe call for the video stream and container: codec, dimensions, bitrate, fps, duration and file size
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,bit_rate,r_frame_rate',
+        '-show_entries', 'format=duration,size',
+        '-print_format', 'json',
+        input_path
+    ]
+
+    # Execute the ffprobe command
+    try:
+        probe = json.loads(subprocess.check_output(cmd, stderr=subprocess.PIPE))
+    except subprocess.CalledProcessError as e:
+        print(f"Error: {e.stderr.decode('utf-8', errors='replace')}")
+        probe = {}
+    except ValueError:
+        print(f"Error: could not parse ffprobe output for {input_path}")
+        probe = {}
+
+    streams = probe.get('streams') or [{}]
+    stream = streams[0]
+    container = probe.get('format', {})
+
+    # Missing fields fall back to the same defaults as before rather than failing the whole row
+    video_codec = stream.get('codec_name', 'h264')
+    width = int(stream.get('width', 1))
+    height = int(stream.get('height', 1))
+    fps = parse_frame_rate(stream.get('r_frame_rate', '1/1'))
+
+    video_bitrate = None
+    if str(stream.get('bit_rate', '')).isdigit():
+        video_bitrate = int(stream['bit_rate']) / 1e6
+
+    try:
+        duration = float(container.get('duration', 1))
+    except ValueError:
+        duration = 1.0
+
+    try:
+        size_mb = int(container.get('size', 1)) / 1e6
+    except ValueError:
+        size_mb = 1e-6
+
+    ##RATING
+    # Read the rating through the shared long-lived exiftool processes
+    try:
+        output, errors = get_exiftool().execute('-XMP:Rating', input_path)
+    except (OSError, RuntimeError) as e:
+        print(f"Error: exiftool did not complete successfully: {e}")
+        return None
+
+    if any(line.startswith('Error') for line in errors.splitlines()):
+        # Handle error if exiftool failed
+        print(f"Error: exiftool did not complete successfully: {errors.strip()}")
+        return None
+
+    # Assume output format: "XMP:Rating                        : <RatingValue>"
+    # Split the output and get the last element, which should be the rating
+    rating_str = output.strip().split(':')[-1].strip()
+    try:
+        rating = int(rating_str)
+    except ValueError:
+        rating = None
+
+    video_info = VideoInfo(
+        video_codec=video_codec,
+        width=width,
+        height=height,
+        video_bitrate=video_bitrate,
+        fps=fps,
+        duration=duration,
+        size_mb=size_mb,
+        rating=rating,
+        mtime=os.path.getmtime(input_path),
+    )
+
+    if cache is not None:
+        cache.put(input_path, video_info.to_dict())
+
+    return video_info
+
+# get_video_info(testfile)
+
+# ffmpeg_settings compiled for lookups, rebuild it if the table is changed at runtime
+export_planner = ExportPlanner(ffmpeg_settings, formats=table_formats())
+
+def get_export_bitrate(video_info, force_hq=False, use_codec=None, use_ffmpeg=False):
+    """
+    Returns the export settings ('new_bitrate', 'new_codec', 'tier') for a VideoInfo from ffmpeg_settings,
+    with use_codec's bitrates if the table has them (see table_codec), the vt_h265 ones otherwise.
+    If the table has no bitrate for the file, new_bitrate is None and 'reason' says why.
+    'stream_copy' is set for HEVC sources already at or about the table bitrate, see remux_video.
+    'auto' is the backend the encode will use with use_ffmpeg, see backend_for.
+    """
+    return export_planner.plan(video_info, force_hq, export_table_codec(use_codec, use_ffmpeg))
+
+def plan_exports(video_infos, force_hq=False, use_codec=None, use_ffmpeg=False):
+    # get_export_bitrate for a whole list of VideoInfo in one pass, use_codec can also be a list with one per VideoInfo
+    if isinstance(use_codec, list):
+        table_codecs = {codec: export_table_codec(codec, use_ffmpeg) for codec in set(use_codec)}
+        return export_planner.plan_many(video_infos, force_hq, [table_codecs[codec] for codec in use_codec])
+    return export_planner.plan_many(video_infos, force_hq, export_table_codec(use_codec, use_ffmpeg))
+
+def codec_for_video(video_path, video_info, use_codec, folder_codecs=None, rating_codecs=None):
+    """
+    The encoder backend for one video: the one in folder_codecs ({folder: backend}) for its closest
+    folder, else the one in rating_codecs ({stars: backend}, that rating and up, unrated counts as 0)
+    for the highest rating it reaches, else use_codec.
+    """
+    if folder_codecs:
+        folder = os.path.dirname(os.path.abspath(video_path))
+        while True:
+            if folder in folder_codecs:
+                return folder_codecs[folder]
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                break
+            folder = parent
+    if rating_codecs:
+        rating = video_info.rating if video_info is not None and video_info.rating is not None else 0
+        reached = [stars for stars in rating_codecs if rating >= stars]
+        if reached:
+            return rating_codecs[max(reached)]
+    return use_codec
+
+def export_table_codec(use_codec, use_ffmpeg=False):
+    # Table column for a use_codec option, None for the default one
+    if use_codec is None:
+        return None
+    return table_codec(backend_for(use_codec, use_ffmpeg))
+
+# Output sizes of finished CRF encodes, estimate_new_file_size uses them for files planned in CRF mode
+crf_size_model = CrfSizeModel()
+
+def set_rate_control(export_settings, rate_control, use_codec, max_bitrate_factor=None, use_ffmpeg=False):
+    """
+    Switches export settings from single-pass average bitrate ('abr', left as it is) to rate_control.
+    'crf' encodes at the backend's constant quality for the tier's LQ/HQ ('crf'), capped at
+    max_bitrate_factor times the table bitrate if given ('max_bitrate'); 'twopass' encodes at
+    new_bitrate in two passes. Stream copies and files without a bitrate are left alone. 'auto' is
+    resolved the way convert_selected_video does for use_ffmpeg, so the CRF is on the scale of the
+    encoder that runs. Returns export_settings.
+    """
+    if rate_control not in RATE_CONTROLS:
+        raise ValueError(f"Invalid rate control {rate_control!r}. Choose {', '.join(RATE_CONTROLS)}.")
+    if rate_control == 'abr' or export_settings.get('stream_copy') or export_settings.get('new_bitrate') is None:
+        return export_settings
+    export_settings['rate_control'] = rate_control
+    if rate_control == 'crf':
+        backend = ENCODER_BACKENDS[backend_for(use_codec, use_ffmpeg)]
+        quality = export_settings['tier'].rsplit('/', 1)[-1]
+        export_settings['crf'] = backend['crf'].get(quality, backend['crf']['LQ'])
+        export_settings['crf_encoder'] = backend['ffmpeg']
+        if max_bitrate_factor:
+            export_settings['max_bitrate'] = round(export_settings['new_bitrate'] * max_bitrate_factor, 2)
+    return export_settings
+
+def crf_resolution(export_settings):
+    # Resolution part of the tier, what the CRF size model is kept per
+    return export_settings['tier'].split('/', 1)[0]
+
+# Containers a stream copy wouldn't change, HEVC sources in these have nothing left to gain
+MP4_EXTENSIONS = ('.mp4', '.m4v')
+
+def needs_remux(input_file):
+    # True if a stream-copy source still has to be moved into an mp4, False if it can be left as it is
+    return os.path.splitext(input_file)[1].lower() not in MP4_EXTENSIONS
+
+def get_quality_export_bitrate(input_file, video_info, use_codec=AUTO_BACKEND, metric='ssim', threads=None):
+    """
+    Alternative to get_export_bitrate that picks the bitrate by measurement instead of the table.
+    A few sample windows are encoded at candidate bitrates up to the HQ table value and compared
+    with the source, and the lowest bitrate whose worst window meets quality_floor(rating) wins.
+    Falls back to get_export_bitrate if the samples can't be encoded or measured.
+    """
+    export_settings = get_export_bitrate(video_info, force_hq=True, use_codec=use_codec)
+    if export_settings.get('stream_copy'):
+        # Already HEVC at or below the highest bitrate the search would try, nothing to measure
+        return export_settings
+    # Files the table has no bitrate for are searched up to the source bitrate
+    max_bitrate = export_settings['new_bitrate'] or video_info.video_bitrate
+    if not max_bitrate:
+        return export_settings
+    floor = quality_floor(video_info.rating, metric)
+    print(f"Searching bitrate for {os.path.basename(input_file)} ({metric} floor {floor})")
+    try:
+        bitrate, score = search_bitrate(input_file, video_info.duration, get_encoders(use_codec)[1], max_bitrate, floor, metric,
+                                        ffmpeg_encoder_args(use_codec, threads))
+    except (subprocess.CalledProcessError, RuntimeError, OSError) as e:
+        print(f"Quality search failed ({e}), using the table bitrate")
+        return get_export_bitrate(video_info, use_codec=use_codec)
+    export_settings['new_bitrate'] = bitrate
+    export_settings['tier'] = f"{export_settings['tier'].rsplit('/', 1)[0]}/{metric}{floor}"
+    export_settings['quality'] = {'metric': metric, 'score': score, 'floor': floor}
+    return export_settings
+
+def bitrate_to_size(duration, bitrate_mbps):
+    """
+    Estimates the file size in MB based on the video duration and bitrate.
+    The duration is expected in seconds and the bitrate_mbps in Mbps.
+    """
+    if bitrate_mbps is None:
+        return None
+    return bitrate_mbps * duration * 0.125
+
+def estimate_new_file_size(video_info, export_settings):
+    new_bitrate = export_settings['new_bitrate']
+
+    # If no matching settings found, there is nothing to estimate
+    if not new_bitrate:
+        return None
+
+    # Estimate new file size, a stream copy comes out the same size as the source
+    crf_samples = None
+    if export_settings.get('stream_copy'):
+        new_file_size_mb = video_info.size_mb
+    elif export_settings.get('rate_control') == 'crf':
+        # CRF output depends on the content, use what earlier CRF encodes at this resolution came out at,
+        # the table bitrate until there are some; never above the ceiling or the source
+        learned, crf_samples = crf_size_model.estimate(export_settings['crf_encoder'], export_settings['crf'],
+                                                       crf_resolution(export_settings), video_info.width, video_info.height, video_info.fps)
+        new_bitrate = learned or new_bitrate
+        for cap in (export_settings.get('max_bitrate'), video_info.video_bitrate):
+            if cap:
+                new_bitrate = min(new_bitrate, cap)
+        new_file_size_mb = bitrate_to_size(video_info.duration, new_bitrate)
+    else:
+        new_file_size_mb = bitrate_to_size(video_info.duration, new_bitrate)
+
+    # Calculate compression ratio
+    try:
+        compression_ratio = 1 - (new_file_size_mb / video_info.size_mb)
+    except ZeroDivisionError:
+        compression_ratio = 0
+
+    converted_file_data = {
+        'new_file_size_mb': new_file_size_mb,
+        'new_bitrate': new_bitrate,
+        'size_mb': video_info.size_mb,
+        'compression_ratio': compression_ratio * 100  # Percent
+    }
+    if crf_samples is not None:
+        # Number of finished CRF encodes the estimate comes from, 0 if it is only the table bitrate
+        converted_file_data['crf_samples'] = crf_samples
+
+    return converted_file_data
+
+def prediction_key(export_settings, use_codec=AUTO_BACKEND):
+    # Predictions are cached per file under the encoder, its rate control arguments and the backend's own options
+    encoder_ffmpeg = get_encoders(use_codec)[1]
+    # Trial encodes use the job's rate control, two-pass samples are close enough to single-pass ones
+    rate_args = ffmpeg_rate_args(encoder_ffmpeg, export_settings)
+    settings_key = f"{encoder_ffmpeg}/{' '.join(rate_args)}" if export_settings.get('rate_control') == 'crf' \
+        else f"{encoder_ffmpeg}/{float(export_settings['new_bitrate']) * 1000:.0f}k"
+    # Without the thread cap, it doesn't change the size
+    encoder_args = ffmpeg_encoder_args(use_codec)
+    if encoder_args:
+        settings_key += f"/{' '.join(encoder_args)}"
+    return settings_key, encoder_ffmpeg, rate_args
+
+def apply_prediction(converted_file_data, prediction, video_info):
+    new_file_size_mb = prediction['new_file_size_mb']
+    try:
+        compression_ratio = 1 - (new_file_size_mb / video_info.size_mb)
+    except ZeroDivisionError:
+        compression_ratio = 0
+    converted_file_data.update({
+        'new_file_size_mb': new_file_size_mb,
+        'compression_ratio': compression_ratio * 100,
+        'encode_seconds': prediction['encode_seconds'],
+        'predicted': True,
+    })
+    return converted_file_data
+
+def predict_new_file_size(input_file, video_info, export_settings, use_codec=AUTO_BACKEND, cache=None, threads=None, allow_encode=True):
+    """
+    Like estimate_new_file_size, but from trial encodes of a few windows of the file (see predict_encode),
+    so audio, container overhead and rate control undershoot on static scenes are accounted for.
+    The result also has 'encode_seconds' and 'predicted'. Predictions are kept in cache, a ProbeCache;
+    with allow_encode=False only a cached prediction is used. Falls back to estimate_new_file_size.
+    """
+    converted_file_data = estimate_new_file_size(video_info, export_settings)
+    if converted_file_data is None or not video_info.duration or export_settings.get('stream_copy'):
+        return converted_file_data
+
+    settings_key, encoder_ffmpeg, rate_args = prediction_key(export_settings, use_codec)
+    prediction = cache.get_prediction(input_file, settings_key) if cache is not None else None
+    if prediction is None:
+        if not allow_encode:
+            return converted_file_data
+        try:
+            prediction = predict_encode(input_file, video_info.duration, encoder_ffmpeg,
+                                        float(export_settings['new_bitrate']) * 1000, ffmpeg_encoder_args(use_codec, threads),
+                                        rate_args=rate_args)
+        except (subprocess.CalledProcessError, OSError, ZeroDivisionError) as e:
+            print(f"Trial encode of {os.path.basename(input_file)} failed ({e}), using the bitrate estimate")
+            return converted_file_data
+        if cache is not None:
+            cache.put_prediction(input_file, settings_key, prediction)
+
+    return apply_prediction(converted_file_data, prediction, video_info)
+
+def cached_file_sizes(rows, cache=None):
+    """
+    predict_new_file_size with allow_encode=False for many files at once, rows is a list of
+    (input_file, video_info, export_settings, use_codec). The cached predictions are looked up
+    in one go (see ProbeCache.get_predictions), so this is cheap enough for the GUI thread.
+    """
+    estimates = [estimate_new_file_size(video_info, settings) for _, video_info, settings, _ in rows]
+    settings_keys = {}
+    for (input_file, video_info, settings, use_codec), estimate in zip(rows, estimates):
+        if estimate is not None and video_info.duration and not settings.get('stream_copy'):
+            settings_keys[input_file] = prediction_key(settings, use_codec)[0]
+    predictions = cache.get_predictions(settings_keys) if cache is not None and settings_keys else {}
+    for (input_file, video_info, _, _), estimate in zip(rows, estimates):
+        if input_file in predictions:
+            apply_prediction(estimate, predictions[input_file], video_info)
+    return estimates
+
+def parse_videos(input_path, index=None):
+    # With a LibraryIndex only the folders that changed since the last scan are listed
+    print("Parsing videos in folder...")
+    if index is not None:
+        return index.scan(input_path)[0]
+    videos = []
+    for root, dirs, files in os.walk(input_path):
+        for f in files:
+            if is_video_name(f):
+                videos.append(os.path.join(root, f))
+    return videos
+
+# ffprobe/exiftool spend most of their time starting up and waiting on disk, so a few more
+# workers than cores still helps, but too many just thrashes a NAS
+PROBE_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Probe cache limits, applied after each scan
+PROBE_CACHE_MAX_ENTRIES = 500000
+PROBE_CACHE_MAX_AGE_DAYS = 365
+
+def probe_videos(video_paths, max_workers=PROBE_WORKERS, stop_event=None, cache=None):
+    """
+    Runs get_video_info on a bounded pool of worker threads.
+    Yields (video_path, video_info) tuples as each probe finishes, in completion order.
+    Setting stop_event cancels the probes that have not started yet.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(get_video_info, video_path, cache): video_path for video_path in video_paths}
+        for future in as_completed(futures):
+            if stop_event is not None and stop_event.is_set():
+                break
+            video_path = futures[future]
+            try:
+                video_info = future.result()
+            except Exception as e:
+                print(f"Error probing {video_path}: {e}")
+                video_info = None
+            yield video_path, video_info
+    finally:
+        # Drop queued probes and don't wait for the ones still running when cancelled
+        executor.shutdown(wait=stop_event is None or not stop_event.is_set(), cancel_futures=True)
+
+class ProbeQueue:
+    """
+    Probes videos on a pool of worker threads, most urgent first. request() queues paths at a priority
+    (lower runs first) or moves ones already waiting up, forget() drops the waiting paths of some
+    priorities, e.g. rows that scrolled off screen before their turn. on_probed(video_path, video_info)
+    is called on a worker thread as each probe finishes, video_info is None if it failed. Every path
+    is probed at most once.
+    """
+
+    def __init__(self, on_probed, max_workers=PROBE_WORKERS, cache=None):
+        self.on_probed = on_probed
+        self.cache = cache
+        self.condition = threading.Condition()
+        # (priority, order, path) entries; an entry is stale once waiting has another priority for its path
+        self.heap = []
+        self.waiting = {}
+        self.started = set()
+        self.order = itertools.count()
+        self.closed = False
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def request(self, video_paths, priority):
+        with self.condition:
+            added = 0
+            for video_path in video_paths:
+                current = self.waiting.get(video_path)
+                if video_path in self.started or (current is not None and current <= priority):
+                    continue
+                self.waiting[video_path] = priority
+                heapq.heappush(self.heap, (priority, next(self.order), video_path))
+                added += 1
+            self.condition.notify(added)
+
+    def forget(self, priorities):
+        # Probes already running still finish
+        with self.condition:
+            self.waiting = {video_path: priority for video_path, priority in self.waiting.items() if priority not in priorities}
+            self.heap = [entry for entry in self.heap if self.waiting.get(entry[2]) == entry[0]]
+            heapq.heapify(self.heap)
+
+    def pending(self):
+        return len(self.waiting)
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.heap:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                priority, _, video_path = heapq.heappop(self.heap)
+                if self.waiting.get(video_path) != priority:
+                    continue
+                del self.waiting[video_path]
+                self.started.add(video_path)
+            try:
+                video_info = get_video_info(video_path, self.cache)
+            except Exception as e:
+                print(f"Error probing {video_path}: {e}")
+                video_info = None
+            self.on_probed(video_path, video_info)
+
+    def close(self):
+        # Drops the waiting paths and waits for the running probes, on_probed isn't called after this returns
+        with self.condition:
+            self.closed = True
+            self.heap = []
+            self.waiting = {}
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+def save_new_filename(input_filedir, reserved=()):
+    dir_name = os.path.dirname(input_filedir)
+    file_name = os.path.splitext(os.path.basename(input_filedir))[0]
+    extension = '.mp4'  # Since we want to convert all files to mp4
+    counter = 1
+
+    output_filedir = os.path.join(dir_name, f"{file_name}{extension}")
+
+    while os.path.exists(output_filedir) or output_filedir in reserved:
+        output_filedir = os.path.join(dir_name, f"{file_name} {counter}{extension}")
+        counter += 1
+    return output_filedir
+
+# Output names handed to encodes that are still running, so concurrent jobs
+# for e.g. clip.mov and clip.mts don't both write to clip.mp4
+_reserved_outputs = set()
+_reserved_outputs_lock = threading.Lock()
+
+def reserve_new_filename(input_filedir):
+    with _reserved_outputs_lock:
+        output_filedir = save_new_filename(input_filedir, _reserved_outputs)
+        _reserved_outputs.add(output_filedir)
+    return output_filedir
+
+def release_new_filename(output_filedir):
+    with _reserved_outputs_lock:
+        _reserved_outputs.discard(output_filedir)
+
+def is_reserved_output(path):
+    # True for outputs of running encodes, including the pieces of a split encode
+    if os.path.basename(os.path.dirname(path)).endswith('.segments'):
+        return True
+    with _reserved_outputs_lock:
+        return path in _reserved_outputs
+
+def get_encoders(use_codec):
+    # Returns the (HandBrakeCLI, ffmpeg) encoder names for the use_codec argument, 'auto' is the best on this host
+    if use_codec == AUTO_BACKEND:
+        use_codec = best_backend()
+    if use_codec not in ENCODER_BACKENDS:
+        raise ValueError(f"Invalid codec option. Choose {', '.join([AUTO_BACKEND] + list(ENCODER_BACKENDS))}.")
+    return ENCODER_BACKENDS[use_codec]['handbrake'], ENCODER_BACKENDS[use_codec]['ffmpeg']
+
+# Early abort only judges an encode once this much of it is done, the first seconds are often not typical
+ABORT_MIN_PERCENT = 15
+
+class EncodeNotWorthIt(RuntimeError):
+    """Raised by convert_selected_video when an encode was stopped because it wouldn't save enough."""
+
+class EncodeCancelled(RuntimeError):
+    """Raised inside process_video_job once its stop_event is set, the encoder is killed and nothing is renamed."""
+
+def ffmpeg_encoder_args(use_codec, threads=None):
+    # Options that go with the backend's ffmpeg encoder, for the whole-file and the segment encodes alike.
+    # They are output options, so they go after -c:v; a -threads before -i would only limit the decoder
+    args = []
+    if get_encoders(use_codec)[1] == 'libx265':
+        # Preset and threading from Additional_files/tune_x265.py if this host was tuned, threads still caps the pool
+        args += x265_ffmpeg_args(threads)
+    args += ENCODER_BACKENDS[use_codec].get('ffmpeg_args', [])
+    if threads:
+        # Limit this encode so several can share the machine
+        args += ['-threads', str(threads)]
+    return args
+
+def convert_selected_video(input_file, export_settings, use_ffmpeg=False, use_codec=AUTO_BACKEND, output_file=None, threads=None,
+                           video_info=None, on_progress=None, split_workers=None, abort_below=None):
+    """
+    Encodes input_file with ffmpeg or HandBrakeCLI and returns the output path. use_codec is an
+    ENCODER_BACKENDS name or 'auto'; a backend only the other program has is encoded with that one.
+    If on_progress is given it is called with a progress dict (percent, fps, speed, eta_seconds, bytes_out)
+    as the encoder reports it; video_info supplies the duration and frame rate used for percent and speed.
+    If split_workers is more than 1 and the video is at least SPLIT_MIN_DURATION long, it is cut into
+    segments that are encoded that many at a time with ffmpeg and joined again (see segment_encode.py).
+    If abort_below is set, the final size is projected from the output so far and the encode is killed,
+    its output deleted and EncodeNotWorthIt raised once it would save less than abort_below percent.
+    Export settings with 'stream_copy' set are remuxed with remux_video instead of encoded, and
+    'rate_control' (see set_rate_control) picks CRF or two-pass instead of single-pass average bitrate.
+    """
+    if output_file is None:
+        output_file = save_new_filename(input_file)
+    if export_settings.get('stream_copy'):
+        return remux_video(input_file, output_file, video_info, on_progress)
+    print("Converting video...")
+    if export_settings.get('new_bitrate') is None:
+        raise ValueError(export_settings.get('reason') or "no bitrate to encode at")
+
+    use_codec, use_ffmpeg = resolve_backend(use_codec, use_ffmpeg)
+    encoder_handbrake, encoder_ffmpeg = get_encoders(use_codec)
+
+    duration = video_info.duration if video_info is not None else None
+    if split_workers and split_workers > 1 and duration and duration >= SPLIT_MIN_DURATION:
+        # Segments always go through ffmpeg, HandBrakeCLI can't write pieces that join without re-encoding.
+        # Each segment gets one pass, two-pass segments would double the work for little
+        return encode_in_segments(
+            input_file, output_file, encoder_ffmpeg, float(export_settings['new_bitrate']) * 1000,
+            duration, split_workers, on_progress=on_progress,
+            rate_args=ffmpeg_rate_args(encoder_ffmpeg, export_settings),
+            encoder_args=ffmpeg_encoder_args(use_codec, threads),
+        )
+
+    two_pass = export_settings.get('rate_control') == 'twopass'
+    if two_pass:
+        # A two-pass encode lands on the planned size, so there is nothing to abort for
+        abort_below = None
+    passes = []
+    if use_ffmpeg:
+        # Build the FFmpeg command
+        cmd = [
+            'ffmpeg',
+            '-i', input_file,
+            '-c:v', encoder_ffmpeg,
+        ] + ffmpeg_rate_args(encoder_ffmpeg, export_settings) + [
+            '-f', 'mp4',
+            '-g', '60',  # Keyframe interval
+            '-vsync', 'cfr',  # Constant frame rate
+            '-map_metadata', '0',
+            '-progress', 'pipe:1', '-nostats',  # Machine-readable progress on stdout
+            output_file
+        ]
+        cmd[-1:-1] = ffmpeg_encoder_args(use_codec, threads)
+        if two_pass and encoder_ffmpeg in TWO_PASS_ENCODERS:
+            # The first pass only writes the stats file, audio and output are skipped
+            passlog = output_file + '.passlog'
+            cmd[-1:-1] = ['-pass', '2', '-passlogfile', passlog]
+            first_pass = cmd[:-1] + ['-an', '-y', os.devnull]
+            first_pass[first_pass.index('-pass') + 1] = '1'
+            first_pass[first_pass.index('-f') + 1] = 'null'
+            passes.append(first_pass)
+        elif two_pass and encoder_ffmpeg == 'hevc_nvenc':
+            cmd[-1:-1] = NVENC_MULTIPASS
+        elif two_pass:
+            print(f"{encoder_ffmpeg} has no two-pass mode, encoding in one pass")
+    else:
+        profile = load_host_profile() if encoder_handbrake == 'x265' else None
+        rate_args, rate_encopts = handbrake_rate_args(encoder_handbrake, export_settings)
+        # Build the HandbrakeCLI command
+        cmd = [
+            'HandBrakeCLI',
+            '-i', input_file,
+            '-o', output_file,
+            '-e', encoder_handbrake,
+        ] + rate_args + [
+            '-f', 'mp4',
+            '--encopts', ':'.join(['keyint=60'] + rate_encopts + (x265_params(threads, profile) if encoder_handbrake == 'x265' else [])),
+            '--optimize',
+            '--cfr',  # Constant frame rate
+            '--keep-display-aspect',  # Maintain aspect ratio
+            '--json',  # Progress as JSON blocks on stdout
+        ]
+        if profile:
+            cmd[-1:-1] = ['--encoder-preset', profile['preset']]
+
+    passes.append(cmd)
+    try:
+        for number, pass_cmd in enumerate(passes):
+            run_encode_pass(pass_cmd, input_file, output_file, use_ffmpeg, video_info, on_progress,
+                            abort_below if pass_cmd is cmd else None, (number, len(passes)))
+    finally:
+        if len(passes) > 1:
+            for name in os.listdir(os.path.dirname(os.path.abspath(output_file))):
+                if name.startswith(os.path.basename(output_file) + '.passlog'):
+                    os.remove(os.path.join(os.path.dirname(os.path.abspath(output_file)), name))
+    return output_file
+
+
+def run_encode_pass(cmd, input_file, output_file, use_ffmpeg, video_info=None, on_progress=None, abort_below=None, pass_number=(0, 1)):
+    # Runs one encoder command for convert_selected_video, reading progress from its stdout while it runs.
+    # pass_number is (this pass, number of passes), percent is reported across all of them
+    print(" ".join(cmd))
+    duration = video_info.duration if video_info is not None else None
+    source_fps = video_info.fps if video_info is not None else None
+    source_bytes = os.path.getsize(input_file)
+    number, count = pass_number
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, errors='replace')
+    if use_ffmpeg:
+        updates = parse_ffmpeg_progress(process.stdout, duration)
+    else:
+        updates = parse_handbrake_progress(process.stdout, source_fps)
+    try:
+        for progress in updates:
+            if progress['bytes_out'] is None and os.path.exists(output_file):
+                progress['bytes_out'] = os.path.getsize(output_file)
+            if on_progress is not None:
+                if count > 1:
+                    progress = dict(progress, percent=None if progress['percent'] is None else (number * 100 + progress['percent']) / count)
+                on_progress(progress)
+            if abort_below is not None and progress['bytes_out'] and (progress['percent'] or 0) >= ABORT_MIN_PERCENT \
+                    and progress['percent'] < 100:
+                # The output grows roughly in step with the input, so scale what's written so far
+                projected_bytes = progress['bytes_out'] / (progress['percent'] / 100)
+                projected_savings = (1 - projected_bytes / source_bytes) * 100
+                if projected_savings < abort_below:
+                    raise EncodeNotWorthIt(
+                        f"stopped at {progress['percent']:.0f}%, projected to save {projected_savings:.1f}% (< {abort_below:g}%)"
+                    )
+    except BaseException:
+        # Stopped early, or on_progress raised (e.g. EncodeCancelled): don't leave the encoder running
+        process.kill()
+        process.wait()
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"{cmd[0]} exited with code {process.returncode}")
+    return output_file
+
+
+def remux_video(input_file, output_file, video_info=None, on_progress=None):
+    """
+    Copies the video and audio streams of input_file into an mp4 without re-encoding, for sources that
+    are already HEVC at or below the target bitrate. Takes seconds where an encode takes the length of
+    the video. Data streams such as QuickTime timecode tracks are left out, mp4 can't hold them.
+    Returns the output path.
+    """
+    print("Remuxing video...")
+    cmd = [
+        'ffmpeg',
+        '-i', input_file,
+        '-map', '0:v:0', '-map', '0:a?',
+        '-c', 'copy',
+        '-tag:v', 'hvc1',  # The tag Apple players expect for HEVC in mp4
+        '-map_metadata', '0',
+        '-movflags', '+faststart',
+        '-f', 'mp4',
+        '-progress', 'pipe:1', '-nostats',
+        output_file
+    ]
+    print(" ".join(cmd))
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, errors='replace')
+    try:
+        for progress in parse_ffmpeg_progress(process.stdout, video_info.duration if video_info is not None else None):
+            if on_progress is not None:
+                on_progress(progress)
+    except BaseException:
+        # on_progress raised, e.g. EncodeCancelled
+        process.kill()
+        process.wait()
+        raise
+    process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}")
+    return output_file
+
+
+def copy_exif_data(original_file, new_file):
+    # Keys to copy
+    keys = {
+        'XMP:Rating': 'Rating',
+        'XML:DeviceManufacturer': 'Make',
+        'XML:DeviceModelName': 'Model',
+        'XML:DeviceSerialNo': 'SerialNumber',
+        'QuickTime:CameraLensModel': 'LensModel',
+        'QuickTime:CameraFocalLength35mmEquivalent': 'FocalLengthIn35mmFilm',
+        'QuickTime:Make': 'Make',
+        'QuickTime:Model': 'Model',
+        'QuickTime:Software': 'Software',
+        'QuickTime:CreateDate': 'DateTimeOriginal',
+        'Composite:GPSAltitude': 'GPSAltitude',
+        'Composite:GPSAltitudeRef': 'GPSAltitudeRef',
+        'Composite:GPSLatitude': 'GPSLatitude',
+        'Composite:GPSLongitude': 'GPSLongitude',
+        'Composite:Rotation': 'Rotation'    
+    }
+
+    simplified_keys = {key.split(':')[1]: value for key, value in keys.items()}
+
+    exiftool = get_exiftool()
+
+    # Read EXIF data from the original file
+    exif_data = exiftool.read_tags([original_file]).get(original_file)
+    if exif_data is None:
+        print(f"Warning: exiftool could not read {original_file}, metadata not copied")
+        return {}
+
+    print("Copying exif data...")
+
+    updated_keys_values = []
+    
+    command_write = ['-P', '-overwrite_original']
+
+    for full_key, simple_key in simplified_keys.items():
+        if full_key in exif_data:
+            value = exif_data[full_key]
+            if isinstance(value, str) and value.strip() == '':
+                continue  # Skip empty string values
+            # print(f'{full_key}:{value}:{simple_key}')
+            command_write.append(f'-{simple_key}={value}')
+            updated_keys_values.append((simple_key, value))
+
+
+    command_write.append(new_file)
+    # print(" ".join(command_write)) 
+    stdout, stderr = exiftool.execute(*command_write)
+
+    # Check the first line of the output to determine if the file was updated
+    first_line = stdout.strip().split('\n')[0] if stdout else ''
+    if "1 image files updated" in first_line:
+        print("The following keys and values have been updated:")
+        for key, value in updated_keys_values:
+            print(f'Updated {key} to {value}')
+    else:
+        print("No updates were made.")
+        if stderr:
+            print("Error:", stderr)
+
+    print("Exif data copied.")
+    return exif_data
+
+def update_timestamp(original_file, new_file):
+    print(f"Updating timestamp for: {os.path.basename(new_file)}")
+
+    # stat -f and SetFile only exist on macOS, elsewhere the modification time is set instead
+    if sys.platform != 'darwin':
+        update_timestamp_portable(original_file, new_file)
+        return
+
+    # Get the original creation time for comparison
+    read_create_date = subprocess.run(['stat', '-f', '%SB', original_file], capture_output=True, text=True)
+    # print(read_create_date.stdout.strip())
+    # Convert the birth time string to a datetime object
+    original_timestamp = datetime.datetime.strptime(read_create_date.stdout.strip(), "%b %d %H:%M:%S %Y")
+    print(f"Original (_OLD) file timestamp: {original_timestamp}")
+
+    # Try to get 'Create Date' from EXIF data
+    stdout, stderr = get_exiftool().execute('-CreateDate', '-d', '%Y:%m:%d %H:%M:%S', original_file)
+    create_date_str = stdout.strip().split(': ')[-1]  # Extract the date part
+    print(f"{os.path.basename(original_file)} create date is {create_date_str}")
+
+    if create_date_str:
+        try:
+            create_date = datetime.datetime.strptime(create_date_str, '%Y:%m:%d %H:%M:%S')
+            formatted_date = create_date.strftime("%m/%d/%Y %H:%M:%S")
+            setfile_command = ['SetFile', '-d', formatted_date, new_file]
+            subprocess.run(setfile_command, check=True)
+            print(f"'Create Date' set to: {formatted_date} based on EXIF DATA")
+        except ValueError:
+            print("Invalid EXIF 'Create Date'. Using fallback method.")
+            # Fallback method using stat and SetFile
+            creation_date = subprocess.check_output(
+                ['stat', '-f', '%SB', '-t', '%m/%d/%Y %H:%M:%S', original_file]
+            ).decode().strip()
+            setfile_command = ['SetFile', '-d', creation_date, new_file]
+            subprocess.run(setfile_command, check=True)
+            print(f"'Create Date' updated to {creation_date} using stat and SetFile from {original_file}")
+    else:
+        # Fallback to the original file's creation time using stat and SetFile
+        creation_date = subprocess.check_output(
+            ['stat', '-f', '%SB', '-t', '%m/%d/%Y %H:%M:%S', original_file]
+        ).decode().strip()
+        setfile_command = ['SetFile', '-d', creation_date, new_file]
+        subprocess.run(setfile_command, check=True)
+        print(f"EXIF data not found. 'Create Date' updated to {creation_date} using stat and SetFile from {original_file}")
+
+def update_timestamp_portable(original_file, new_file):
+    # Use the EXIF 'Create Date' if there is one, otherwise the original file's modification time
+    stdout, stderr = get_exiftool().execute('-CreateDate', '-d', '%Y:%m:%d %H:%M:%S', original_file)
+    create_date_str = stdout.strip().split(': ')[-1]
+    try:
+        timestamp = datetime.datetime.strptime(create_date_str, '%Y:%m:%d %H:%M:%S').timestamp()
+        source = "EXIF DATA"
+    except ValueError:
+        timestamp = os.path.getmtime(original_file)
+        source = f"the modification time of {original_file}"
+    os.utime(new_file, (timestamp, timestamp))
+    print(f"Timestamp set to {datetime.datetime.fromtimestamp(timestamp)} based on {source}")
+
+def old_file_new_name(input_path):
+    file_base, file_extension = os.path.splitext(input_path)
+    counter = 1
+    converted_file_name = f"{file_base}_OLD{file_extension}"
+    # Check if the file exists and increment the counter until an unused name is found
+    while os.path.exists(converted_file_name):
+        converted_file_name = f"{file_base}_OLD {counter}{file_extension}"
+        counter += 1
+    
+    return converted_file_name
+
+def rename_file(input_path, new_name):
+    try:
+        directory = os.path.dirname(input_path)
+        original_extension = os.path.splitext(input_path)[1]
+        new_name_without_extension = os.path.splitext(new_name)[0]
+        new_file_path = os.path.join(directory, new_name_without_extension + original_extension)
+        os.rename(input_path, new_file_path)
+        print(f"Renamed {os.path.basename(input_path)} to {os.path.basename(new_file_path)}")
+        return True
+    except Exception as e:
+        print(f"Failed to rename {os.path.basename(input_path)}: {e}")
+        return False
+
+def rename_with_rollback(original_file_path, intermediate_file_path, final_file_path):
+    # First, rename the original file to the intermediate path
+    if rename_file(original_file_path, intermediate_file_path):
+        # If the first rename succeeds, try the second rename
+        if rename_file(final_file_path, original_file_path):
+            return True
+        else:
+            # If the second rename fails, rollback the first rename
+            print("Second renaming operation failed, rolling back the first rename.")
+            rename_file(intermediate_file_path, original_file_path)
+    else:
+        print("First renaming operation failed.")
+    return False
+
+# Number of encodes run at once by encode_videos. Hardware encoders gain little from more
+# than one or two, software encoders can use more on a many-core machine
+ENCODE_JOBS = 1
+
+def default_encode_jobs(use_codec):
+    # Software x265 runs as many encodes at once as tune_x265.py found fastest on this host
+    if use_codec == AUTO_BACKEND:
+        use_codec = best_backend()
+    profile = load_host_profile() if use_codec == 'plain' else None
+    return profile['jobs'] if profile else ENCODE_JOBS
+
+def process_video_job(job, tracker=None, journal=None, stop_event=None):
+    """
+    Runs every step for one planned video: encode, copy metadata, update the timestamp,
+    swap the files with rename_with_rollback and optionally delete the original.
+    job is a dict with 'input_file' and 'export_settings', plus optional 'video_info', 'renamed_old_file_path',
+    'use_ffmpeg', 'use_codec', 'threads', 'split_workers', 'abort_below', 'delete_original' and 'label'.
+    Encode progress is reported to tracker, a ProgressTracker, if given.
+    If journal, a JobJournal, is given each step is recorded in it, and a file an earlier run
+    got partway through is resumed after its last recorded step.
+    Setting stop_event, a threading.Event, kills the encode at its next progress update and skips
+    the metadata and rename steps; the output is deleted and 'cancelled' is set in the result.
+    Returns a result dict with 'input_file', 'output_file', 'success', 'error' and 'elapsed_seconds',
+    plus 'not_worth_it' set to True if the encode was stopped early (see convert_selected_video's abort_below).
+    """
+    input_file = job['input_file']
+    result = {'input_file': input_file, 'output_file': None, 'success': False, 'error': None, 'elapsed_seconds': None}
+    started = time.time()
+    print(f"{'=' * 29} Processing {job.get('label', os.path.basename(input_file))} {'=' * 29}")
+
+    state = journal.state(input_file) if journal is not None else None
+    if state is not None and state['stage'] == 'encoding' and state.get('output_file'):
+        # The earlier encode was cut off, its output is incomplete
+        remove_partial_output(state['output_file'])
+    # An encoded output that has since gone missing means starting over
+    resuming = stage_done(state, 'encoded') and os.path.exists(state['output_file'])
+    if resuming:
+        # Keep the names the earlier run chose, the files on disk use them
+        renamed_old_file_path = state['renamed_old_file_path']
+        output_file = state['output_file']
+        with _reserved_outputs_lock:
+            _reserved_outputs.add(output_file)
+        print(f"Resuming after the '{state['stage']}' step")
+    else:
+        # Starting over, none of the earlier run's steps count
+        state = None
+        renamed_old_file_path = job.get('renamed_old_file_path') or old_file_new_name(input_file)
+        output_file = reserve_new_filename(input_file)
+    # The converted file ends up at the original name, with the output's extension
+    final_file = os.path.splitext(input_file)[0] + os.path.splitext(output_file)[1]
+
+    def record(stage, **fields):
+        if journal is not None:
+            journal.record(input_file, stage, **fields)
+
+    def check_stopped():
+        if stop_event is not None and stop_event.is_set():
+            raise EncodeCancelled("stopped before it finished")
+
+    video_info = job.get('video_info')
+    export_settings = job['export_settings']
+    try:
+        if not resuming:
+            record('encoding', output_file=output_file, renamed_old_file_path=renamed_old_file_path,
+                   delete_original=bool(job.get('delete_original')))
+            on_progress = None
+            if stop_event is not None:
+                on_progress = lambda progress: check_stopped()
+            if tracker is not None:
+                # Speeds are kept per encoder, tier and rate control, a two-pass encode takes about twice as long
+                tier = f"{export_settings.get('new_codec')} {export_settings.get('tier')}"
+                if export_settings.get('rate_control'):
+                    tier += f" {export_settings['rate_control']}"
+                tracker.start_job(
+                    input_file,
+                    os.path.getsize(input_file) if os.path.exists(input_file) else 0,
+                    video_info.duration if video_info is not None else None,
+                    'stream copy' if export_settings.get('stream_copy') else tier,
+                )
+                def on_progress(progress):
+                    tracker.update(input_file, progress)
+                    check_stopped()
+            convert_selected_video(
+                input_file,
+                export_settings,
+                use_ffmpeg=job.get('use_ffmpeg', False),
+                use_codec=job.get('use_codec', AUTO_BACKEND),
+                output_file=output_file,
+                threads=job.get('threads'),
+                video_info=video_info,
+                on_progress=on_progress,
+                split_workers=job.get('split_workers'),
+                abort_below=job.get('abort_below'),
+            )
+            if tracker is not None:
+                tracker.finish_job(input_file, os.path.getsize(output_file))
+            if export_settings.get('rate_control') == 'crf' and video_info is not None:
+                # Later CRF estimates at this resolution start from what this one came out at
+                crf_size_model.learn(export_settings['crf_encoder'], export_settings['crf'], crf_resolution(export_settings),
+                                     video_info.width, video_info.height, video_info.fps, video_info.duration,
+                                     os.path.getsize(output_file))
+            record('encoded')
+        result['output_file'] = output_file
+        check_stopped()
+
+        if not stage_done(state, 'metadata'):
+            copy_exif_data(input_file, output_file)
+            update_timestamp(input_file, output_file)
+            record('metadata')
+
+        if not os.path.exists(input_file) and os.path.exists(renamed_old_file_path):
+            # The earlier run died between the two renames, only the converted file still has to move
+            success = rename_file(output_file, input_file)
+        else:
+            success = rename_with_rollback(input_file, renamed_old_file_path, output_file)
+        print("Renaming operations completed successfully." if success else "Renaming operations failed or partially failed.")
+        result['success'] = success
+        if success:
+            result['output_file'] = final_file
+            record('renamed', final_file=final_file, final_size=os.path.getsize(final_file))
+
+        if success and job.get('delete_original'):
+            try:
+                os.remove(renamed_old_file_path)
+                print(f"Deleted original file: {renamed_old_file_path}")
+                record('deleted')
+            except OSError as e:
+                print(f"Error deleting file {renamed_old_file_path}: {e.strerror}")
+    except EncodeCancelled as e:
+        print(f"Stopped {os.path.basename(input_file)}: {e}")
+        result['error'] = str(e)
+        result['output_file'] = None
+        result['cancelled'] = True
+        remove_partial_output(output_file)
+        record('planned', output_file=None)
+    except EncodeNotWorthIt as e:
+        print(f"Not worth converting {os.path.basename(input_file)}: {e}")
+        result['error'] = str(e)
+        result['not_worth_it'] = True
+        record('planned', output_file=None)
+    except Exception as e:
+        print(f"Error processing {os.path.basename(input_file)}: {e}")
+        result['error'] = str(e)
+    finally:
+        release_new_filename(output_file)
+        result['elapsed_seconds'] = time.time() - started
+    return result
+
+def resume_unfinished_jobs(journal):
+    """
+    Finishes files an earlier run encoded but didn't get to rename, using the journal's record of them.
+    Run it before scanning, until it has run the half-renamed originals are missing and the outputs
+    look like new videos. Returns the process_video_job results.
+    """
+    results = []
+    for state in journal.unfinished():
+        job = {
+            'input_file': state['input_file'],
+            'export_settings': {},
+            'delete_original': state.get('delete_original', False),
+            'label': f"{os.path.basename(state['input_file'])} (resumed)",
+        }
+        results.append(process_video_job(job, journal=journal))
+    return results
+
+def print_tier_summary(tracker):
+    # Encode speed per ffmpeg_settings tier, to spot which resolution/fps bucket is the bottleneck
+    for tier, realtime in sorted(tracker.tier_summary().items(), key=lambda item: str(item[0])):
+        print(f"Tier {tier}: {f'{realtime:.2f}x realtime' if realtime else 'n/a'}")
+
+def encode_videos(jobs, max_jobs=ENCODE_JOBS, threads_per_encode=None, stop_event=None, tracker=None, journal=None):
+    """
+    Runs process_video_job for each job with up to max_jobs encodes at once.
+    threads_per_encode, if set, caps the threads each encoder may use.
+    Progress from every encode is reported to tracker, a ProgressTracker, if given,
+    and each step is recorded in journal, a JobJournal, if given.
+    Yields (job, result) tuples as each job finishes. Setting stop_event stops jobs
+    that have not started yet, running encodes are left to finish.
+    """
+    def run(job):
+        if stop_event is not None and stop_event.is_set():
+            return {'input_file': job['input_file'], 'output_file': None, 'success': False, 'error': 'cancelled', 'elapsed_seconds': None}
+        if threads_per_encode and not job.get('threads'):
+            job = dict(job, threads=threads_per_encode)
+        return process_video_job(job, tracker, journal)
+
+    if journal is not None:
+        for job in jobs:
+            # Files an earlier run got partway through keep their state so they resume
+            state = journal.state(job['input_file'])
+            if state is None or state['stage'] in ('renamed', 'deleted'):
+                journal.record(job['input_file'], 'planned')
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        futures = {executor.submit(run, job): job for job in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
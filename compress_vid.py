@@ -1,497 +1,30 @@
-import subprocess
-import datetime
-import os
-
-ffmpeg_settings = {
-    '4k': {
-        '30': {'vt_h265': { 'LQ': '25', 'HQ': '60' }, },
-        '60': {'vt_h265': { 'LQ': '30', 'HQ': '70' }, },
-        '120': {'vt_h265': { 'LQ': '50', 'HQ': '100' }, },
-    },
-    '2.7k': { 
-        '30': {'vt_h265': {'LQ': '16', 'HQ': '37' }, },
-        '60': {'vt_h265': { 'LQ': '20', 'HQ': '45' }, },
-        '120': {'vt_h265': { 'LQ': '35', 'HQ': '70' }, },
-    },
-    '1080p': {
-        '30': {'vt_h265': {'LQ': '8','HQ': '15' }, },
-        '60': {'vt_h265': { 'LQ': '10', 'HQ': '20' }, },
-        '120': {'vt_h265': { 'LQ': '20', 'HQ': '40' }, },
-    }
-}
-
-
-def get_video_info(input_path):
-    ## FFPROBE INFO
-    # ffprobe command to get video codec, dimensions, bitrate, fps, duration, and file size
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-select_streams', 'v:0',
-        '-show_entries', 'stream=codec_name,width,height,bit_rate,r_frame_rate',
-        '-show_entries', 'format=duration,size',  # Including format=size to get the file size
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        input_path
-    ]
-    # print("Pulling video information...")
-    # print(" ".join(cmd))
-
-    # Execute the ffprobe command
-    try:
-        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode('utf-8').strip().split('\n')
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e.output.decode('utf-8')}")
-        output = ['h264', '1', '1', '1/1', '1', '1', '1']
-    default_output = ['h264', '1', '1', '1/1', '1', '1', '1']
-
-    # Extracting the information from the output
-    try:
-        video_codec = output[0]
-    except IndexError:
-        video_codec = default_output[0]
-
-    try:
-        width = int(output[1])  # Convert to integer
-    except (IndexError, ValueError):  # Catch both index and value errors
-        width = int(default_output[1])  # Use default value if error occurs
-
-    try:
-        height = int(output[2])  # Convert to integer
-    except (IndexError, ValueError):  # Catch both index and value errors
-        height = int(default_output[2])  # Use default value if error occurs
-
-    try:
-        fps_frac = output[3]
-    except IndexError:
-        fps_frac = default_output[3]
-
-    try:
-        bitrate = output[4]
-    except IndexError:
-        bitrate = default_output[4]
-
-    try:
-        duration = float(output[5])
-    except (IndexError, ValueError):
-        duration = float(default_output[5])
-
-    try:
-        file_size = output[6]
-    except IndexError:
-        file_size = default_output[6]
-
-    # Calculating FPS from the fractional representation
-    fps = "N/A"
-    if fps_frac:
-        try:
-            numerator, denominator = map(int, fps_frac.split('/'))
-            fps = round(float(numerator) / float(denominator), 2)
-        except ValueError:
-            # Handle the case where the FPS is not a fraction (which is rare)
-            fps = float(fps_frac)
-
-    # Formatting dimensions
-    dimensions = f"{width}x{height}"
-
-    # Formatting bitrate as Mb/s if bitrate is available
-    video_bitrate = "N/A"
-    if bitrate and bitrate.isdigit():
-        video_bitrate = round(int(bitrate) / 1e6, 1)
-
-    # Formatting file size as MB
-    size_mb = round(float(file_size) / 1e6, 1)
-
-    # Formatting duration as HH:MM:SS
-    duration_str = str(datetime.timedelta(seconds=duration))
-
-    ##RATING
-    # Command to get the rating using exiftool
-    rating_cmd = ['exiftool', '-XMP:Rating', input_path]
-
-    # Run the command and capture the output
-    completed_process = subprocess.run(rating_cmd, stdout=subprocess.PIPE, text=True)
-
-    # Check if the command was successful
-    if completed_process.returncode == 0:
-        # Extract the rating from the output
-        output = completed_process.stdout.strip()
-
-        # Assume output format: "XMP:Rating                        : <RatingValue>"
-        # Split the output and get the last element, which should be the rating
-        rating = output.split(':')[-1].strip()
-
-    else:
-        # Handle error if exiftool failed
-        print("Error: exiftool did not complete successfully.")
-        return None
-    
-    # Get the file's last modification time
-    modification_time = os.path.getmtime(input_path)
-
-    # Convert the timestamp to a human-readable format
-    date_modified = datetime.datetime.fromtimestamp(modification_time).strftime('%-d %b %Y')
-
-    # Constructing the dictionary with the video information
-    video_info = {
-        'video_codec': video_codec,
-        'dimensions': dimensions,
-        'video_bitrate': video_bitrate,
-        'fps': fps,
-        'duration_str': duration_str,
-        'size_mb': size_mb,
-        'rating': rating,
-        'date_modified': date_modified
-    }
-
-    # Returning the constructed dictionary
-    return video_info
-
-# get_video_info(testfile)
-
-def get_export_bitrate(video_info, force_hq=False):
-    # Use the get_video_info function to get video parameters
-    # print("Getting export settings...")
-    try:
-        dimensions = video_info['dimensions']
-        fps = video_info['fps']
-        codec = 'vt_h265' #Pulling h265 no matter what #TODO
-        video_bitrate = video_info['video_bitrate']
-        rating_str = video_info['rating']
-        # Default quality
-        quality = 'LQ'
-        # Override quality if HQ is forced
-        if force_hq:
-            quality = 'HQ'
-    except:
-        pass
-
-    # Attempt to convert the rating to an integer if it's numeric
-    try:
-        rating = int(rating_str)
-        if rating >= 5:
-            quality = 'HQ'
-    except ValueError:
-        # If it's not a number, keep the default quality
-        pass
-    
-    # Define standard dimensions
-    WIDTH_4K, HEIGHT_4K = 3840, 2160
-    WIDTH_2_7K, HEIGHT_2_7K = 2704, 1520
-    WIDTH_1080P, HEIGHT_1080P = 1920, 1080
-
-    # Define tolerance
-    TOLERANCE = 0.10  # 10%
-
-    # Input dimensions
-    width, height = map(int, dimensions.split('x'))
-    resolution = None
-
-    # Check for 4K with tolerance
-    if ((WIDTH_4K * (1 - TOLERANCE)) <= width <= (WIDTH_4K * (1 + TOLERANCE)) and (HEIGHT_4K * (1 - TOLERANCE)) <= height <= (HEIGHT_4K * (1 + TOLERANCE))) or \
-    ((HEIGHT_4K * (1 - TOLERANCE)) <= width <= (HEIGHT_4K * (1 + TOLERANCE)) and (WIDTH_4K * (1 - TOLERANCE)) <= height <= (WIDTH_4K * (1 + TOLERANCE))):
-        resolution = '4k'
-    # Check for 2.7K with tolerance
-    elif ((WIDTH_2_7K * (1 - TOLERANCE)) <= width <= (WIDTH_2_7K * (1 + TOLERANCE)) and (HEIGHT_2_7K * (1 - TOLERANCE)) <= height <= (HEIGHT_2_7K * (1 + TOLERANCE))) or \
-        ((HEIGHT_2_7K * (1 - TOLERANCE)) <= width <= (HEIGHT_2_7K * (1 + TOLERANCE)) and (WIDTH_2_7K * (1 - TOLERANCE)) <= height <= (WIDTH_2_7K * (1 + TOLERANCE))):
-        resolution = '2.7k'
-    # Check for 1080p with tolerance
-    elif ((WIDTH_1080P * (1 - TOLERANCE)) <= width <= (WIDTH_1080P * (1 + TOLERANCE)) and (HEIGHT_1080P * (1 - TOLERANCE)) <= height <= (HEIGHT_1080P * (1 + TOLERANCE))) or \
-        ((HEIGHT_1080P * (1 - TOLERANCE)) <= width <= (HEIGHT_1080P * (1 + TOLERANCE)) and (WIDTH_1080P * (1 - TOLERANCE)) <= height <= (WIDTH_1080P * (1 + TOLERANCE))):
-        resolution = '1080p'
-
-    # Round fps to the nearest whole number to match against '30' or '60', 24 & 25 are considered 30
-    if float(fps) <= 30:
-        frame_rate = '30'
-    else:
-        frame_rate = str(round(float(fps) / 30) * 30)
-
-    # Use resolution and frame rate to get the correct settings from the dictionary
-    try:
-        export_settings = {
-            "new_bitrate": str(min(float(ffmpeg_settings.get(resolution, {}).get(str(frame_rate), {}).get(codec, {}).get(quality)), float(video_bitrate))),
-            "new_codec":list(ffmpeg_settings.get(resolution, {}).get(str(frame_rate)).keys())[0]
-            }
-    except:
-        export_settings = {
-            "new_bitrate": "999",
-            "new_codec": "vt_h265"
-            }
-    #new codec no-longer needed, defined in convert_selected_video
-    return export_settings
-
-def bitrate_to_size(duration_str, bitrate_mbps):
-    """
-    Estimates the file size in MB based on the video duration and bitrate.
-    The duration_str is expected to be in HH:MM:SS format.
-    The bitrate_mbps is expected to be in Mbps.
-    """
-    # Convert HH:MM:SS to total seconds
-    try:
-        hours, minutes, seconds = map(float, duration_str.split(':'))
-        total_seconds = hours * 3600 + minutes * 60 + seconds
-    except:
-        total_seconds = 1
-    
-    # Calculate the estimated file size in MB
-    if bitrate_mbps != "N/A":
-        file_size_mb = (bitrate_mbps * total_seconds * 0.125)
-    else:
-        file_size_mb = "N/A"
-    
-    return round(file_size_mb, 2) if file_size_mb != "N/A" else file_size_mb
-
-def estimate_new_file_size(video_info, export_settings):
-    # print("Estimating new file size...")
-
-    duration_str = video_info['duration_str']
-    size_mb = video_info['size_mb']
-    new_bitrate = export_settings['new_bitrate']
-
-    # If no matching settings found, return "N/A"
-    if not new_bitrate:
-        return "N/A"
-
-    # Estimate new file size
-    new_file_size_mb = round(bitrate_to_size(duration_str, float(new_bitrate)),1)
-
-    # Calculate compression ratio
-    try:
-        compression_ratio = 1 - (new_file_size_mb / size_mb)
-    except:
-        compression_ratio = 0
-
-    converted_file_data = {
-        'new_file_size_mb': new_file_size_mb,
-        'new_bitrate': new_bitrate,
-        'size_mb': size_mb,
-        'compression_ratio': f'{round(compression_ratio * 100, 1)}%'
-    }
-
-    return converted_file_data
-
-def parse_videos(input_path):
-    print("Parsing videos in folder...")
-    extensions = ['.mts', '.mp4', '.mkv', '.avi', '.mov']
-    videos = []
-    for root, dirs, files in os.walk(input_path):
-        for f in files:
-            if not f.startswith('.') and any(f.lower().endswith(ext) for ext in extensions):
-                videos.append(os.path.join(root, f))
-    return videos
-
-def save_new_filename(input_filedir):
-    dir_name = os.path.dirname(input_filedir)
-    file_name = os.path.splitext(os.path.basename(input_filedir))[0]
-    extension = '.mp4'  # Since we want to convert all files to mp4
-    counter = 1
-
-    output_filedir = os.path.join(dir_name, f"{file_name}{extension}")
-
-    while os.path.exists(output_filedir):
-        output_filedir = os.path.join(dir_name, f"{file_name} {counter}{extension}")
-        counter += 1
-    return output_filedir
-
-def convert_selected_video(input_file, export_settings, use_ffmpeg=False, use_codec='mac'):
-    print("Converting video...")
-    output_file = save_new_filename(input_file)
-
-    # Define encoder settings based on the use_codec argument
-    if use_codec == 'mac':
-        encoder_handbrake = 'vt_h265'
-        encoder_ffmpeg = 'hevc_videotoolbox'
-    elif use_codec == 'nvidia':
-        encoder_handbrake = 'nvenc_h265'
-        encoder_ffmpeg = 'hevc_nvenc'
-    elif use_codec == 'plain':
-        encoder_handbrake = 'x265'
-        encoder_ffmpeg = 'libx265'
-    else:
-        raise ValueError("Invalid codec option. Choose 'mac', 'nvidia', or 'plain'.")
-
-    if use_ffmpeg:
-        # Build the FFmpeg command
-        cmd = [
-            'ffmpeg',
-            '-i', input_file,
-            '-c:v', encoder_ffmpeg,
-            '-b:v', f"{float(export_settings['new_bitrate']) * 1000}k",  # Bitrate in kbps
-            '-f', 'mp4',
-            '-g', '60',  # Keyframe interval
-            '-vsync', 'cfr',  # Constant frame rate
-            '-map_metadata', '0',
-            output_file
-        ]
-    else:
-        # Build the HandbrakeCLI command
-        cmd = [
-            'HandBrakeCLI',
-            '-i', input_file,
-            '-o', output_file,
-            '-e', encoder_handbrake,
-            '-b', str(float(export_settings['new_bitrate'])*1000),  # Average bitrate
-            '-f', 'mp4',
-            '--encopts', 'keyint=60',
-            '--optimize',
-            '--cfr',  # Constant frame rate
-            '--keep-display-aspect',  # Maintain aspect ratio
-        ]
-
-    # Execute the command
-    print(" ".join(cmd))
-    subprocess.run(cmd)
-    return output_file
-
-
-def copy_exif_data(original_file, new_file):
-    # Keys to copy
-    keys = {
-        'XMP:Rating': 'Rating',
-        'XML:DeviceManufacturer': 'Make',
-        'XML:DeviceModelName': 'Model',
-        'XML:DeviceSerialNo': 'SerialNumber',
-        'QuickTime:CameraLensModel': 'LensModel',
-        'QuickTime:CameraFocalLength35mmEquivalent': 'FocalLengthIn35mmFilm',
-        'QuickTime:Make': 'Make',
-        'QuickTime:Model': 'Model',
-        'QuickTime:Software': 'Software',
-        'QuickTime:CreateDate': 'DateTimeOriginal',
-        'Composite:GPSAltitude': 'GPSAltitude',
-        'Composite:GPSAltitudeRef': 'GPSAltitudeRef',
-        'Composite:GPSLatitude': 'GPSLatitude',
-        'Composite:GPSLongitude': 'GPSLongitude',
-        'Composite:Rotation': 'Rotation'    
-    }
-
-    simplified_keys = {key.split(':')[1]: value for key, value in keys.items()}
-
-    # Read EXIF data from the original file
-    command_read = ['exiftool', '-json', original_file]
-    result = subprocess.run(command_read, capture_output=True, text=True)
-    exif_data = json.loads(result.stdout)[0]
-
-    print("Copying exif data...")
-
-    updated_keys_values = []
-    
-    command_write = ['exiftool', '-P', '-overwrite_original']
-
-    for full_key, simple_key in simplified_keys.items():
-        if full_key in exif_data:
-            value = exif_data[full_key]
-            if isinstance(value, str) and value.strip() == '':
-                continue  # Skip empty string values
-            # print(f'{full_key}:{value}:{simple_key}')
-            command_write.append(f'-{simple_key}={value}')
-            updated_keys_values.append((simple_key, value))
-
-
-    command_write.append(new_file)
-    # print(" ".join(command_write)) 
-    result = subprocess.run(command_write, capture_output=True, text=True)
-
-    # Check the first line of the output to determine if the file was updated
-    first_line = result.stdout.split('\n')[0] if result.stdout else ''
-    if "1 image files updated" in first_line:
-        print("The following keys and values have been updated:")
-        for key, value in updated_keys_values:
-            print(f'Updated {key} to {value}')
-    else:
-        print("No updates were made.")
-        if result.stderr:
-            print("Error:", result.stderr)
-
-    print("Exif data copied.")
-    return exif_data
-
-def update_timestamp(original_file, new_file):
-    print(f"Updating timestamp for: {os.path.basename(new_file)}")
-
-    # Get the original creation time for comparison
-    read_create_date = subprocess.run(['stat', '-f', '%SB', original_file], capture_output=True, text=True)
-    # print(read_create_date.stdout.strip())
-    # Convert the birth time string to a datetime object
-    original_timestamp = datetime.datetime.strptime(read_create_date.stdout.strip(), "%b %d %H:%M:%S %Y")
-    print(f"Original (_OLD) file timestamp: {original_timestamp}")
-
-    # Try to get 'Create Date' from EXIF data
-    command = ['exiftool', '-CreateDate', '-d', '%Y:%m:%d %H:%M:%S', original_file]
-    result = subprocess.run(command, capture_output=True, text=True)
-    create_date_str = result.stdout.strip().split(': ')[-1]  # Extract the date part
-    print(f"{os.path.basename(original_file)} create date is {create_date_str}")
-
-    if create_date_str:
-        try:
-            create_date = datetime.datetime.strptime(create_date_str, '%Y:%m:%d %H:%M:%S')
-            formatted_date = create_date.strftime("%m/%d/%Y %H:%M:%S")
-            setfile_command = ['SetFile', '-d', formatted_date, new_file]
-            subprocess.run(setfile_command, check=True)
-            print(f"'Create Date' set to: {formatted_date} based on EXIF DATA")
-        except ValueError:
-            print("Invalid EXIF 'Create Date'. Using fallback method.")
-            # Fallback method using stat and SetFile
-            creation_date = subprocess.check_output(
-                ['stat', '-f', '%SB', '-t', '%m/%d/%Y %H:%M:%S', original_file]
-            ).decode().strip()
-            setfile_command = ['SetFile', '-d', creation_date, new_file]
-            subprocess.run(setfile_command, check=True)
-            print(f"'Create Date' updated to {creation_date} using stat and SetFile from {original_file}")
-    else:
-        # Fallback to the original file's creation time using stat and SetFile
-        creation_date = subprocess.check_output(
-            ['stat', '-f', '%SB', '-t', '%m/%d/%Y %H:%M:%S', original_file]
-        ).decode().strip()
-        setfile_command = ['SetFile', '-d', creation_date, new_file]
-        subprocess.run(setfile_command, check=True)
-        print(f"EXIF data not found. 'Create Date' updated to {creation_date} using stat and SetFile from {original_file}")
-
-def old_file_new_name(input_path):
-    file_base, file_extension = os.path.splitext(input_path)
-    counter = 1
-    converted_file_name = f"{file_base}_OLD{file_extension}"
-    # Check if the file exists and increment the counter until an unused name is found
-    while os.path.exists(converted_file_name):
-        converted_file_name = f"{file_base}_OLD {counter}{file_extension}"
-        counter += 1
-    
-    return converted_file_name
-
-def rename_file(input_path, new_name):
-    try:
-        directory = os.path.dirname(input_path)
-        original_extension = os.path.splitext(input_path)[1]
-        new_name_without_extension = os.path.splitext(new_name)[0]
-        new_file_path = os.path.join(directory, new_name_without_extension + original_extension)
-        os.rename(input_path, new_file_path)
-        print(f"Renamed {os.path.basename(input_path)} to {os.path.basename(new_file_path)}")
-        return True
-    except Exception as e:
-        print(f"Failed to rename {os.path.basename(input_path)}: {e}")
-        return False
-
-def rename_with_rollback(original_file_path, intermediate_file_path, final_file_path):
-    # First, rename the original file to the intermediate path
-    if rename_file(original_file_path, intermediate_file_path):
-        # If the first rename succeeds, try the second rename
-        if rename_file(final_file_path, original_file_path):
-            return True
-        else:
-            # If the second rename fails, rollback the first rename
-            print("Second renaming operation failed, rolling back the first rename.")
-            rename_file(intermediate_file_path, original_file_path)
-    else:
-        print("First renaming operation failed.")
-    return False
-
-
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtWidgets import QMenu, QApplication, QMainWindow, QTreeView, QPushButton, QFileDialog, QMessageBox, QDialog, QVBoxLayout, QCheckBox, QDialogButtonBox 
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QStandardItemModel, QStandardItem, QBrush, QColor, QFont
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
 import os
 import json
 import sys
 import subprocess
+import threading
+from compress_core import *
+from export_planner import RESOLUTION_SIZES
+from video_model import VideoTreeModel, VideoFilterProxy, OTHER_RESOLUTION, UNPROBED, PROBED, PROBE_FAILED
+
+# Encodes projected to save less than this percentage are stopped, same cut-off as the greyed out rows
+EARLY_ABORT_PERCENT = 10.0
+
+# Probe results are added to the tree in batches, at most this many milliseconds after they arrive
+PROBE_FLUSH_MS = 200
+# Probe order, lowest first: rows a conversion or trial encode waits for, rows on screen, the folder
+# under the mouse, a screen above and below, then the rest of the rows while a filter needs them
+PROBE_SELECTED, PROBE_VISIBLE, PROBE_HOVERED, PROBE_NEARBY, PROBE_FILTERED = range(5)
+# Probes follow scrolling, expanding and hovering at most this often
+VIEWPORT_PROBE_MS = 50
+# A filter is applied again at most this often while the rows it needs are being probed
+FILTER_REFRESH_MS = 1000
+# Ceiling offered for constant-quality encodes, as a multiple of the table bitrate
+CRF_CEILING_FACTOR = 1.5
 
 def resize_window(window):
     # Obtain the size of the screen
@@ -575,8 +108,55 @@ class SubfolderSelectionDialog(QDialog):
         return selected_folders
 
 
+class PredictThread(QtCore.QThread):
+    # Emitted with (video_path, converted_file_data) as each trial encode finishes
+    videoPredicted = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, requests, cache=None, parent=None):
+        super().__init__(parent)
+        # (video_path, video_info, export_settings, use_codec) tuples
+        self.requests = requests
+        self.cache = cache
+        self.stop_event = threading.Event()
+
+    def run(self):
+        for video_path, video_info, export_settings, use_codec in self.requests:
+            if self.stop_event.is_set():
+                break
+            converted_file_data = predict_new_file_size(video_path, video_info, export_settings, use_codec, self.cache)
+            self.videoPredicted.emit(video_path, converted_file_data)
+
+    def cancel(self):
+        self.stop_event.set()
+
+
+class EncodeThread(QtCore.QThread):
+    # Emitted from the worker thread as each job's encode, metadata copy and rename finish
+    jobFinished = QtCore.pyqtSignal(object, object)
+    # Emitted with (job_progress, totals) as the encoders report progress
+    progressUpdated = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, jobs, max_jobs=ENCODE_JOBS, threads_per_encode=None, journal=None, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.journal = journal
+        self.max_jobs = max_jobs
+        self.threads_per_encode = threads_per_encode
+        self.stop_event = threading.Event()
+        self.tracker = ProgressTracker(self.progressUpdated.emit)
+
+    def run(self):
+        for job, result in encode_videos(self.jobs, self.max_jobs, self.threads_per_encode, self.stop_event, self.tracker, self.journal):
+            self.jobFinished.emit(job, result)
+
+    def cancel(self):
+        self.stop_event.set()
+
+
 class MainWindow(QtWidgets.QMainWindow):
-    
+    # Emitted from the probe queue's worker threads, delivered to the window on the GUI thread
+    videoProbed = QtCore.pyqtSignal(str, object)
+
     headers_order = [
                 'Name', 
                 'Select', 
@@ -594,12 +174,13 @@ class MainWindow(QtWidgets.QMainWindow):
                 'Duration', 
                 'Codec', 
                 'New Codec', 
+                'Rate Control', 
                 'Converted File Name', 
                 'Renamed Old File Name', 
                 'Full File Path'
             ]
 
-    COL_NAME = COL_SELECT = COL_FORCE_HQ = COL_INPUT_BITRATE = COL_RATING = COL_DURATION = COL_DIMENSIONS = COL_FPS = COL_CODEC = COL_BIT_RATE = COL_SIZE_MB = COL_NEW_CODEC = COL_NEW_BIT_RATE = COL_EST_NEW_SIZE = COL_COMPRESSION_PERCENT = COL_CONVERTED_FILE_NAME = COL_RENAMED_OLD_FILE_NAME = COL_FULL_FILE_PATH = None
+    COL_NAME = COL_SELECT = COL_FORCE_HQ = COL_INPUT_BITRATE = COL_RATING = COL_DURATION = COL_DIMENSIONS = COL_FPS = COL_CODEC = COL_BIT_RATE = COL_SIZE_MB = COL_NEW_CODEC = COL_RATE_CONTROL = COL_NEW_BIT_RATE = COL_EST_NEW_SIZE = COL_COMPRESSION_PERCENT = COL_CONVERTED_FILE_NAME = COL_RENAMED_OLD_FILE_NAME = COL_FULL_FILE_PATH = None
 
     headers_mapping = {
         'Name': 'COL_NAME',
@@ -614,6 +195,7 @@ class MainWindow(QtWidgets.QMainWindow):
         'Bit Rate': 'COL_BIT_RATE',
         'Size (MB)': 'COL_SIZE_MB',
         'New Codec': 'COL_NEW_CODEC',
+        'Rate Control': 'COL_RATE_CONTROL',
         'New Bit Rate': 'COL_NEW_BIT_RATE',
         'Est. New Size': 'COL_EST_NEW_SIZE',
         'Compression %': 'COL_COMPRESSION_PERCENT',
@@ -646,9 +228,50 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tree.setUniformRowHeights(True)
         self.tree.setSortingEnabled(True)
 
-        self.model = QStandardItemModel()
-        self.model.itemChanged.connect(self.onItemChanged)
-        self.tree.setModel(self.model)
+        # Columnar model, only the rows on screen are turned into text; the proxy filters and hands sorting back to it
+        self.model = VideoTreeModel(self.headers_order, self)
+        self.proxy = VideoFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.tree.setModel(self.proxy)
+
+        # Rows are added straight from the folder scan and filled in as probes finish, the ones on screen first
+        self.probed_rows = []
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush_probed_rows)
+        self.probed_count = 0
+        self.probe_cache = ProbeCache()
+        # Files whose encode was stopped early, loaded once and kept up to date by on_job_finished
+        self.not_worth_it = self.probe_cache.not_worth_it_paths()
+        self.probe_queue = ProbeQueue(self.videoProbed.emit, cache=self.probe_cache)
+        self.videoProbed.connect(self.on_video_probed)
+        self.hovered_folder = None
+        self.viewport_timer = QtCore.QTimer(self)
+        self.viewport_timer.setSingleShot(True)
+        self.viewport_timer.timeout.connect(self.probe_visible_rows)
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.timeout.connect(self.proxy.invalidateFilter)
+        # Paths a conversion or trial encode is waiting for, and what to run once they're probed
+        self.awaited_paths = set()
+        self.after_probe = None
+        self.library_index = LibraryIndex()
+        # Encoder backend for encodes and trial encodes, auto is resolved to the best one this machine has.
+        # Folders ({path: backend}, from the folder's context menu) and ratings ({stars: backend}) can override it
+        self.use_codec = AUTO_BACKEND
+        self.folder_codecs = {}
+        self.rating_codecs = {}
+        # Rate control for every job, see set_rate_control, and the CRF ceiling as a multiple of the table bitrate
+        self.rate_control = 'abr'
+        self.max_bitrate_factor = None
+        # Converted video -> its _OLD files, and all those _OLD files, filled in by build_folder_structure
+        self.old_pairs = {}
+        self.old_files = set()
+
+        # Finish or clean up whatever an earlier session was doing when it died, before the folders are listed
+        self.job_journal = JobJournal()
+        self.job_journal.clean_partial_outputs()
+        resume_unfinished_jobs(self.job_journal)
 
         path = self.get_directory_path()
         if path:
@@ -658,6 +281,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 selected_folders = self.get_subfolder_selection(path)
                 for folder in selected_folders:
                     self.populate_tree(folder)  # Assuming populate_tree can handle individual folders
+        # Old versions are known from the scan, the rest is greyed out as the rows are probed
+        self.grey_out_rows()
         
         # Auto-size columns
         self.tree.resizeColumnToContents(self.COL_NAME)  
@@ -683,20 +308,51 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tree.setContextMenuPolicy(Qt.CustomContextMenu)
         self.tree.customContextMenuRequested.connect(self.openContextMenu)
 
+        # Probing follows the view, see probe_visible_rows
+        self.tree.setMouseTracking(True)
+        self.tree.entered.connect(self.on_row_hovered)
+        self.tree.expanded.connect(self.schedule_visible_probe)
+        self.tree.collapsed.connect(self.schedule_visible_probe)
+        self.tree.verticalScrollBar().valueChanged.connect(self.schedule_visible_probe)
+        self.tree.verticalScrollBar().rangeChanged.connect(self.schedule_visible_probe)
+        self.tree.header().sortIndicatorChanged.connect(self.schedule_visible_probe)
+        self.proxy.layoutChanged.connect(self.schedule_visible_probe)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.schedule_visible_probe()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.schedule_visible_probe()
+
     def openContextMenu(self, position):
         indexes = self.tree.selectedIndexes()
         if indexes:
             menu = QMenu()
             show_in_finder_action = menu.addAction("Show in Finder")
+            # Folder rows can be given their own encoder, e.g. AV1 for an archive folder
+            folder = self.proxy.folder_path(self.tree.indexAt(position))
+            codec_actions = {}
+            if folder:
+                codec_menu = menu.addMenu("Encode folder with")
+                current = self.folder_codecs.get(os.path.abspath(folder))
+                for backend in [None] + usable_backends():
+                    codec_action = codec_menu.addAction(backend or "Default codec")
+                    codec_action.setCheckable(True)
+                    codec_action.setChecked(backend == current)
+                    codec_actions[codec_action] = backend
             action = menu.exec_(self.tree.viewport().mapToGlobal(position))
             if action == show_in_finder_action:
                 self.showSelectedInFinder(indexes[0])  # Assumes first column has the full path or modify as needed
+            elif action in codec_actions:
+                self.set_folder_codec(folder, codec_actions[action])
 
     def showSelectedInFinder(self, index):
         if index.isValid():
-            file_path_item = self.model.itemFromIndex(index.sibling(index.row(), self.COL_FULL_FILE_PATH))
-            if file_path_item:
-                file_path = file_path_item.text()
+            row_id = self.proxy.row_id(index)
+            if row_id is not None:
+                file_path = self.model.paths[row_id]
                 if file_path and os.path.exists(file_path):
                     if sys.platform == "darwin":
                         subprocess.run(["open", "-R", file_path])
@@ -726,21 +382,171 @@ class MainWindow(QtWidgets.QMainWindow):
         self.showInFinderButton = QtWidgets.QPushButton("Show in Finder", self)
         self.showInFinderButton.clicked.connect(self.showInFinder)
 
+        # Encode concurrency, threads per encode of 0 lets the encoder decide
+        self.encodeJobsSpinBox = QtWidgets.QSpinBox(self)
+        self.encodeJobsSpinBox.setRange(1, os.cpu_count() or 1)
+        self.encodeJobsSpinBox.setValue(default_encode_jobs(self.use_codec))
+        self.encodeJobsSpinBox.setPrefix("Concurrent encodes: ")
+
+        self.threadsPerEncodeSpinBox = QtWidgets.QSpinBox(self)
+        self.threadsPerEncodeSpinBox.setRange(0, os.cpu_count() or 1)
+        self.threadsPerEncodeSpinBox.setSpecialValueText("Threads per encode: auto")
+        self.threadsPerEncodeSpinBox.setPrefix("Threads per encode: ")
+        self.encode_thread = None
+
+        self.encodeProgressBar = QtWidgets.QProgressBar(self)
+        self.encodeProgressBar.setRange(0, 100)
+        self.encodeProgressBar.hide()
+
+        self.cancelScanButton = QtWidgets.QPushButton("Cancel scan", self)
+        self.cancelScanButton.clicked.connect(self.cancel_probe)
+        self.cancelScanButton.setEnabled(False)
+
+        # Trial encodes a few seconds of each selected video for a better size estimate
+        self.predictButton = QtWidgets.QPushButton("Predict sizes of selected videos", self)
+        self.predictButton.clicked.connect(self.predict_selected)
+        self.predict_thread = None
+
+        # Filters only hide rows, Select All and the folder checkboxes then only tick the rows shown
+        self.minRatingSpinBox = QtWidgets.QSpinBox(self)
+        self.minRatingSpinBox.setRange(0, 5)
+        self.minRatingSpinBox.setSpecialValueText("Min rating: any")
+        self.minRatingSpinBox.setPrefix("Min rating: ")
+        self.minRatingSpinBox.valueChanged.connect(self.apply_filters)
+
+        self.resolutionComboBox = QtWidgets.QComboBox(self)
+        self.resolutionComboBox.addItem("All resolutions", None)
+        for resolution in RESOLUTION_SIZES:
+            self.resolutionComboBox.addItem(resolution, resolution)
+        self.resolutionComboBox.addItem("Other resolutions", OTHER_RESOLUTION)
+        self.resolutionComboBox.currentIndexChanged.connect(self.apply_filters)
+
+        self.minSavingsSpinBox = QtWidgets.QSpinBox(self)
+        self.minSavingsSpinBox.setRange(0, 100)
+        self.minSavingsSpinBox.setSpecialValueText("Min savings: any")
+        self.minSavingsSpinBox.setPrefix("Min savings: ")
+        self.minSavingsSpinBox.setSuffix("%")
+        self.minSavingsSpinBox.valueChanged.connect(self.apply_filters)
+
+        # Encoder choice, changing it re-plans the New Codec, New Bit Rate and size columns
+        self.codecComboBox = QtWidgets.QComboBox(self)
+        self.codecComboBox.addItem(f"Codec: auto ({best_backend()})", AUTO_BACKEND)
+        for backend in usable_backends():
+            self.codecComboBox.addItem(f"Codec: {backend}", backend)
+        self.codecComboBox.currentIndexChanged.connect(self.codecChanged)
+
+        # Videos rated this many stars or more can use another encoder, e.g. keep 5-star videos in HEVC
+        self.ratingCodecSpinBox = QtWidgets.QSpinBox(self)
+        self.ratingCodecSpinBox.setRange(0, 5)
+        self.ratingCodecSpinBox.setSpecialValueText("Rating codec: off")
+        self.ratingCodecSpinBox.setPrefix("Rated ")
+        self.ratingCodecSpinBox.setSuffix("+ use:")
+        self.ratingCodecSpinBox.valueChanged.connect(self.ratingCodecChanged)
+
+        self.ratingCodecComboBox = QtWidgets.QComboBox(self)
+        for backend in usable_backends():
+            self.ratingCodecComboBox.addItem(backend, backend)
+        self.ratingCodecComboBox.currentIndexChanged.connect(self.ratingCodecChanged)
+
+        # Single-pass average bitrate as before, constant quality with or without a ceiling, or two passes
+        self.rateControlComboBox = QtWidgets.QComboBox(self)
+        self.rateControlComboBox.addItem("Rate control: average bitrate", ('abr', None))
+        self.rateControlComboBox.addItem("Rate control: constant quality", ('crf', None))
+        self.rateControlComboBox.addItem(f"Rate control: constant quality, at most {CRF_CEILING_FACTOR:g}x the bitrate", ('crf', CRF_CEILING_FACTOR))
+        self.rateControlComboBox.addItem("Rate control: two-pass", ('twopass', None))
+        self.rateControlComboBox.currentIndexChanged.connect(self.rateControlChanged)
+
+    def apply_filters(self):
+        self.proxy.set_filters(
+            min_rating=self.minRatingSpinBox.value() or None,
+            resolution=self.resolutionComboBox.currentData(),
+            min_savings=self.minSavingsSpinBox.value() or None,
+        )
+        # A filter only knows which videos match once they're probed, so with one set every row is probed
+        if self.proxy.filtering():
+            self.probe_queue.request([path for r, path in enumerate(self.model.paths) if self.model.probe_state[r] == UNPROBED],
+                                     PROBE_FILTERED)
+        else:
+            self.probe_queue.forget((PROBE_FILTERED,))
+        self.update_probe_status()
+
     def setupLayout(self):
         layout = QtWidgets.QVBoxLayout()
         layout.addWidget(self.selectAllCheckBox)
         layout.addWidget(self.forceHQAllCheckBox)
         layout.addWidget(self.deleteConvertedVideosCheckBox)
+        encode_layout = QtWidgets.QHBoxLayout()
+        encode_layout.addWidget(self.encodeJobsSpinBox)
+        encode_layout.addWidget(self.threadsPerEncodeSpinBox)
+        encode_layout.addWidget(self.codecComboBox)
+        encode_layout.addWidget(self.ratingCodecSpinBox)
+        encode_layout.addWidget(self.ratingCodecComboBox)
+        encode_layout.addWidget(self.rateControlComboBox)
+        layout.addLayout(encode_layout)
+        filter_layout = QtWidgets.QHBoxLayout()
+        filter_layout.addWidget(self.minRatingSpinBox)
+        filter_layout.addWidget(self.resolutionComboBox)
+        filter_layout.addWidget(self.minSavingsSpinBox)
+        layout.addLayout(filter_layout)
         layout.addWidget(self.tree)
+        layout.addWidget(self.encodeProgressBar)
         layout.addWidget(self.printButton)
+        layout.addWidget(self.predictButton)
+        layout.addWidget(self.cancelScanButton)
         layout.addWidget(self.showInFinderButton)
 
         container = QtWidgets.QWidget()
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+    def codecChanged(self):
+        self.use_codec = self.codecComboBox.currentData()
+        self.replan_rows(range(len(self.model.paths)))
+
+    def ratingCodecChanged(self):
+        stars = self.ratingCodecSpinBox.value()
+        backend = self.ratingCodecComboBox.currentData()
+        self.rating_codecs = {stars: backend} if stars and backend else {}
+        self.replan_rows(range(len(self.model.paths)))
+
+    def rateControlChanged(self):
+        self.rate_control, self.max_bitrate_factor = self.rateControlComboBox.currentData()
+        self.replan_rows(range(len(self.model.paths)))
+
+    def set_folder_codec(self, folder, backend):
+        # None goes back to the default codec; subfolders follow unless they have their own
+        folder = os.path.abspath(folder)
+        if backend:
+            self.folder_codecs[folder] = backend
+        else:
+            self.folder_codecs.pop(folder, None)
+        self.model.set_folder_codec(folder, backend)
+        self.replan_rows(r for r, path in enumerate(self.model.paths)
+                         if os.path.abspath(path).startswith(folder + os.sep))
+
+    def video_codec(self, video_path, video_info):
+        return codec_for_video(video_path, video_info, self.use_codec, self.folder_codecs, self.rating_codecs)
+
+    def replan_rows(self, row_ids):
+        # Planned again with each row's encoder, cached trial-encode predictions are used if they match.
+        # Rows not probed yet are planned with the current choices when they are
+        row_ids = [r for r in row_ids if self.model.probe_state[r] == PROBED]
+        if not row_ids:
+            return
+        video_infos = [self.model.video_info(r) for r in row_ids]
+        codecs = [self.video_codec(self.model.paths[r], video_info) for r, video_info in zip(row_ids, video_infos)]
+        export_settings = plan_exports(video_infos, use_codec=codecs)
+        for settings, codec in zip(export_settings, codecs):
+            set_rate_control(settings, self.rate_control, codec, self.max_bitrate_factor)
+        converted_file_data = cached_file_sizes([
+            (self.model.paths[r], video_info, settings, codec)
+            for r, video_info, settings, codec in zip(row_ids, video_infos, export_settings, codecs)
+        ], self.probe_cache)
+        self.model.set_exports(list(zip(row_ids, export_settings, converted_file_data)))
+        self.grey_out_rows(row_ids)
+
     def has_subfolders(self, path):
-        return any(os.path.isdir(os.path.join(path, name)) for name in os.listdir(path))
+        return bool(self.library_index.subdirs(path))
 
     def get_directory_path(self):
         ##Logic to save the last used directory
@@ -776,61 +582,16 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             return []
 
-    def is_item_greyed_out(self, item):
-        # Assuming greyed-out items have a specific foreground color, e.g., grey
-        return item.foreground().color() == QColor('grey')
-
     def selectAllChanged(self, state):
-        for row in range(self.model.rowCount()):
-            folder_item = self.model.item(row)
-            for child_row in range(folder_item.rowCount()):
-                item = folder_item.child(child_row, self.COL_SELECT)
-                if item is not None and item.isCheckable() and not self.is_item_greyed_out(item):
-                    item.setCheckState(Qt.Checked if state == Qt.Checked else Qt.Unchecked)
+        # Greyed out rows are skipped, see VideoTreeModel.set_checked
+        self.model.set_checked('Select', state == Qt.Checked)
 
     def forceHQAllChanged(self, state):
-        for row in range(self.model.rowCount()):
-            folder_item = self.model.item(row)
-            for child_row in range(folder_item.rowCount()):
-                item = folder_item.child(child_row, self.COL_FORCE_HQ)  # 3 is the index for 'Force HQ' column
-                if item is not None and item.isCheckable() and not self.is_item_greyed_out(item):
-                    item.setCheckState(Qt.Checked if state == Qt.Checked else Qt.Unchecked)
+        self.model.set_checked('Force HQ', state == Qt.Checked)
 
     def deleteConvertedVideosChanged(self, state):
         self.delete_converted_videos = state == Qt.Checked
 
-    def select_all_for_folder(self, folder_item, state):
-        for row in range(folder_item.rowCount()):
-            item = folder_item.child(row, self.COL_SELECT)
-            if item is not None and item.isCheckable() and not self.is_item_greyed_out(item):
-                item.setCheckState(Qt.Checked if state == Qt.Checked else Qt.Unchecked)
-
-    def force_hq_all_for_folder(self, folder_item, state):
-        for row in range(folder_item.rowCount()):
-            item = folder_item.child(row, self.COL_FORCE_HQ)
-            if item is not None and item.isCheckable() and not self.is_item_greyed_out(item):
-                item.setCheckState(Qt.Checked if state == Qt.Checked else Qt.Unchecked)
-
-    def apply_bitrate_to_folder(self, folder_item, bitrate):
-        for row in range(folder_item.rowCount()):
-            video_row_item = folder_item.child(row, self.COL_INPUT_BITRATE)
-            if video_row_item and video_row_item.isEditable():
-                video_row_item.setText(bitrate)
-    
-    def onItemChanged(self, item):
-    # Check if the changed item is a folder-level checkbox
-        if item.column() in [self.COL_SELECT, self.COL_FORCE_HQ]:
-            folder_item = item.data(Qt.UserRole)
-            if folder_item:
-                if item.column() == self.COL_SELECT:
-                    self.select_all_for_folder(folder_item, item.checkState())
-                elif item.column() == self.COL_FORCE_HQ:
-                    self.force_hq_all_for_folder(folder_item, item.checkState())
-        if item.column() == self.COL_INPUT_BITRATE:
-            folder_item = item.data(Qt.UserRole)
-            if folder_item:  # Check if this is a folder-level change
-                self.apply_bitrate_to_folder(folder_item, item.text())
-    
     def showInFinder(self):
         # Logic to open the selected directory in Finder or File Explorer
         directory = self.get_directory_path()  # Assuming this method returns the selected directory path
@@ -857,282 +618,332 @@ class MainWindow(QtWidgets.QMainWindow):
     def close_application(self):
         QtWidgets.QApplication.quit()
 
+    def closeEvent(self, event):
+        # Don't leave probes running against a destroyed model
+        self.probe_queue.close()
+        self.probe_cache.print_stats()
+        self.probe_cache.evict(PROBE_CACHE_MAX_ENTRIES, PROBE_CACHE_MAX_AGE_DAYS)
+        if self.predict_thread is not None and self.predict_thread.isRunning():
+            self.predict_thread.cancel()
+            self.predict_thread.wait()
+        # Queued encodes are dropped, the ones already running finish before exiting
+        if self.encode_thread is not None and self.encode_thread.isRunning():
+            self.encode_thread.cancel()
+            self.encode_thread.wait()
+        super().closeEvent(event)
+
     def get_total_checked_videos(self):
-        total_checked = 0
-        for folder_row in range(self.model.rowCount()):
-            folder_item = self.model.item(folder_row)
-            for video_row in range(folder_item.rowCount()):
-                if self.is_video_selected(folder_item, video_row):
-                    total_checked += 1
-        return total_checked
+        return len(self.model.checked_rows())
 
     def convert_videos(self):
-        total_checked = self.get_total_checked_videos()
-        if total_checked == 0:
+        if not self.model.checked_rows():
             QMessageBox.information(self, "No Videos Selected", "Please select videos to convert.")
             return
+        # Rows ticked before they were probed are probed first, this runs again once they are
+        if self.probe_first(self.model.checked_rows(), self.convert_videos):
+            return
+        selected_rows = self.checked_probed_rows()
+        total_checked = len(selected_rows)
+        if total_checked == 0:
+            QMessageBox.information(self, "No Videos Selected", "None of the selected videos are worth converting.")
+            return
 
-        current_checked = 0
-        for folder_row in range(self.model.rowCount()):
-            folder_item = self.model.item(folder_row)
-            for video_row in range(folder_item.rowCount()):
-                if self.is_video_selected(folder_item, video_row):  # Adjusted to check within folder
-                    current_checked += 1
-                    file_name = self.get_item_text(folder_item, video_row, self.COL_NAME)
-                    self.print_conversion_header(file_name, current_checked, total_checked)
-
-                    try:
-                        self.process_video(folder_item, video_row)  # Adjusted to process within folder
-                    except Exception as e:
-                        print(f"Error processing {file_name}: {e}")
-                        continue
-
-        print("===========Conversion complete===========")
+        jobs = []
+        for row_id in selected_rows:
+            job = self.build_job(row_id)
+            # Already HEVC in an mp4, remuxing would just copy it into the same container
+            if job['export_settings'].get('stream_copy') and not needs_remux(job['input_file']):
+                continue
+            jobs.append(job)
+        if len(jobs) < total_checked:
+            print(f"Skipping {total_checked - len(jobs)} selected videos that are already HEVC in an mp4")
+        if not jobs:
+            QMessageBox.information(self, "No Videos Selected", "None of the selected videos are worth converting.")
+            return
+        for number, job in enumerate(jobs, 1):
+            job['label'] = f"{os.path.basename(job['input_file'])} - {number}/{len(jobs)}"
+
+        # Encodes run on a background thread so the window stays responsive
+        self.encode_results = []
+        self.encode_thread = EncodeThread(jobs, self.encodeJobsSpinBox.value(), self.threadsPerEncodeSpinBox.value() or None,
+                                          self.job_journal, self)
+        self.encode_thread.jobFinished.connect(self.on_job_finished)
+        self.encode_thread.progressUpdated.connect(self.on_encode_progress)
+        self.encode_thread.finished.connect(self.on_encode_finished)
+        self.printButton.setEnabled(False)
+        self.encodeProgressBar.setValue(0)
+        self.encodeProgressBar.show()
+        self.encode_thread.start()
+
+    def on_encode_progress(self, job_progress, totals):
+        # Overall progress is weighted by source size across the jobs started so far
+        self.encodeProgressBar.setValue(int(totals['percent']))
+        self.statusBar().showMessage(format_progress(job_progress, totals))
+
+    def on_job_finished(self, job, result):
+        self.encode_results.append(result)
+        if result.get('not_worth_it'):
+            # The row is greyed out from now on, see grey_out_rows
+            self.probe_cache.mark_not_worth_it(job['input_file'], result['error'])
+            self.not_worth_it[job['input_file']] = result['error']
+            status = f"not worth it: {result['error']}"
+        else:
+            status = "done" if result['success'] else f"failed{': ' + result['error'] if result['error'] else ''}"
+        print(f"Finished {job['label']} ({status})")
+
+    def on_encode_finished(self):
+        failed = sum(1 for result in self.encode_results if not result['success'] and not result.get('not_worth_it'))
+        stopped = sum(1 for result in self.encode_results if result.get('not_worth_it'))
+        succeeded = len(self.encode_results) - failed - stopped
+        print(f"===========Conversion complete ({succeeded} succeeded, {stopped} not worth it, {failed} failed)===========")
+        print_tier_summary(self.encode_thread.tracker)
+        self.encodeProgressBar.hide()
+        self.printButton.setEnabled(True)
         self.show_completion_dialog()
 
-    def is_video_selected(self, folder_item, row):
-        check_item = folder_item.child(row, self.COL_SELECT)
-        return check_item and check_item.checkState() == Qt.Checked
-
-    def get_item_text(self, folder_item, row, column):
-        item = folder_item.child(row, column)
-        return item.text() if item else ""
-
-    def print_conversion_header(self, file_name, current, total):
-        header_line = "=" * 100 + "\n"
-        print(f"{header_line *10}{'=' * 29} Processing {file_name} - {current}/{total} {'=' * 29}\n{header_line *10}")
+    def predict_selected(self):
+        if self.probe_first(self.model.checked_rows(), self.predict_selected):
+            return
+        requests = []
+        for row_id in self.checked_probed_rows():
+            job = self.build_job(row_id)
+            requests.append((job['input_file'], job['video_info'], job['export_settings'], job['use_codec']))
+        if not requests:
+            QMessageBox.information(self, "No Videos Selected", "Please select videos to predict.")
+            return
+        print(f"Trial encoding {len(requests)} videos...")
+        self.predict_thread = PredictThread(requests, self.probe_cache, self)
+        self.predict_thread.videoPredicted.connect(self.on_video_predicted)
+        self.predict_thread.finished.connect(self.on_predict_finished)
+        self.predictButton.setEnabled(False)
+        self.predict_thread.start()
+
+    def on_video_predicted(self, video, converted_file_data):
+        self.model.set_prediction(video, converted_file_data)
+
+    def on_predict_finished(self):
+        print("Size predictions complete")
+        self.predictButton.setEnabled(True)
+        self.grey_out_rows()
 
-    def process_video(self, folder_item, row):
-        # Retrieve the full file path from the folder item and row index
-        old_file_path = self.get_item_text(folder_item, row, self.COL_FULL_FILE_PATH)
-        renamed_old_file_path = self.get_item_text(folder_item, row, self.COL_RENAMED_OLD_FILE_NAME)
-        video_info = self.extract_video_info(folder_item, row)
-        force_hq = folder_item.child(row, self.COL_FORCE_HQ).checkState() == Qt.Checked
+    def build_job(self, row_id):
+        # Collect everything the encode needs from the row, the job itself runs off the GUI thread
+        video_info = self.model.video_info(row_id)
+        force_hq = bool(self.model.checks['Force HQ'][row_id])
+        use_codec = self.video_codec(self.model.paths[row_id], video_info)
 
-        export_settings = get_export_bitrate(video_info, force_hq)
+        export_settings = get_export_bitrate(video_info, force_hq, use_codec)
         
         #Override bitrate
-        input_bitrate_item = folder_item.child(row, self.COL_INPUT_BITRATE)
-        input_bitrate = input_bitrate_item.text() if input_bitrate_item else ""
-        if input_bitrate.isdigit():
+        input_bitrate = self.model.input_bitrate(row_id)
+        rate_control = self.rate_control
+        if input_bitrate is not None:
             export_settings['new_bitrate'] = input_bitrate
+            # A bitrate typed in means encoding, even for an HEVC source that would otherwise be copied,
+            # and encoding at that bitrate rather than at a constant quality
+            export_settings.pop('stream_copy', None)
+            if rate_control == 'crf':
+                rate_control = 'abr'
+        set_rate_control(export_settings, rate_control, use_codec, self.max_bitrate_factor)
         
-        # print(export_settings)
-
-        new_file_path = convert_selected_video(old_file_path, export_settings)
-        copy_exif_data(old_file_path, new_file_path)
-        update_timestamp(old_file_path, new_file_path)
-
-        success = rename_with_rollback(old_file_path, renamed_old_file_path, new_file_path)
-        print("Renaming operations completed successfully." if success else "Renaming operations failed or partially failed.")
-
-        if self.delete_converted_videos:
-            self.delete_original_file(renamed_old_file_path)
-            print(f"Deleted original file: {renamed_old_file_path}")
-
-    def delete_original_file(self, file_path):
-        try:
-            os.remove(file_path)
-        except OSError as e:
-            print(f"Error deleting file {file_path}: {e.strerror}")
-    
-    def extract_video_info(self, folder_item, row):
         return {
-            'video_codec': self.get_item_text(folder_item, row, self.COL_CODEC),
-            'dimensions': self.get_item_text(folder_item, row, self.COL_DIMENSIONS),
-            'video_bitrate': self.get_item_text(folder_item, row, self.COL_BIT_RATE),
-            'fps': self.get_item_text(folder_item, row, self.COL_FPS),
-            'duration_str': self.get_item_text(folder_item, row, self.COL_DURATION),
-            'size_mb': self.get_item_text(folder_item, row, self.COL_SIZE_MB),
-            'rating': self.get_item_text(folder_item, row, self.COL_RATING),
-            'date_modified': self.get_item_text(folder_item, row, self.COL_DATE_MODIFIED),
+            'input_file': self.model.paths[row_id],
+            'video_info': video_info,
+            'export_settings': export_settings,
+            'renamed_old_file_path': self.model.renamed_old_file_name(row_id),
+            'use_codec': use_codec,
+            'abort_below': EARLY_ABORT_PERCENT,
+            'delete_original': self.delete_converted_videos,
         }
 
     def populate_tree(self, path):
-        self.setup_tree_headers()
         folder_structure = self.build_folder_structure(path)
+        # Rows show straight away with their names, the rest is filled in by probe_visible_rows and probe_first
         self.populate_folders(folder_structure)
-        # Grey out old versions
-        self.grey_out_rows()
 
-    def setup_tree_headers(self):
-        # Create headers list using the order in headers_order
-        headers = [header for header in self.headers_order]
+    def schedule_visible_probe(self, *args):
+        if not self.viewport_timer.isActive():
+            self.viewport_timer.start(VIEWPORT_PROBE_MS)
+
+    def on_row_hovered(self, index):
+        folder = self.proxy.folder_path(index)
+        if folder is not None and folder != self.hovered_folder:
+            self.hovered_folder = folder
+            self.schedule_visible_probe()
+
+    def visible_rows(self):
+        # (row ids on screen, row ids of a screen above and below it), walked from the row at the top of the view
+        tree = self.tree
+        top = tree.indexAt(QtCore.QPoint(0, 0))
+        visible, nearby = [], []
+        if not top.isValid():
+            return visible, nearby
+        screen = tree.viewport().height() // max(tree.visualRect(top).height(), 1) + 1
+        index = top
+        for _ in range(screen):
+            index = tree.indexAbove(index)
+            if not index.isValid():
+                break
+            nearby.append(self.proxy.row_id(index))
+        index = top
+        for row in range(2 * screen):
+            (visible if row < screen else nearby).append(self.proxy.row_id(index))
+            index = tree.indexBelow(index)
+            if not index.isValid():
+                break
+        # Folder rows have no row id
+        return [r for r in visible if r is not None], [r for r in nearby if r is not None]
+
+    def probe_visible_rows(self):
+        """
+        Queues the unprobed rows on screen, then those of the folder under the mouse and a screen
+        either side. Worked out again whenever the view changes, so rows that went off screen before
+        their turn are dropped and only probed if they come back or are selected for conversion.
+        While a filter is set every row is queued already, see apply_filters.
+        """
+        if self.proxy.filtering():
+            return
+        model = self.model
+        visible, nearby = self.visible_rows()
+        hovered = model.children[model.folder_numbers[self.hovered_folder]] if self.hovered_folder in model.folder_numbers else []
+        self.probe_queue.forget((PROBE_VISIBLE, PROBE_HOVERED, PROBE_NEARBY))
+        for row_ids, priority in ((visible, PROBE_VISIBLE), (hovered, PROBE_HOVERED), (nearby, PROBE_NEARBY)):
+            self.probe_queue.request([model.paths[r] for r in row_ids if model.probe_state[r] == UNPROBED], priority)
+        self.update_probe_status()
+
+    def probe_first(self, row_ids, action):
+        # Probes the unprobed rows ahead of everything else and runs action once they're in; False if there were none
+        paths = [self.model.paths[r] for r in row_ids if self.model.probe_state[r] == UNPROBED]
+        if not paths:
+            return False
+        self.awaited_paths = set(paths)
+        self.after_probe = action
+        self.probe_queue.request(paths, PROBE_SELECTED)
+        self.statusBar().showMessage(f"Probing {len(paths)} selected videos first...")
+        self.update_probe_status()
+        return True
 
-        # Set the model's header labels
-        self.model.setHorizontalHeaderLabels(headers)
+    def checked_probed_rows(self):
+        # Ticked rows whose probe failed can't be encoded
+        rows = self.model.checked_rows()
+        failed = [r for r in rows if self.model.probe_state[r] == PROBE_FAILED]
+        if failed:
+            print(f"Skipping {len(failed)} selected videos that could not be probed")
+        return [r for r in rows if self.model.probe_state[r] == PROBED]
+
+    def update_probe_status(self):
+        self.cancelScanButton.setEnabled(self.probe_queue.pending() > 0 or self.after_probe is not None)
+
+    def cancel_probe(self):
+        print("Cancelling scan...")
+        self.probe_queue.forget(range(PROBE_FILTERED + 1))
+        self.awaited_paths = set()
+        self.after_probe = None
+        self.statusBar().clearMessage()
+        self.update_probe_status()
+
+    def on_video_probed(self, video, video_info):
+        self.probed_count += 1
+        print(f"Video {self.probed_count} / {len(self.model.paths)} - {os.path.basename(video)}")
+        if video_info is None:
+            print(f"Failed to retrieve info for {video}. Skipping.")
+        self.probed_rows.append((video, video_info))
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(PROBE_FLUSH_MS)
+
+    def flush_probed_rows(self):
+        # Planned as a batch with one cache query; only the rows that arrived are filled in and greyed out
+        if not self.probed_rows:
+            return
+        probed_rows, self.probed_rows = self.probed_rows, []
+        failed = [video for video, video_info in probed_rows if video_info is None]
+        probed_rows = [(video, video_info) for video, video_info in probed_rows if video_info is not None]
+        codecs = [self.video_codec(video, video_info) for video, video_info in probed_rows]
+        export_settings = plan_exports([video_info for _, video_info in probed_rows], use_codec=codecs)
+        for settings, codec in zip(export_settings, codecs):
+            set_rate_control(settings, self.rate_control, codec, self.max_bitrate_factor)
+        # Uses an earlier trial-encode prediction if there is one, otherwise the bitrate estimate
+        converted_file_data = cached_file_sizes([
+            (video, video_info, settings, codec)
+            for (video, video_info), settings, codec in zip(probed_rows, export_settings, codecs)
+        ], self.probe_cache)
+        self.model.set_video_info([
+            (video, video_info, settings, file_data)
+            for (video, video_info), settings, file_data in zip(probed_rows, export_settings, converted_file_data)
+        ], failed)
+
+        videos = [video for video, _ in probed_rows] + failed
+        row_ids = [self.model.row_ids[video] for video in videos]
+        was_greyed = {r for r in row_ids if self.model.greyed[r]}
+        self.grey_out_rows(row_ids)
+        # Ticked before they were probed, e.g. by Select All, and not worth converting after all
+        unticked = [r for r in row_ids if self.model.greyed[r] and r not in was_greyed and self.model.checks['Select'][r]]
+        if unticked:
+            print(f"Unticked {len(unticked)} selected videos that turned out not to be worth converting")
+            self.model.clear_checks(unticked)
+        if self.proxy.filtering() and not self.filter_timer.isActive():
+            self.filter_timer.start(FILTER_REFRESH_MS)
+
+        self.awaited_paths.difference_update(videos)
+        if self.after_probe is not None and not self.awaited_paths:
+            after_probe, self.after_probe = self.after_probe, None
+            self.statusBar().clearMessage()
+            after_probe()
+        self.update_probe_status()
 
     def build_folder_structure(self, path):
         folder_structure = {}
-        videos_list = parse_videos(path)
+        videos_list, old_pairs = self.library_index.scan(path)
+        self.old_pairs.update(old_pairs)
+        for old_paths in old_pairs.values():
+            self.old_files.update(old_paths)
         for video_path in videos_list:
             folder_path = os.path.dirname(video_path)
             folder_structure.setdefault(folder_path, []).append(video_path)
         return folder_structure
 
     def populate_folders(self, folder_structure):
-        folder_counter = 0
         for folder, videos in folder_structure.items():
-            folder_item = QStandardItem(os.path.basename(folder))
-
-            # Folder-level 'Select All' checkbox
-            select_all_item = QStandardItem()
-            select_all_item.setCheckable(True)
-            select_all_item.setCheckState(Qt.Unchecked)
-
-            # Folder-level 'Force HQ All' checkbox
-            force_hq_all_item = QStandardItem()
-            force_hq_all_item.setCheckable(True)
-            force_hq_all_item.setCheckState(Qt.Unchecked)
-
-            # Add folder item to the data of input bitrate item
-            item_input_bitrate = QStandardItem()
-            item_input_bitrate.setEditable(True)
-            item_input_bitrate.setData(folder_item, Qt.UserRole)  # Linking to parent folder
-
-            folder_row_items = [
-                folder_item,  # Folder name
-                select_all_item,  # Select All checkbox
-                force_hq_all_item,  # Force HQ All checkbox
-                item_input_bitrate,  # input bitrate item
-            ]
-            
-            # Store the folder item in the checkbox items for later reference
-            select_all_item.setData(folder_item, Qt.UserRole)
-            force_hq_all_item.setData(folder_item, Qt.UserRole)
-            
-            self.model.appendRow(folder_row_items)
-            folder_index = self.model.indexFromItem(folder_item)
-            self.tree.expand(folder_index)  # Expands the folder row
-
-            video_counter = 0
-            folder_counter += 1
-            print(f"==={os.path.basename(os.path.dirname(folder))}===")
-            print(f"===({folder_counter} / {len(folder_structure)})==={os.path.basename(folder)}===")
-            for video in videos:
-                video_counter += 1
-                print(f"Video {video_counter} / {len(videos)} - {os.path.basename(video)}")
-                video_row_items = self.create_video_row_items(video)
-                folder_item.appendRow(video_row_items)
-    
-    def format_columns(self, video_row_items):
-        for col, item in enumerate(video_row_items):
-            # Apply bold font to certain columns
-            if col in [self.COL_RATING, self.COL_NEW_BIT_RATE, self.COL_EST_NEW_SIZE, self.COL_COMPRESSION_PERCENT, self.COL_BIT_RATE, self.COL_SIZE_MB]:
-                self.apply_bold_font(item)
-
-            # Apply color to certain columns
-            if col in [self.COL_NEW_BIT_RATE, self.COL_EST_NEW_SIZE, self.COL_COMPRESSION_PERCENT]:
-                item.setForeground(QBrush(QColor('green')))
-            elif col in [self.COL_BIT_RATE, self.COL_SIZE_MB]:
-                item.setForeground(QBrush(QColor('red')))
-
-            # Grey out certain columns
-            if col in [self.COL_DURATION, self.COL_DIMENSIONS, self.COL_FPS, self.COL_CODEC, self.COL_NEW_CODEC]:
-                item.setForeground(QBrush(QColor('grey')))
-
-    def apply_bold_font(self, item):
-        font = QFont()
-        font.setBold(True)
-        item.setFont(font)
-
-    def grey_out_rows(self):
-        grey_brush = QBrush(QColor('grey'))
-        font = QFont()
-        font = QFont()
-        font.setStrikeOut(True)
-
-        for folder_row in range(self.model.rowCount()):
-            folder_item = self.model.item(folder_row)
-            for video_row in range(folder_item.rowCount()):
-                video_item = folder_item.child(video_row, self.COL_NAME)
-                base_name, _ = os.path.splitext(video_item.text())
-                old_file_name = f"{base_name}_OLD"
-
-                compression_ratio_item = folder_item.child(video_row, self.COL_COMPRESSION_PERCENT)
-                compression_ratio = self.parse_compression_ratio(compression_ratio_item.text()) if compression_ratio_item else 100.0
-
-                if self.check_old_file_exists(folder_item, old_file_name):
-                    self.update_row_style(folder_item, video_row, grey_brush, font)
-                    if old_file_name:
-                        self.update_row_style_for_old_file(folder_item, old_file_name, grey_brush, font)
-                elif compression_ratio < 10.0:
-                    self.update_row_style(folder_item, video_row, grey_brush, font)
-
-    def check_old_file_exists(self, folder_item, old_file_name):
-        for row in range(folder_item.rowCount()):
-            item = folder_item.child(row, self.COL_NAME)
-            if item and old_file_name in item.text():
-                return True
-        return False
-
-    def parse_compression_ratio(self, ratio_str):
-        try:
-            return float(ratio_str.rstrip('%'))
-        except ValueError:
-            return 100.0
-
-    def update_row_style(self, folder_item, row, brush, font):
-        for col in range(self.model.columnCount()):
-            item = folder_item.child(row, col)
-            if item:
-                item.setForeground(brush)
-                item.setFont(font)
-
-    def update_row_style_for_old_file(self, folder_item, old_file_name, brush, font):
-        for row in range(folder_item.rowCount()):
-            item = folder_item.child(row, self.COL_NAME)
-            if item and old_file_name in item.text():
-                self.update_row_style(folder_item, row, brush, font)
-
-    def create_video_row_items(self, video):
-        video_info = get_video_info(video)
-        export_settings = get_export_bitrate(video_info)
-        converted_file_data = estimate_new_file_size(video_info, export_settings)
-        new_file_size = converted_file_data['new_file_size_mb']
-        converted_file_name = save_new_filename(video)
-        renamed_old_file_name = old_file_new_name(video)
-
-        item_select = QStandardItem()
-        item_select.setCheckable(True)
-        item_select.setCheckState(Qt.Unchecked)
-
-        item_force_hq = QStandardItem()
-        item_force_hq.setCheckable(True)
-        item_force_hq.setCheckState(Qt.Unchecked)
-
-        item_input_bitrate = QStandardItem()  # Create an empty item for input bitrate
-        item_input_bitrate.setEditable(True)  # Make the item editable
-
-        # Define a dictionary to map headers to the corresponding QStandardItem creation logic
-        header_to_item = {
-            'Name': QStandardItem(os.path.basename(video)),
-            'Select': item_select,
-            'Force HQ': item_force_hq,
-            'Input Bitrate': item_input_bitrate,  # Assuming this is how you want to handle it
-            'Rating': QStandardItem(str(video_info['rating'])),
-            'Duration': QStandardItem(video_info['duration_str'].split('.')[0]),
-            'Dimensions': QStandardItem(video_info['dimensions']),
-            'FPS': QStandardItem(str(video_info['fps'])),
-            'Codec': QStandardItem(video_info['video_codec']),
-            'Bit Rate': QStandardItem(str(video_info['video_bitrate'])),
-            'Size (MB)': QStandardItem(f"{video_info['size_mb']} MB"),
-            'New Codec': QStandardItem(export_settings['new_codec']),
-            'New Bit Rate': QStandardItem(str(export_settings['new_bitrate'])),
-            'Est. New Size': QStandardItem(str(f'{new_file_size} MB')),
-            'Compression %': QStandardItem(converted_file_data['compression_ratio']),
-            'Converted File Name': QStandardItem(converted_file_name),
-            'Renamed Old File Name': QStandardItem(renamed_old_file_name),
-            'Full File Path': QStandardItem(video),
-            'Date Modified': QStandardItem(video_info['date_modified']),
-        }
-
-        # Create video_row_items list using the order in headers_mapping
-        video_row_items = [header_to_item[header] for header in self.headers_order]
+            if folder in self.model.folder_numbers:
+                continue
+            # Folder rows have their own Select, Force HQ and Input Bitrate cells that apply to the whole folder
+            self.model.add_folder(folder)
+            self.model.add_videos(videos)
+            self.tree.expand(self.proxy.mapFromSource(self.model.folder_index(folder)))  # Expands the folder row
 
-        self.format_columns(video_row_items)
-        
-        return video_row_items
+            print(f"==={os.path.basename(os.path.dirname(folder))}===")
+            print(f"===({len(self.model.folders)})==={os.path.basename(folder)} - {len(videos)} videos===")
+
+    def grey_out_rows(self, row_ids=None):
+        # Greys out the given row ids, all rows by default; unprobed rows only if they are converted or _OLD files
+        model = self.model
+        rows = range(len(model.paths)) if row_ids is None else row_ids
+        greyed = []
+        for row_id in rows:
+            video_path = model.paths[row_id]
+            # The library index already paired each converted file with its _OLD files
+            if video_path in self.old_pairs or video_path in self.old_files:
+                greyed.append(row_id)
+                continue
+            probe_state = model.probe_state[row_id]
+            if probe_state != PROBED:
+                if probe_state == PROBE_FAILED:
+                    greyed.append(row_id)
+                continue
+            if model.new_codecs[row_id] == 'copy':
+                # A remux saves nothing but only takes seconds, so it is offered unless the file is already in an mp4
+                if not needs_remux(video_path) or video_path in self.not_worth_it:
+                    greyed.append(row_id)
+                continue
+            compression_ratio = model.compression[row_id]
+            if compression_ratio != compression_ratio:
+                compression_ratio = 100.0
+            # No bitrate in the table for this file, the tooltip says why
+            new_bitrate = model.new_bitrate[row_id]
+            unmatched = new_bitrate != new_bitrate
+            if compression_ratio < 10.0 or unmatched or video_path in self.not_worth_it:
+                greyed.append(row_id)
+        model.set_greyed(greyed, None if row_ids is None else rows)
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication([])
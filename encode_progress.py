@@ -0,0 +1,227 @@
+import re
+import json
+import time
+import threading
+
+
+def parse_ffmpeg_progress(lines, duration=None):
+    """
+    Parses ffmpeg's "-progress pipe:1" key=value stream.
+    Yields a progress dict each time ffmpeg finishes a block (progress=continue/end).
+    """
+    block = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        block[key] = value.strip()
+        if key != 'progress':
+            continue
+
+        progress = {'fps': None, 'speed': None, 'percent': None, 'eta_seconds': None, 'bytes_out': None}
+        try:
+            progress['fps'] = float(block.get('fps', ''))
+        except ValueError:
+            pass
+        try:
+            progress['speed'] = float(block.get('speed', '').rstrip('x'))
+        except ValueError:
+            pass
+        try:
+            progress['bytes_out'] = int(block.get('total_size', ''))
+        except ValueError:
+            pass
+        try:
+            # out_time_us is the position reached in the output, in microseconds
+            out_time = int(block.get('out_time_us', '')) / 1e6
+        except ValueError:
+            out_time = None
+        if out_time is not None and duration:
+            progress['percent'] = min(100.0, max(0.0, out_time / duration * 100))
+            if progress['speed']:
+                progress['eta_seconds'] = max(0.0, (duration - out_time) / progress['speed'])
+        if value == 'end':
+            progress['percent'] = 100.0
+            progress['eta_seconds'] = 0.0
+        yield progress
+        block = {}
+
+
+# Plain HandBrakeCLI status line, e.g.
+# "Encoding: task 1 of 1, 45.67 % (30.12 fps, avg 29.80 fps, ETA 00h01m02s)"
+HANDBRAKE_STATUS = re.compile(
+    r'Encoding: task \d+ of \d+, (?P<percent>[\d.]+) %'
+    r'(?: \((?P<fps>[\d.]+) fps, avg (?P<avg_fps>[\d.]+) fps, ETA (?P<h>\d+)h(?P<m>\d+)m(?P<s>\d+)s\))?'
+)
+
+def parse_handbrake_progress(lines, source_fps=None):
+    """
+    Parses HandBrakeCLI output, either the "--json" Progress blocks or the plain status lines.
+    Yields a progress dict for each update.
+    """
+    json_lines = None
+    for line in lines:
+        # Plain status updates are separated by carriage returns, not newlines
+        for chunk in line.split('\r'):
+            if json_lines is None:
+                if chunk.startswith('Progress:'):
+                    json_lines = [chunk[len('Progress:'):]]
+                else:
+                    progress = handbrake_status_progress(chunk, source_fps)
+                    if progress is not None:
+                        yield progress
+                    continue
+            else:
+                json_lines.append(chunk)
+
+            # JSON blocks span several lines, parse once the braces balance
+            text = "\n".join(json_lines)
+            if text.count('{') and text.count('{') == text.count('}'):
+                json_lines = None
+                try:
+                    progress = handbrake_json_progress(json.loads(text), source_fps)
+                except ValueError:
+                    continue
+                if progress is not None:
+                    yield progress
+
+def handbrake_status_progress(line, source_fps=None):
+    match = HANDBRAKE_STATUS.search(line)
+    if not match:
+        return None
+    fps = float(match.group('avg_fps') or 0) or None
+    eta = None
+    if match.group('h') is not None:
+        eta = int(match.group('h')) * 3600 + int(match.group('m')) * 60 + int(match.group('s'))
+    return {
+        'fps': fps,
+        'speed': fps / source_fps if fps and source_fps else None,
+        'percent': float(match.group('percent')),
+        'eta_seconds': eta,
+        'bytes_out': None,
+    }
+
+def handbrake_json_progress(data, source_fps=None):
+    working = data.get('Working')
+    if data.get('State') != 'WORKING' or not working:
+        if data.get('State') == 'WORKDONE':
+            return {'fps': None, 'speed': None, 'percent': 100.0, 'eta_seconds': 0.0, 'bytes_out': None}
+        return None
+    fps = working.get('RateAvg') or working.get('Rate') or None
+    return {
+        'fps': fps,
+        'speed': fps / source_fps if fps and source_fps else None,
+        'percent': working.get('Progress', 0.0) * 100,
+        'eta_seconds': working.get('ETASeconds'),
+        'bytes_out': None,
+    }
+
+
+class ProgressTracker:
+    """
+    Collects progress from every running encode and passes it on to a single callback.
+    The callback is called as callback(job_progress, totals) from the encode threads,
+    where totals holds the aggregate percent, bytes in and bytes out for the batch.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # Encode seconds and media seconds per resolution/fps/quality tier, for the summary
+        self.tier_times = {}
+
+    def start_job(self, input_file, source_bytes, duration, tier=None):
+        with self.lock:
+            self.jobs[input_file] = {
+                'input_file': input_file,
+                'tier': tier,
+                'source_bytes': source_bytes,
+                'duration': duration,
+                'started': time.time(),
+                'percent': 0.0,
+                'fps': None,
+                'speed': None,
+                'eta_seconds': None,
+                'bytes_out': 0,
+                'done': False,
+            }
+
+    def update(self, input_file, progress):
+        with self.lock:
+            job = self.jobs[input_file]
+            for key, value in progress.items():
+                if value is not None:
+                    job[key] = value
+            job_progress = dict(job)
+            totals = self.totals_locked()
+        if self.callback is not None:
+            self.callback(job_progress, totals)
+
+    def finish_job(self, input_file, bytes_out=None):
+        with self.lock:
+            job = self.jobs[input_file]
+            job['done'] = True
+            job['percent'] = 100.0
+            job['eta_seconds'] = 0.0
+            if bytes_out is not None:
+                job['bytes_out'] = bytes_out
+            elapsed = time.time() - job['started']
+            encode_seconds, media_seconds = self.tier_times.get(job['tier'], (0.0, 0.0))
+            self.tier_times[job['tier']] = (encode_seconds + elapsed, media_seconds + (job['duration'] or 0))
+            job_progress = dict(job)
+            totals = self.totals_locked()
+        if self.callback is not None:
+            self.callback(job_progress, totals)
+
+    def totals_locked(self):
+        bytes_total = sum(job['source_bytes'] for job in self.jobs.values())
+        # Bytes in is how much of each source the encoders have got through
+        bytes_in = sum(job['source_bytes'] * job['percent'] / 100 for job in self.jobs.values())
+        return {
+            'jobs': len(self.jobs),
+            'jobs_done': sum(1 for job in self.jobs.values() if job['done']),
+            'bytes_in': bytes_in,
+            'bytes_out': sum(job['bytes_out'] for job in self.jobs.values()),
+            'bytes_total': bytes_total,
+            'percent': bytes_in / bytes_total * 100 if bytes_total else 0.0,
+        }
+
+    def totals(self):
+        with self.lock:
+            return self.totals_locked()
+
+    def tier_summary(self):
+        # Speed relative to real time per tier, e.g. 2.0 means a minute of footage took 30 seconds
+        with self.lock:
+            return {
+                tier: (media_seconds / encode_seconds if encode_seconds else None)
+                for tier, (encode_seconds, media_seconds) in self.tier_times.items()
+            }
+
+
+class ConsoleProgressPrinter:
+    """Progress callback for the headless scripts, prints a status line at most every interval seconds."""
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.last_print = 0
+
+    def __call__(self, job_progress, totals):
+        now = time.time()
+        if now - self.last_print < self.interval and not job_progress['done']:
+            return
+        self.last_print = now
+        print(format_progress(job_progress, totals))
+
+
+def format_progress(job_progress, totals):
+    fps = f"{job_progress['fps']:.1f} fps" if job_progress['fps'] else "? fps"
+    speed = f"{job_progress['speed']:.2f}x" if job_progress['speed'] else "?x"
+    eta = job_progress['eta_seconds']
+    eta = f"ETA {int(eta) // 3600}:{int(eta) % 3600 // 60:02d}:{int(eta) % 60:02d}" if eta is not None else "ETA ?"
+    return (
+        f"[{totals['jobs_done']}/{totals['jobs']} done, {totals['percent']:.1f}%, "
+        f"{totals['bytes_in'] / 1e6:.0f} MB in / {totals['bytes_out'] / 1e6:.0f} MB out] "
+        f"{job_progress['input_file']}: {job_progress['percent']:.1f}% {fps} {speed} {eta}"
+    )
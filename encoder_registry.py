@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import socket
+import shutil
+import threading
+import subprocess
+
+# Encoder backends, best first. 'handbrake' and 'ffmpeg' are the encoder names in each program,
+# hardware encoders are only listed as usable if a test frame encodes. 'crf' is the constant quality
+# used per table quality in CRF mode, on the encoder's own scale (VideoToolbox's goes up with quality)
+ENCODER_BACKENDS = {
+    'mac': {'handbrake': 'vt_h265', 'ffmpeg': 'hevc_videotoolbox', 'codec': 'hevc', 'hardware': True,
+            'crf': {'LQ': 55, 'HQ': 65}},
+    'nvidia': {'handbrake': 'nvenc_h265', 'ffmpeg': 'hevc_nvenc', 'codec': 'hevc', 'hardware': True,
+               'crf': {'LQ': 28, 'HQ': 24}},
+    'plain': {'handbrake': 'x265', 'ffmpeg': 'libx265', 'codec': 'hevc', 'hardware': False,
+              'crf': {'LQ': 26, 'HQ': 22}},
+    # ffmpeg's default SVT-AV1 preset trades too much size for speed for archiving
+    'svtav1': {'handbrake': 'svt_av1', 'ffmpeg': 'libsvtav1', 'codec': 'av1', 'hardware': False,
+               'ffmpeg_args': ['-preset', '8'], 'crf': {'LQ': 36, 'HQ': 30}},
+    'x264': {'handbrake': 'x264', 'ffmpeg': 'libx264', 'codec': 'h264', 'hardware': False,
+             'crf': {'LQ': 23, 'HQ': 19}},
+    # libaom's default speed takes hours per minute of video
+    'aom': {'handbrake': None, 'ffmpeg': 'libaom-av1', 'codec': 'av1', 'hardware': False,
+            'ffmpeg_args': ['-cpu-used', '6', '-row-mt', '1'], 'crf': {'LQ': 34, 'HQ': 28}},
+}
+# Picks the best backend this host has
+AUTO_BACKEND = 'auto'
+CODEC_CHOICES = [AUTO_BACKEND] + list(ENCODER_BACKENDS)
+# Used when neither program could be run, so the error comes from the encode itself
+FALLBACK_BACKEND = 'plain'
+PROGRAMS = {'ffmpeg': 'ffmpeg', 'handbrake': 'HandBrakeCLI'}
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def encoders_cache_path(host=None):
+    # One file per host name, like the x265 profile, the programs differ between nodes sharing a checkout
+    host = host or socket.gethostname() or 'localhost'
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f".compress_vid_encoders_{host}.json")
+
+
+def program_fingerprint():
+    # Path and modification time of each program, the cache is redone when either is installed or updated
+    fingerprint = {}
+    for program, command in PROGRAMS.items():
+        path = shutil.which(command)
+        try:
+            fingerprint[program] = [path, os.path.getmtime(path)] if path else None
+        except OSError:
+            fingerprint[program] = None
+    return fingerprint
+
+
+def run_output(cmd):
+    try:
+        completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   errors='replace', timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return ''
+    return completed.stdout
+
+
+def ffmpeg_encoders():
+    # Video encoder names from "ffmpeg -encoders", lines look like " V....D libx265   libx265 H.265 / HEVC"
+    names = set()
+    for line in run_output(['ffmpeg', '-hide_banner', '-encoders']).splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith('V'):
+            names.add(parts[1])
+    return names
+
+
+def handbrake_encoders():
+    # Video encoder names from the list below "-e, --encoder" in "HandBrakeCLI --help"
+    names = set()
+    in_list = False
+    for line in run_output(['HandBrakeCLI', '--help']).splitlines():
+        stripped = line.strip()
+        if not in_list:
+            in_list = '--encoder ' in stripped or stripped.endswith('--encoder')
+            continue
+        if stripped.startswith('-'):
+            break
+        if re.fullmatch(r'[\w.-]+', stripped):
+            names.add(stripped)
+    return names
+
+
+def encodes_test_frame(encoder):
+    # Hardware encoders are compiled in whether or not this machine has the hardware
+    cmd = ['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+           '-frames:v', '1', '-c:v', encoder, '-f', 'null', '-']
+    try:
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def detect_backends():
+    # {backend: {'ffmpeg': usable, 'handbrake': usable}}, runs the programs
+    in_ffmpeg = ffmpeg_encoders()
+    in_handbrake = handbrake_encoders()
+    backends = {}
+    for name, backend in ENCODER_BACKENDS.items():
+        ffmpeg_ok = backend['ffmpeg'] in in_ffmpeg
+        if ffmpeg_ok and backend['hardware']:
+            ffmpeg_ok = encodes_test_frame(backend['ffmpeg'])
+        handbrake_ok = backend['handbrake'] in in_handbrake
+        if handbrake_ok and backend['hardware'] and backend['ffmpeg'] in in_ffmpeg:
+            # Same hardware for both programs, ffmpeg's test frame stands for HandBrake too
+            handbrake_ok = ffmpeg_ok
+        backends[name] = {'ffmpeg': ffmpeg_ok, 'handbrake': handbrake_ok}
+    return backends
+
+
+def load_backends(refresh=False, path=None):
+    """
+    Returns {backend: {'ffmpeg': usable, 'handbrake': usable}} for every ENCODER_BACKENDS entry.
+    Worked out once per host from "ffmpeg -encoders" and "HandBrakeCLI --help" and kept on disk
+    until either program changes; read once per process. refresh=True detects again.
+    """
+    global _backends
+    path = path or encoders_cache_path()
+    with _backends_lock:
+        if _backends is not None and not refresh:
+            return _backends
+        fingerprint = program_fingerprint()
+        cached = None
+        if not refresh:
+            try:
+                with open(path) as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                cached = None
+        if cached and cached.get('fingerprint') == fingerprint and set(cached.get('backends', {})) == set(ENCODER_BACKENDS):
+            _backends = cached['backends']
+            return _backends
+        _backends = detect_backends()
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'backends': _backends}, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save the encoder list: {e}")
+        return _backends
+
+
+def usable_backends(program=None):
+    # Backend names usable with 'ffmpeg', 'handbrake' or (None) either of them, best first
+    backends = load_backends()
+    return [name for name, usable in backends.items()
+            if (usable[program] if program else usable['ffmpeg'] or usable['handbrake'])]
+
+
+def best_backend(program=None):
+    # The first usable backend, FALLBACK_BACKEND if neither program could be run
+    usable = usable_backends(program)
+    if not usable and program:
+        usable = usable_backends()
+    return usable[0] if usable else FALLBACK_BACKEND
+
+
+def backend_for(use_codec, use_ffmpeg=False):
+    # The backend a use_codec option stands for with ffmpeg or HandBrakeCLI, 'auto' is the best one that program has
+    return best_backend('ffmpeg' if use_ffmpeg else 'handbrake') if use_codec == AUTO_BACKEND else use_codec
+
+
+def resolve_backend(use_codec, use_ffmpeg=False):
+    """
+    Returns (backend, use_ffmpeg) to encode with. 'auto' becomes the best backend for the program,
+    and a backend the program doesn't have moves to the other program if that one has it.
+    """
+    program = 'ffmpeg' if use_ffmpeg else 'handbrake'
+    backend = backend_for(use_codec, use_ffmpeg)
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Invalid codec option {use_codec!r}. Choose {', '.join([AUTO_BACKEND] + list(ENCODER_BACKENDS))}.")
+    usable = load_backends()[backend]
+    if not usable[program]:
+        other = 'handbrake' if use_ffmpeg else 'ffmpeg'
+        if usable[other]:
+            print(f"{PROGRAMS[program]} can't encode with {backend}, using {PROGRAMS[other]}")
+            return backend, not use_ffmpeg
+    return backend, use_ffmpeg
+
+
+def backend_problem(use_codec):
+    # Why use_codec can't encode on this host, None if it can; checked at startup instead of failing every job
+    if use_codec == AUTO_BACKEND:
+        return None if usable_backends() else "neither ffmpeg nor HandBrakeCLI can encode on this host"
+    if use_codec not in usable_backends():
+        backend = ENCODER_BACKENDS[use_codec]
+        usable = ', '.join(usable_backends()) or 'none'
+        return f"{backend['ffmpeg']} / {backend['handbrake'] or '-'} isn't usable on this host (usable: {usable})"
+    return None
+
+
+def table_codec(backend):
+    # Key of the backend's bitrates in the export table: its HandBrake encoder name, or ffmpeg's if HandBrake has none
+    backend = ENCODER_BACKENDS[backend]
+    return backend['handbrake'] or backend['ffmpeg']
+
+
+def table_formats():
+    # {export table key: output codec}, e.g. 'svt_av1': 'av1'
+    return {table_codec(name): backend['codec'] for name, backend in ENCODER_BACKENDS.items()}
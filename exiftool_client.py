@@ -0,0 +1,168 @@
+import os
+import json
+import queue
+import atexit
+import threading
+import subprocess
+
+
+class ExifTool:
+    """
+    A single exiftool process started in -stay_open mode.
+    Commands are written to its stdin as argument files, so Perl only starts once.
+    Not thread-safe, use ExifToolPool to share processes between threads.
+    """
+
+    def __init__(self, executable='exiftool'):
+        self.process = subprocess.Popen(
+            [executable, '-stay_open', 'True', '-@', '-'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+        )
+        self.sequence = 0
+        # stderr is drained all the time by a thread, if it filled up while we wait on stdout exiftool would
+        # block writing warnings and never print the stdout marker
+        self.stderr_lines = queue.Queue()
+        self.stderr_reader = threading.Thread(target=self.drain_stderr, daemon=True)
+        self.stderr_reader.start()
+
+    def drain_stderr(self):
+        for line in self.process.stderr:
+            self.stderr_lines.put(line)
+        # None tells execute exiftool has exited
+        self.stderr_lines.put(None)
+
+    def execute(self, *args):
+        # Returns (stdout, stderr) for one exiftool command
+        self.sequence += 1
+        ready = f"{{ready{self.sequence}}}"
+        # -echo4 prints the marker on stderr once the command is done, -execute prints it on stdout
+        lines = [str(arg) for arg in args] + ['-echo4', ready, f'-execute{self.sequence}']
+        self.process.stdin.write("\n".join(lines) + "\n")
+        self.process.stdin.flush()
+        stdout = self.read_until(self.process.stdout.readline, ready)
+        stderr = self.read_until(self.stderr_lines.get, ready)
+        return stdout, stderr
+
+    def read_until(self, next_line, marker):
+        output = []
+        while True:
+            line = next_line()
+            if not line:
+                raise RuntimeError("exiftool exited unexpectedly")
+            if line.rstrip('\r\n') == marker:
+                return "".join(output)
+            output.append(line)
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write("-stay_open\nFalse\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+
+
+class ExifToolPool:
+    """
+    A small pool of long-lived exiftool processes shared by the probe and encode threads.
+    Processes are started on first use, so an idle pool costs nothing.
+    """
+
+    def __init__(self, size=min(4, os.cpu_count() or 1), executable='exiftool'):
+        self.size = size
+        self.executable = executable
+        self.idle = queue.Queue()
+        self.started = 0
+        self.lock = threading.Lock()
+        self.all_processes = []
+        # Set once the executable turns out not to exist
+        self.missing = None
+
+    def acquire(self):
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                if self.missing:
+                    # Found missing once already, don't try to start it for every file
+                    raise FileNotFoundError(self.missing)
+                if self.started < self.size:
+                    self.started += 1
+                    try:
+                        exiftool = ExifTool(self.executable)
+                    except OSError as e:
+                        self.started -= 1
+                        if isinstance(e, FileNotFoundError):
+                            self.missing = f"{self.executable} not found, is exiftool installed?"
+                        raise
+                    self.all_processes.append(exiftool)
+                    return exiftool
+            try:
+                # Checks again now and then, a broken process may have been dropped and can be replaced
+                return self.idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    def execute(self, *args):
+        exiftool = self.acquire()
+        try:
+            result = exiftool.execute(*args)
+        except (OSError, RuntimeError):
+            # Drop the broken process, a fresh one is started on the next call
+            exiftool.close()
+            with self.lock:
+                self.started -= 1
+                self.all_processes.remove(exiftool)
+            raise
+        self.idle.put(exiftool)
+        return result
+
+    def read_tags(self, files, tags=()):
+        """
+        Reads tags from many files with a single exiftool command.
+        Returns a dict of file path, as given, -> tag dict, with all tags read if none are given.
+        Files exiftool couldn't read are missing from it.
+        """
+        files = list(files)
+        if not files:
+            return {}
+        stdout, stderr = self.execute('-json', *[f'-{tag}' for tag in tags], *files)
+        # Unreadable files are left out of the output, so match on SourceFile rather than position.
+        # exiftool may write SourceFile differently (slashes on Windows), so both sides are normalised
+        requested = {os.path.normcase(os.path.abspath(f)): f for f in files}
+        results = {}
+        for data in (json.loads(stdout) if stdout.strip() else []):
+            source = data.get('SourceFile')
+            if source:
+                source = os.path.normcase(os.path.abspath(source))
+                results[requested.get(source, data['SourceFile'])] = data
+        return results
+
+    def close(self):
+        with self.lock:
+            for exiftool in self.all_processes:
+                exiftool.close()
+            self.all_processes = []
+            self.started = 0
+            self.idle = queue.Queue()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_exiftool():
+    # Process-wide pool used by get_video_info, copy_exif_data and update_timestamp
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ExifToolPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
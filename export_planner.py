@@ -0,0 +1,122 @@
+# Frame size each resolution in ffmpeg_settings is matched against, long side first; either orientation matches
+RESOLUTION_SIZES = {'4k': (3840, 2160), '2.7k': (2704, 1520), '1080p': (1920, 1080)}
+TOLERANCE = 0.10  # 10%
+# Encoder whose bitrates are used for encoders the table has no bitrates for
+EXPORT_CODEC = 'vt_h265'
+# Output codec of encoders not in the planner's formats
+DEFAULT_FORMAT = 'hevc'
+# ffprobe codec names of sources that are already in the output codec
+HEVC_CODECS = ('hevc', 'h265')
+# An HEVC source up to this much above the table bitrate isn't worth re-encoding, the output would be about as big
+COPY_MARGIN = 0.10  # 10%
+# Cap on remembered lookups, only reached with very unusual libraries
+MAX_ENTRIES = 100000
+
+
+def fps_bucket(fps):
+    # Round fps to the nearest multiple of 30 to match against '30', '60' or '120', 24 & 25 are considered 30
+    if fps is None or fps <= 30:
+        return 30
+    return int(round(fps / 30) * 30)
+
+
+class ExportPlanner:
+    """
+    The export bitrate table (ffmpeg_settings) compiled for lookups: the size bounds of each resolution
+    and the bitrate per (encoder, resolution, frame rate, quality). plan() handles one VideoInfo,
+    plan_many() a whole list. formats maps encoders to the codec they output ({'svt_av1': 'av1'}):
+    an encoder without bitrates of its own uses those of the first encoder in the table with the same
+    output, and only HEVC encoders get stream copies. Build a new planner when the table changes.
+    """
+
+    def __init__(self, settings, tolerance=TOLERANCE, codec=EXPORT_CODEC, formats=None):
+        self.codec = codec
+        self.formats = formats or {}
+        # (name, long side min, long side max, short side min, short side max), checked in this order
+        self.bounds = [
+            (name, long_side * (1 - tolerance), long_side * (1 + tolerance),
+             short_side * (1 - tolerance), short_side * (1 + tolerance))
+            for name, (long_side, short_side) in RESOLUTION_SIZES.items() if name in settings
+        ]
+        self.bitrates = {}
+        for resolution, frame_rates in settings.items():
+            for frame_rate, codecs in frame_rates.items():
+                for table_codec, qualities in codecs.items():
+                    for quality, bitrate in qualities.items():
+                        self.bitrates[(table_codec, resolution, int(frame_rate), quality)] = float(bitrate)
+        # Output codec -> the first encoder in the table that outputs it
+        self.format_codecs = {}
+        for table_codec, _, _, _ in self.bitrates:
+            self.format_codecs.setdefault(self.formats.get(table_codec, DEFAULT_FORMAT), table_codec)
+        # (width, height, fps, quality, encoder) -> lookup()
+        self.entries = {}
+
+    def resolution(self, width, height):
+        if not width or not height:
+            return None
+        long_side, short_side = max(width, height), min(width, height)
+        for name, long_min, long_max, short_min, short_max in self.bounds:
+            if long_min <= long_side <= long_max and short_min <= short_side <= short_max:
+                return name
+        return None
+
+    def lookup(self, width, height, fps, quality, codec=None):
+        # Returns (tier, table bitrate, reason) for one combination, reason is None when the table has a bitrate.
+        # An encoder without bitrates of its own gets those of an encoder with the same output, else the default encoder's
+        codec = codec or self.codec
+        resolution = self.resolution(width, height)
+        frame_rate = fps_bucket(fps)
+        tier = f"{resolution or 'unmatched'}/{frame_rate}/{quality}"
+        if resolution is None:
+            if not width or not height:
+                return tier, None, "the dimensions are unknown"
+            return tier, None, f"no resolution in the table matches {width}x{height}"
+        table_bitrate = self.bitrates.get((codec, resolution, frame_rate, quality))
+        if table_bitrate is None:
+            same_format = self.format_codecs.get(self.formats.get(codec, DEFAULT_FORMAT))
+            table_bitrate = self.bitrates.get((same_format, resolution, frame_rate, quality))
+        if table_bitrate is None:
+            table_bitrate = self.bitrates.get((self.codec, resolution, frame_rate, quality))
+        if table_bitrate is None:
+            return tier, None, f"no {quality} bitrate for {resolution} at {frame_rate} fps in the table"
+        return tier, table_bitrate, None
+
+    def plan(self, video_info, force_hq=False, codec=None):
+        """
+        Returns the export settings for a VideoInfo, with codec's bitrates from the table (the
+        planner's default encoder if None); 'new_codec' is the encoder they are for. Without a
+        table bitrate new_bitrate is None and 'reason' says why. Sources already in HEVC at or
+        about an HEVC encoder's table bitrate get 'stream_copy' set, their streams only need copying
+        into the mp4; drop it to encode them anyway. Lookups are kept per dimensions, frame rate, quality
+        and encoder, a library only has a handful of those.
+        """
+        # Default quality, HQ if forced or if the video is rated 5 stars
+        quality = 'HQ' if force_hq or (video_info.rating is not None and video_info.rating >= 5) else 'LQ'
+        codec = codec or self.codec
+        key = (video_info.width, video_info.height, video_info.fps, quality, codec)
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= MAX_ENTRIES:
+                self.entries.clear()
+            entry = self.entries[key] = self.lookup(*key)
+        tier, table_bitrate, reason = entry
+        if reason is not None:
+            return {"new_bitrate": None, "new_codec": codec, "tier": tier, "reason": reason}
+        source_bitrate = video_info.video_bitrate
+        export_settings = {
+            # Never go above the source
+            "new_bitrate": min(table_bitrate, source_bitrate) if source_bitrate else table_bitrate,
+            "new_codec": codec,
+            "tier": tier,
+        }
+        if source_bitrate and video_info.video_codec in HEVC_CODECS and self.formats.get(codec, DEFAULT_FORMAT) == 'hevc' \
+                and source_bitrate <= table_bitrate * (1 + COPY_MARGIN):
+            export_settings["stream_copy"] = True
+        return export_settings
+
+    def plan_many(self, video_infos, force_hq=False, codec=None):
+        """Returns plan()'s export settings for each VideoInfo, in order. codec can also be a list, one per VideoInfo."""
+        plan = self.plan
+        if isinstance(codec, list):
+            return [plan(video_info, force_hq, video_codec) for video_info, video_codec in zip(video_infos, codec)]
+        return [plan(video_info, force_hq, codec) for video_info in video_infos]
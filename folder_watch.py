@@ -0,0 +1,227 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from library_index import LibraryIndex, is_video_name
+
+# A file counts as complete once its size and mtime have not changed for this long
+SETTLE_SECONDS = 30
+# Ready files are handed on once no new file has turned up for this long...
+DEBOUNCE_SECONDS = 10
+# ...or once the oldest ready file has waited this long, so a steady trickle still gets processed
+MAX_BATCH_WAIT_SECONDS = 300
+# Rescan interval when inotify isn't available
+POLL_SECONDS = 60
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyBackend:
+    """Watches every folder under the roots with inotify, through libc since the standard library has no binding."""
+
+    def __init__(self, roots):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}
+        try:
+            for root in roots:
+                self.add_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # ENOSPC means fs.inotify.max_user_watches is too low for this tree
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+
+    def add_tree(self, root):
+        # Returns the videos already in the tree, for folders that were moved in whole
+        videos = []
+        for dirpath, dirs, files in os.walk(root):
+            self.add_watch(dirpath)
+            videos.extend(os.path.join(dirpath, name) for name in files if is_video_name(name))
+        return videos
+
+    def changes(self, timeout):
+        # Returns (touched video paths, removed paths, overflowed) for the events within timeout
+        touched = set()
+        removed = set()
+        overflowed = False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return touched, removed, overflowed
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+                directory = self.paths.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            touched.update(self.add_tree(path))
+                        except OSError as e:
+                            print(f"Can't watch {path}: {e}")
+                elif is_video_name(os.path.basename(path)):
+                    if mask & (IN_DELETE | IN_MOVED_FROM):
+                        removed.add(path)
+                    else:
+                        touched.add(path)
+        return touched, removed, overflowed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """Rescans the roots through a LibraryIndex, so each poll only lists the folders that changed."""
+
+    def __init__(self, roots, index=None):
+        self.roots = roots
+        self.index = index or LibraryIndex()
+        self.known = self.scan()
+
+    def scan(self):
+        videos = set()
+        for root in self.roots:
+            videos.update(self.index.scan(root, quiet=True)[0])
+        return videos
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        current = self.scan()
+        touched, removed = current - self.known, self.known - current
+        self.known = current
+        return touched, removed, False
+
+    def close(self):
+        pass
+
+
+class FolderWatcher:
+    """
+    Watches library folders for new or rewritten videos and hands them out in batches
+    once they've stopped changing. Uses inotify on Linux and falls back to polling.
+    ignore, if given, is called with each path and returns True for files to leave alone,
+    e.g. outputs the encoder is still writing.
+    """
+
+    def __init__(self, roots, settle_seconds=SETTLE_SECONDS, debounce_seconds=DEBOUNCE_SECONDS,
+                 poll_seconds=POLL_SECONDS, use_inotify=True, ignore=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.settle_seconds = settle_seconds
+        self.debounce_seconds = debounce_seconds
+        self.poll_seconds = poll_seconds
+        self.ignore = ignore
+        self.backend = None
+        if use_inotify:
+            try:
+                self.backend = InotifyBackend(self.roots)
+                print(f"Watching {len(self.backend.paths)} folders with inotify")
+            except OSError as e:
+                print(f"inotify unavailable ({e}), polling every {poll_seconds}s instead")
+        if self.backend is None:
+            self.backend = PollingBackend(self.roots)
+        # path -> (size, mtime_ns, time the signature last changed)
+        self.candidates = {}
+
+    def rescan(self):
+        # After an inotify queue overflow events were lost, treat every video as possibly new
+        print("Watch events were lost, rescanning")
+        touched = set()
+        for root in self.roots:
+            for dirpath, dirs, files in os.walk(root):
+                touched.update(os.path.join(dirpath, name) for name in files if is_video_name(name))
+        return touched
+
+    def batches(self, stop_event=None):
+        """Yields sorted lists of paths that have settled. Stops when stop_event is set."""
+        ready = set()
+        last_new = time.time()
+        first_ready = None
+        while stop_event is None or not stop_event.is_set():
+            polling = isinstance(self.backend, PollingBackend)
+            timeout = 1.0
+            if polling:
+                timeout = min(self.poll_seconds, self.settle_seconds / 3) if self.candidates else self.poll_seconds
+            touched, removed, overflowed = self.backend.changes(timeout)
+            if overflowed:
+                touched |= self.rescan()
+
+            now = time.time()
+            for path in touched:
+                if self.ignore is not None and self.ignore(path):
+                    continue
+                ready.discard(path)
+                if path not in self.candidates:
+                    self.candidates[path] = (None, None, now)
+                last_new = now
+            for path in removed:
+                self.candidates.pop(path, None)
+                ready.discard(path)
+
+            # A file is complete once its size and mtime have stayed the same for settle_seconds
+            for path, (size, mtime_ns, changed_at) in list(self.candidates.items()):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    del self.candidates[path]
+                    continue
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    self.candidates[path] = (st.st_size, st.st_mtime_ns, now)
+                elif now - changed_at >= self.settle_seconds:
+                    del self.candidates[path]
+                    ready.add(path)
+                    if first_ready is None:
+                        first_ready = now
+
+            if ready and (now - last_new >= self.debounce_seconds or now - first_ready >= MAX_BATCH_WAIT_SECONDS):
+                batch = sorted(ready)
+                ready = set()
+                first_ready = None
+                yield batch
+
+    def close(self):
+        self.backend.close()
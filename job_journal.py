@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".compress_vid_journal.jsonl")
+
+# Stages a file goes through in process_video_job, in order
+STAGES = ['planned', 'encoding', 'encoded', 'metadata', 'renamed', 'deleted']
+
+
+def remove_partial_output(output_file):
+    # Removes an interrupted encode's output, and the segment folder if it was a split encode
+    shutil.rmtree(output_file + '.segments', ignore_errors=True)
+    if os.path.exists(output_file):
+        os.remove(output_file)
+        print(f"Removed partial output {output_file}")
+        return True
+    return False
+
+
+def stage_done(state, stage):
+    # True if a journal state has got at least as far as stage
+    return state is not None and STAGES.index(state['stage']) >= STAGES.index(stage)
+
+
+class JobJournal:
+    """
+    Append-only record of how far each file got through process_video_job.
+    Every stage is written as one JSON line and flushed to disk before the next step starts,
+    so after a crash the last line for a file says which steps are already done.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # Latest state per input file: the stage plus the paths it was using
+        self.states = {}
+        # Converted files by path, input and final name, with their size when they were finished
+        self.finished = {}
+        lines = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the crash, everything before it is still good
+                        continue
+                    lines += 1
+                    self.merge_locked(entry)
+        if lines > 2 * len(self.states) + 1000:
+            self.compact()
+        self.file = open(path, 'a')
+
+    def record(self, input_file, stage, **fields):
+        entry = dict(fields, input_file=input_file, stage=stage, time=time.time())
+        with self.lock:
+            self.merge_locked(entry)
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def merge_locked(self, entry):
+        state = dict(self.states.get(entry['input_file'], {}), **entry)
+        self.states[entry['input_file']] = state
+        if state['stage'] in ('renamed', 'deleted'):
+            self.finished[state['input_file']] = state.get('final_size')
+            self.finished[state.get('final_file')] = state.get('final_size')
+        else:
+            # Being converted again
+            self.finished.pop(state['input_file'], None)
+
+    def state(self, input_file):
+        # Returns the latest state dict for input_file, or None if it was never journaled
+        with self.lock:
+            state = self.states.get(input_file)
+            return dict(state) if state else None
+
+    def is_finished(self, path):
+        """
+        True if path is a file this journal already converted and it hasn't changed since,
+        either as the input that was replaced or as the converted file at its final name.
+        """
+        with self.lock:
+            if path not in self.finished:
+                return False
+            final_size = self.finished[path]
+        try:
+            return os.path.getsize(path) == final_size
+        except OSError:
+            return False
+
+    def unfinished(self):
+        # States of files that were encoded but not yet renamed, whose output is still there
+        with self.lock:
+            states = [dict(state) for state in self.states.values() if state['stage'] in ('encoded', 'metadata')]
+        return [state for state in states if state.get('output_file') and os.path.exists(state['output_file'])]
+
+    def clean_partial_outputs(self):
+        """
+        Removes outputs left behind by encodes that were running when the process died
+        and puts those files back to 'planned'. Returns the removed paths.
+        Only call this when no other process is encoding with the same journal.
+        """
+        removed = []
+        with self.lock:
+            states = [dict(state) for state in self.states.values() if state['stage'] == 'encoding']
+        for state in states:
+            output_file = state.get('output_file')
+            if output_file and remove_partial_output(output_file):
+                removed.append(output_file)
+            self.record(state['input_file'], 'planned', output_file=None)
+        return removed
+
+    def compact(self):
+        # Rewrites the journal with only the latest state per file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for state in self.states.values():
+                f.write(json.dumps(state) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
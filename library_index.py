@@ -0,0 +1,152 @@
+import os
+import time
+import sqlite3
+import threading
+
+from old_pairs import find_old_pairs
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".compress_vid_library_index.sqlite")
+
+# Bump when the stored layout changes, the index is rebuilt on open
+INDEX_VERSION = 1
+
+VIDEO_EXTENSIONS = frozenset(['.mts', '.mp4', '.mkv', '.avi', '.mov'])
+
+
+def is_video_name(name):
+    return not name.startswith('.') and os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+
+
+class LibraryIndex:
+    """
+    On-disk index of the folders under a library root: each directory's mtime plus its
+    subdirectories and video files. A directory's mtime changes whenever an entry is added,
+    removed or renamed in it, so a rescan only lists the directories whose mtime moved and
+    reuses the stored entries for the rest.
+    """
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        self.db_path = db_path
+        self.listed = 0
+        self.unchanged = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS dirs")
+            self.conn.execute("DROP TABLE IF EXISTS entries")
+            self.conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                scanned_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                is_dir INTEGER NOT NULL,
+                PRIMARY KEY (dir, name)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def list_dir_locked(self, path, known_mtimes):
+        # Returns (subdirectory names, video names) for path, listing it only if it changed
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return [], []
+        if known_mtimes.get(path) == mtime_ns:
+            self.unchanged += 1
+            rows = self.conn.execute("SELECT name, is_dir FROM entries WHERE dir = ?", (path,)).fetchall()
+            return [name for name, is_dir in rows if is_dir], [name for name, is_dir in rows if not is_dir]
+
+        self.listed += 1
+        subdirs = []
+        videos = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        # Symlinked folders aren't followed, same as os.walk
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif is_video_name(entry.name) and entry.is_file():
+                            videos.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return [], []
+
+        # Folders that disappeared take their whole stored subtree with them
+        stored_subdirs = self.conn.execute("SELECT name FROM entries WHERE dir = ? AND is_dir = 1", (path,)).fetchall()
+        for (name,) in stored_subdirs:
+            if name not in subdirs:
+                self.forget_locked(os.path.join(path, name))
+
+        self.conn.execute("DELETE FROM entries WHERE dir = ?", (path,))
+        self.conn.executemany(
+            "INSERT INTO entries (dir, name, is_dir) VALUES (?, ?, ?)",
+            [(path, name, 1) for name in subdirs] + [(path, name, 0) for name in videos]
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, mtime_ns, scanned_at) VALUES (?, ?, ?)",
+            (path, mtime_ns, time.time())
+        )
+        return subdirs, videos
+
+    def forget_locked(self, path):
+        prefix = path.rstrip(os.sep) + os.sep
+        for table, column in (('dirs', 'path'), ('entries', 'dir')):
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE {column} = ? OR substr({column}, 1, ?) = ?",
+                (path, len(prefix), prefix)
+            )
+
+    def scan(self, root, full=False, quiet=False):
+        """
+        Returns (video_paths, old_pairs) for everything under root, see find_old_pairs.
+        Only directories whose mtime changed since the last scan are listed again;
+        full=True lists every directory, for filesystems that don't update directory mtimes.
+        """
+        root = os.path.abspath(root)
+        with self.lock:
+            self.listed = 0
+            self.unchanged = 0
+            known_mtimes = {}
+            if not full:
+                prefix = root.rstrip(os.sep) + os.sep
+                known_mtimes = dict(self.conn.execute(
+                    "SELECT path, mtime_ns FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (root, len(prefix), prefix)
+                ).fetchall())
+
+            video_paths = []
+            stack = [root]
+            while stack:
+                path = stack.pop()
+                subdirs, videos = self.list_dir_locked(path, known_mtimes)
+                video_paths.extend(os.path.join(path, name) for name in videos)
+                stack.extend(os.path.join(path, name) for name in subdirs)
+            self.conn.commit()
+        if not quiet:
+            print(f"Library index: {self.listed} folders listed, {self.unchanged} unchanged")
+        video_paths.sort()
+        return video_paths, find_old_pairs(video_paths)
+
+    def subdirs(self, path):
+        # Subfolders of path, from the index when the folder hasn't changed since it was scanned
+        path = os.path.abspath(path)
+        with self.lock:
+            row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+            subdirs, _ = self.list_dir_locked(path, {path: row[0]} if row else {})
+            self.conn.commit()
+        return [os.path.join(path, name) for name in subdirs]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,40 @@
+import os
+import re
+
+# Originals are kept next to the converted file as name_OLD.ext, then name_OLD 1.ext, name_OLD 2.ext...
+OLD_SUFFIX = re.compile(r'_OLD(?: (\d+))?$')
+
+
+def is_old_name(path):
+    # True for an _OLD file, only the file name counts, not the folders it is in
+    return OLD_SUFFIX.search(os.path.splitext(os.path.basename(path))[0]) is not None
+
+
+def old_number(path):
+    # 0 for name_OLD.ext, N for name_OLD N.ext, so the first original sorts first
+    match = OLD_SUFFIX.search(os.path.splitext(os.path.basename(path))[0])
+    return int(match.group(1) or 0) if match else 0
+
+
+def find_old_pairs(video_paths):
+    """
+    Returns {video_path: [old_paths]} for every video that has an _OLD version next to it,
+    e.g. clip.mp4 -> [clip_OLD.mov, clip_OLD 1.mov], in the order they were made. Any extension
+    matches on either side. The _OLD files themselves are not keys. One pass over the list,
+    with the originals looked up by (folder, name before _OLD).
+    """
+    olds = {}
+    for path in video_paths:
+        directory, name = os.path.split(path)
+        base = os.path.splitext(name)[0]
+        match = OLD_SUFFIX.search(base)
+        if match:
+            olds.setdefault((directory, base[:match.start()]), []).append(path)
+    pairs = {}
+    for path in video_paths:
+        directory, name = os.path.split(path)
+        base = os.path.splitext(name)[0]
+        if not OLD_SUFFIX.search(base) and (directory, base) in olds:
+            old_paths = olds[(directory, base)]
+            pairs[path] = sorted(old_paths, key=lambda old: (old_number(old), old)) if len(old_paths) > 1 else old_paths
+    return pairs
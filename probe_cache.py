@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".compress_vid_probe_cache.sqlite")
+
+# Bump when the stored video_info layout changes, older entries are dropped on open
+CACHE_VERSION = 2
+
+
+class ProbeCache:
+    """
+    On-disk cache of get_video_info results.
+    An entry is only used while the file's path, size, mtime and inode all still match,
+    so an edited or replaced file is probed again.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        # Probes run on a thread pool, so the connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS probes")
+            self.conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                probed_at REAL NOT NULL,
+                video_info TEXT NOT NULL
+            )
+        """)
+        # Sample-encode predictions, keyed by file and encoder settings, see predict_new_file_size
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS predictions (
+                path TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                predicted_at REAL NOT NULL,
+                prediction TEXT NOT NULL,
+                PRIMARY KEY (path, settings)
+            )
+        """)
+        # Files whose encode was stopped early because it wasn't going to save enough
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS not_worth_it (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                marked_at REAL NOT NULL,
+                reason TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def file_key(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, path):
+        # Returns the cached video_info, or None if there is no entry or the file has changed
+        try:
+            size, mtime_ns, inode = self.file_key(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT video_info FROM probes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (path, size, mtime_ns, inode)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, path, video_info):
+        try:
+            size, mtime_ns, inode = self.file_key(path)
+        except OSError:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, inode, probed_at, video_info) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, inode, time.time(), json.dumps(video_info))
+            )
+            self.conn.commit()
+
+    def get_prediction(self, path, settings):
+        # Returns the cached prediction for path encoded with settings, or None
+        try:
+            size, mtime_ns, inode = self.file_key(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT prediction FROM predictions WHERE path = ? AND settings = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (path, settings, size, mtime_ns, inode)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_predictions(self, settings_by_path):
+        """
+        Cached predictions for many files in a few queries, settings_by_path maps each path to its
+        settings key; returns {path: prediction}. A prediction counts if it was made for the file
+        the probes table has for the path, that entry was checked against the file when it was
+        probed, so nothing is read from disk here.
+        """
+        paths = list(settings_by_path)
+        rows = []
+        with self.lock:
+            # Stays under SQLite's limit on query parameters
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                rows.extend(self.conn.execute(
+                    "SELECT p.path, p.settings, p.prediction FROM predictions p JOIN probes q ON q.path = p.path "
+                    "AND q.size = p.size AND q.mtime_ns = p.mtime_ns AND q.inode = p.inode "
+                    f"WHERE p.path IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        return {path: json.loads(prediction) for path, settings, prediction in rows if settings_by_path[path] == settings}
+
+    def put_prediction(self, path, settings, prediction):
+        try:
+            size, mtime_ns, inode = self.file_key(path)
+        except OSError:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO predictions (path, settings, size, mtime_ns, inode, predicted_at, prediction) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, settings, size, mtime_ns, inode, time.time(), json.dumps(prediction))
+            )
+            self.conn.commit()
+
+    def mark_not_worth_it(self, path, reason):
+        try:
+            size, mtime_ns, inode = self.file_key(path)
+        except OSError:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO not_worth_it (path, size, mtime_ns, inode, marked_at, reason) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, inode, time.time(), reason)
+            )
+            self.conn.commit()
+
+    def not_worth_it(self, path):
+        # Returns the reason an earlier encode of this exact file was stopped, or None
+        try:
+            size, mtime_ns, inode = self.file_key(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT reason FROM not_worth_it WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                (path, size, mtime_ns, inode)
+            ).fetchone()
+        return row[0] if row else None
+
+    def not_worth_it_paths(self):
+        # Every marked file as {path: reason} in one query, for marks made on the file the probes table
+        # still has for the path; a file replaced since is probed again with a new key and drops out
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT n.path, n.reason FROM not_worth_it n JOIN probes q ON q.path = n.path "
+                "AND q.size = n.size AND q.mtime_ns = n.mtime_ns AND q.inode = n.inode"
+            ).fetchall()
+        return dict(rows)
+
+    def evict(self, max_entries=None, max_age_days=None):
+        # Drops entries older than max_age_days, then the oldest entries beyond max_entries
+        removed = 0
+        with self.lock:
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                removed += self.conn.execute("DELETE FROM probes WHERE probed_at < ?", (cutoff,)).rowcount
+                self.conn.execute("DELETE FROM predictions WHERE predicted_at < ?", (cutoff,))
+            if max_entries is not None:
+                removed += self.conn.execute(
+                    "DELETE FROM probes WHERE path NOT IN (SELECT path FROM probes ORDER BY probed_at DESC LIMIT ?)",
+                    (max_entries,)
+                ).rowcount
+                self.conn.execute("DELETE FROM predictions WHERE path NOT IN (SELECT path FROM probes)")
+            self.conn.commit()
+        return removed
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Probe cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
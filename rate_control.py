@@ -0,0 +1,120 @@
+import os
+import json
+import threading
+
+# 'abr' is single-pass average bitrate, 'crf' constant quality (CRF/CQ), 'twopass' two-pass average bitrate
+RATE_CONTROLS = ('abr', 'crf', 'twopass')
+# ffmpeg encoders that take -pass 1 / -pass 2, NVENC does its passes in one run, the rest only have one pass
+TWO_PASS_ENCODERS = ('libx264', 'libx265', 'libaom-av1')
+NVENC_MULTIPASS = ['-multipass', 'fullres']
+# HandBrake encoders whose --encopts take x264/x265 VBV options
+VBV_ENCOPTS_ENCODERS = ('x264', 'x265')
+# VBV buffer in seconds at the max rate
+VBV_BUFFER_SECONDS = 2
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".compress_vid_crf_model.json")
+# Encodes shorter than this say too little about a file's size to learn from
+MIN_LEARN_SECONDS = 5
+
+
+def describe_rate_control(export_settings):
+    # Short text for the Rate Control column, e.g. "CRF 26 <= 12 Mb/s"
+    rate_control = export_settings.get('rate_control', 'abr')
+    if export_settings.get('stream_copy'):
+        return 'copy'
+    if rate_control == 'crf':
+        text = f"CRF {export_settings['crf']:g}"
+        if export_settings.get('max_bitrate'):
+            text += f" <= {export_settings['max_bitrate']:g} Mb/s"
+        return text
+    return '2-pass' if rate_control == 'twopass' else 'ABR'
+
+
+def ffmpeg_rate_args(encoder_ffmpeg, export_settings):
+    # ffmpeg options for the rate control in export_settings, passes not included
+    bitrate_kbps = float(export_settings['new_bitrate']) * 1000
+    if export_settings.get('rate_control') != 'crf':
+        return ['-b:v', f"{bitrate_kbps}k"]
+    crf = f"{export_settings['crf']:g}"
+    max_kbps = float(export_settings['max_bitrate']) * 1000 if export_settings.get('max_bitrate') else None
+    if encoder_ffmpeg == 'libaom-av1':
+        # Constrained quality, libaom takes the ceiling as its bitrate and ignores -maxrate
+        return ['-crf', crf, '-b:v', f"{max_kbps}k" if max_kbps else '0']
+    if encoder_ffmpeg == 'hevc_nvenc':
+        args = ['-rc', 'vbr', '-cq', crf, '-b:v', '0']
+    elif encoder_ffmpeg == 'hevc_videotoolbox':
+        # 1-100, higher is better, only on Apple Silicon
+        args = ['-q:v', crf]
+    else:
+        args = ['-crf', crf]
+    if max_kbps:
+        args += ['-maxrate', f"{max_kbps}k", '-bufsize', f"{max_kbps * VBV_BUFFER_SECONDS}k"]
+    return args
+
+
+def handbrake_rate_args(encoder_handbrake, export_settings):
+    # (HandBrakeCLI options, extra --encopts) for the rate control in export_settings
+    bitrate_kbps = float(export_settings['new_bitrate']) * 1000
+    rate_control = export_settings.get('rate_control')
+    if rate_control == 'twopass':
+        return ['-b', str(bitrate_kbps), '--multi-pass', '--turbo'], []
+    if rate_control != 'crf':
+        return ['-b', str(bitrate_kbps)], []
+    encopts = []
+    if export_settings.get('max_bitrate') and encoder_handbrake in VBV_ENCOPTS_ENCODERS:
+        max_kbps = int(float(export_settings['max_bitrate']) * 1000)
+        encopts = [f"vbv-maxrate={max_kbps}", f"vbv-bufsize={max_kbps * VBV_BUFFER_SECONDS}"]
+    return ['-q', f"{export_settings['crf']:g}"], encopts
+
+
+class CrfSizeModel:
+    """
+    Output size of CRF encodes, learned from the ones that finished: bits per pixel per frame for
+    each encoder, CRF and resolution, so a CRF file can be estimated before it is encoded.
+    Kept in a small JSON file next to compress_core.py; safe to share between encode threads.
+    """
+
+    def __init__(self, path=DEFAULT_MODEL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    @staticmethod
+    def key(encoder_ffmpeg, crf, resolution):
+        return f"{encoder_ffmpeg}/{crf:g}/{resolution}"
+
+    def load(self):
+        # Called with the lock held, {key: [bits, pixel frames, encodes]}
+        if self.entries is None:
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def estimate(self, encoder_ffmpeg, crf, resolution, width, height, fps):
+        # Returns (Mb/s, number of encodes it is based on), (None, 0) before the first one
+        with self.lock:
+            entry = self.load().get(self.key(encoder_ffmpeg, crf, resolution))
+        if not entry or not entry[1] or not width or not height or not fps:
+            return None, 0
+        bits_per_pixel = entry[0] / entry[1]
+        return bits_per_pixel * width * height * fps / 1e6, entry[2]
+
+    def learn(self, encoder_ffmpeg, crf, resolution, width, height, fps, duration, output_bytes):
+        if not width or not height or not fps or not duration or duration < MIN_LEARN_SECONDS or not output_bytes:
+            return
+        with self.lock:
+            entries = self.load()
+            entry = entries.setdefault(self.key(encoder_ffmpeg, crf, resolution), [0.0, 0.0, 0])
+            entry[0] += output_bytes * 8
+            entry[1] += width * height * fps * duration
+            entry[2] += 1
+            try:
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(entries, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Could not save the CRF size model: {e}")
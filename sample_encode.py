@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import tempfile
+import subprocess
+
+# Number and length of the windows encoded from each file
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 4
+
+# Lowest acceptable quality per star rating, higher rated footage must stay closer to the source.
+# SSIM is ffmpeg's "All" score (1.0 is identical), PSNR the average in dB
+QUALITY_FLOORS = {
+    'ssim': {5: 0.990, 4: 0.985, 3: 0.980, None: 0.975},
+    'psnr': {5: 42.0, 4: 40.0, 3: 38.0, None: 36.0},
+}
+
+# Fractions of the table bitrate tried by the search, lowest first
+BITRATE_LADDER = [0.25, 0.35, 0.5, 0.7, 1.0]
+# Don't search below this (Mb/s), static shots would otherwise pass at next to nothing
+MIN_SEARCH_BITRATE = 0.5
+
+SSIM_ALL = re.compile(r'SSIM .*All:([\d.]+)')
+PSNR_AVERAGE = re.compile(r'PSNR .*average:([\d.]+|inf)')
+
+
+def quality_floor(rating, metric='ssim'):
+    # Ratings below 3 stars, and unrated files, share the default floor
+    floors = QUALITY_FLOORS[metric]
+    if rating is not None and rating >= 3:
+        return floors[min(rating, 5)]
+    return floors[None]
+
+
+def sample_starts(duration, count=SAMPLE_COUNT, length=SAMPLE_SECONDS):
+    # Spread the windows evenly, leaving out the first and last 5% where intros and fades sit
+    if not duration or duration <= length:
+        return [0.0]
+    first, last = duration * 0.05, duration * 0.95 - length
+    if last <= first or count == 1:
+        return [max(0.0, (duration - length) / 2)]
+    step = (last - first) / (count - 1)
+    return [first + step * index for index in range(count)]
+
+
+def encode_sample(input_file, start, length, encoder_ffmpeg, bitrate_kbps, output_file, encoder_args=None, audio=False, rate_args=None):
+    # Encodes one window with the same video settings as convert_selected_video, the container follows output_file.
+    # rate_args replaces -b:v for other rate controls, see rate_control.ffmpeg_rate_args; encoder_args are the
+    # backend's own options and thread cap (compress_core.ffmpeg_encoder_args), or sizes and scores wouldn't carry over
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-ss', str(start), '-t', str(length),
+        '-i', input_file,
+    ] + (['-c:a', 'aac'] if audio else ['-an']) + [
+        '-c:v', encoder_ffmpeg,
+    ] + (rate_args or ['-b:v', f"{bitrate_kbps}k"]) + [
+        '-g', '60',
+    ] + (encoder_args or []) + [
+        output_file
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output_file
+
+
+def measure_quality(input_file, start, length, sample_file, metric='ssim'):
+    # Compares a sample with the same window of the source using ffmpeg's ssim or psnr filter
+    lavfi = f"[1:v]setpts=PTS-STARTPTS[encoded];[0:v]setpts=PTS-STARTPTS[source];[encoded][source]{metric}"
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostats',
+        '-ss', str(start), '-t', str(length), '-i', input_file,
+        '-i', sample_file,
+        '-lavfi', lavfi,
+        '-f', 'null', '-'
+    ]
+    output = subprocess.run(cmd, capture_output=True, text=True, errors='replace').stderr
+    match = (SSIM_ALL if metric == 'ssim' else PSNR_AVERAGE).search(output)
+    if not match:
+        raise RuntimeError(f"Couldn't read the {metric} score for {os.path.basename(input_file)}")
+    return float(match.group(1))
+
+
+def score_bitrate(input_file, starts, encoder_ffmpeg, bitrate_kbps, metric='ssim', encoder_args=None, length=SAMPLE_SECONDS):
+    # The worst window decides, busy scenes are what falls apart at low bitrates
+    scores = []
+    with tempfile.TemporaryDirectory(prefix='compress_vid_sample_') as tmp_dir:
+        for index, start in enumerate(starts):
+            sample_file = os.path.join(tmp_dir, f'sample_{index}.mkv')
+            encode_sample(input_file, start, length, encoder_ffmpeg, bitrate_kbps, sample_file, encoder_args)
+            scores.append(measure_quality(input_file, start, length, sample_file, metric))
+    return min(scores)
+
+
+def search_bitrate(input_file, duration, encoder_ffmpeg, max_bitrate, floor, metric='ssim', encoder_args=None):
+    """
+    Finds the lowest bitrate on BITRATE_LADDER (fractions of max_bitrate, in Mb/s) whose samples
+    all score at least floor. Quality rises with bitrate, so the ladder is bisected.
+    Returns (bitrate, score), or (max_bitrate, score) if no rung meets the floor.
+    """
+    starts = sample_starts(duration)
+    lowest = min(MIN_SEARCH_BITRATE, max_bitrate)
+    candidates = sorted(set(max(lowest, max_bitrate * fraction) for fraction in BITRATE_LADDER))
+    scores = {}
+
+    def score(index):
+        if index not in scores:
+            scores[index] = score_bitrate(input_file, starts, encoder_ffmpeg, candidates[index] * 1000, metric, encoder_args)
+            print(f"  {candidates[index]:.2f} Mb/s: {metric} {scores[index]:.4f} (floor {floor})")
+        return scores[index]
+
+    low, high = 0, len(candidates) - 1
+    best = high
+    while low <= high:
+        middle = (low + high) // 2
+        if score(middle) >= floor:
+            best = middle
+            high = middle - 1
+        else:
+            low = middle + 1
+    return candidates[best], score(best)
+
+
+def predict_encode(input_file, duration, encoder_ffmpeg, bitrate_kbps, encoder_args=None, count=SAMPLE_COUNT, length=SAMPLE_SECONDS,
+                   rate_args=None):
+    """
+    Trial-encodes a few windows of the file, with audio and as mp4 like the real encode,
+    and scales their total size and encode time up to the full duration. rate_args and encoder_args as in encode_sample.
+    Returns {'new_file_size_mb': ..., 'encode_seconds': ...}.
+    """
+    sampled_seconds = 0.0
+    sampled_bytes = 0
+    elapsed = 0.0
+    with tempfile.TemporaryDirectory(prefix='compress_vid_predict_') as tmp_dir:
+        for index, start in enumerate(sample_starts(duration, count, length)):
+            window = min(length, duration - start)
+            sample_file = os.path.join(tmp_dir, f'sample_{index}.mp4')
+            started = time.time()
+            encode_sample(input_file, start, window, encoder_ffmpeg, bitrate_kbps, sample_file, encoder_args, audio=True,
+                          rate_args=rate_args)
+            elapsed += time.time() - started
+            sampled_bytes += os.path.getsize(sample_file)
+            sampled_seconds += window
+    scale = duration / sampled_seconds
+    return {'new_file_size_mb': sampled_bytes * scale / 1e6, 'encode_seconds': elapsed * scale}
@@ -0,0 +1,143 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from encode_progress import parse_ffmpeg_progress
+
+# Only files at least this long are worth the split/join overhead
+SPLIT_MIN_DURATION = 20 * 60
+# Shortest segment we cut, shorter ones waste time on encoder start-up and rate control warm-up
+SEGMENT_MIN_SECONDS = 60
+
+
+def probe_stream_stats(path):
+    # Returns (duration, frame count) of the first video stream, counting packets so it is exact
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-count_packets',
+        '-show_entries', 'stream=nb_read_packets:format=duration',
+        '-of', 'default=noprint_wrappers=1',
+        path
+    ]
+    output = subprocess.check_output(cmd, text=True)
+    values = dict(line.split('=', 1) for line in output.strip().splitlines() if '=' in line)
+    return float(values.get('duration', 0)), int(values.get('nb_read_packets', 0))
+
+
+def split_at_keyframes(input_file, segment_dir, segment_seconds):
+    # Stream-copies the video into pieces; ffmpeg's segment muxer only cuts on keyframes
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-i', input_file,
+        '-map', '0:v:0',
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(segment_seconds),
+        '-reset_timestamps', '1',
+        os.path.join(segment_dir, 'source_%05d.mkv')
+    ]
+    print(" ".join(cmd))
+    subprocess.run(cmd, check=True)
+    return sorted(
+        os.path.join(segment_dir, name) for name in os.listdir(segment_dir) if name.startswith('source_')
+    )
+
+
+def encode_in_segments(input_file, output_file, encoder_ffmpeg, bitrate_kbps, duration, workers,
+                       on_progress=None, rate_args=None, encoder_args=None):
+    """
+    Encodes a long video as several segments in parallel and joins them into output_file.
+    The source is cut at keyframes with stream copy, each piece is encoded once at the target
+    bitrate (or with rate_args, e.g. a CRF) plus encoder_args, the backend's own options (see
+    ffmpeg_encoder_args in compress_core.py), and the pieces are joined with the concat demuxer
+    without re-encoding.
+    Raises RuntimeError if the output's duration or frame count doesn't match the source.
+    """
+    segment_dir = output_file + '.segments'
+    os.makedirs(segment_dir, exist_ok=True)
+    try:
+        # Two segments per worker keeps every worker busy when some segments encode faster than others
+        segment_seconds = max(SEGMENT_MIN_SECONDS, duration / (workers * 2))
+        sources = split_at_keyframes(input_file, segment_dir, segment_seconds)
+        print(f"Split {os.path.basename(input_file)} into {len(sources)} segments of about {segment_seconds:.0f}s")
+
+        segment_durations = [probe_stream_stats(source)[0] for source in sources]
+        total_duration = sum(segment_durations) or 1
+        done_seconds = [0.0] * len(sources)
+
+        def encode_segment(index):
+            source = sources[index]
+            encoded = os.path.join(segment_dir, f'encoded_{index:05d}.mkv')
+            cmd = [
+                'ffmpeg', '-v', 'error', '-y',
+                '-i', source,
+                '-c:v', encoder_ffmpeg,
+            ] + (rate_args or ['-b:v', f"{bitrate_kbps}k"]) + [
+                '-g', '60',  # Keyframe interval
+                '-progress', 'pipe:1', '-nostats',
+                encoded
+            ]
+            cmd[-1:-1] = encoder_args or []
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, errors='replace')
+            try:
+                for progress in parse_ffmpeg_progress(process.stdout, segment_durations[index]):
+                    if progress['percent'] is not None:
+                        done_seconds[index] = segment_durations[index] * progress['percent'] / 100
+                    if on_progress is not None:
+                        # Report progress across all segments, fps and speed of one segment would be misleading
+                        on_progress({
+                            'percent': sum(done_seconds) / total_duration * 100,
+                            'fps': None,
+                            'speed': None,
+                            'eta_seconds': None,
+                            'bytes_out': None,
+                        })
+            except BaseException:
+                # on_progress raised, e.g. the job was cancelled, don't leave ffmpeg running
+                process.kill()
+                process.wait()
+                raise
+            process.wait()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg exited with code {process.returncode} encoding segment {index}")
+            return encoded
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            encoded_segments = list(executor.map(encode_segment, range(len(sources))))
+
+        # Join the encoded video with the source's audio; video is stream-copied, audio encoded as in the single-pass path
+        concat_list = os.path.join(segment_dir, 'segments.txt')
+        with open(concat_list, 'w') as f:
+            for encoded in encoded_segments:
+                escaped = encoded.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'concat', '-safe', '0', '-i', concat_list,
+            '-i', input_file,
+            '-map', '0:v:0',
+            '-map', '1:a?',
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-map_metadata', '1',
+            '-f', 'mp4',
+            output_file
+        ]
+        print(" ".join(cmd))
+        subprocess.run(cmd, check=True)
+
+        # The join must not have dropped or duplicated anything
+        source_duration, source_frames = probe_stream_stats(input_file)
+        output_duration, output_frames = probe_stream_stats(output_file)
+        if output_frames != source_frames or abs(output_duration - source_duration) > 1.0:
+            os.remove(output_file)
+            raise RuntimeError(
+                f"Segmented encode mismatch: source {source_frames} frames / {source_duration:.2f}s, "
+                f"output {output_frames} frames / {output_duration:.2f}s"
+            )
+        print(f"Verified {output_frames} frames / {output_duration:.2f}s against the source")
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    return output_file
@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compress_core
+import sample_encode
+from compress_core import VideoInfo, convert_selected_video
+
+
+def assert_caps_encoder(cmd, threads):
+    # -threads only limits the encoder as an output option, i.e. after -i and -c:v
+    position = cmd.index('-threads')
+    assert cmd[position + 1] == str(threads)
+    assert position > cmd.index('-i')
+    assert position > cmd.index('-c:v')
+    assert cmd.count('-threads') == 1
+
+
+def test_convert_puts_threads_after_the_encoder(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(compress_core, 'run_encode_pass', lambda cmd, *args: commands.append(cmd))
+    export_settings = {'new_bitrate': 5, 'new_codec': 'x264'}
+    convert_selected_video('in.mp4', export_settings, use_ffmpeg=True, use_codec='x264',
+                           output_file=str(tmp_path / 'out.mp4'), threads=3)
+    assert_caps_encoder(commands[0], 3)
+
+
+def test_segments_get_the_thread_cap(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(compress_core, 'encode_in_segments', lambda *args, **kwargs: calls.append(kwargs))
+    video_info = VideoInfo('h264', 1920, 1080, 20.0, 30.0, compress_core.SPLIT_MIN_DURATION, 100.0, None, 0)
+    convert_selected_video('in.mp4', {'new_bitrate': 5, 'new_codec': 'x264'}, use_ffmpeg=True, use_codec='x264',
+                           output_file=str(tmp_path / 'out.mp4'), threads=3, video_info=video_info, split_workers=2)
+    encoder_args = calls[0]['encoder_args']
+    assert encoder_args[encoder_args.index('-threads') + 1] == '3'
+
+
+def test_sample_puts_threads_after_the_encoder(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(sample_encode.subprocess, 'run', lambda cmd, **kwargs: commands.append(cmd))
+    encoder_args = compress_core.ffmpeg_encoder_args('x264', 2)
+    sample_encode.encode_sample('in.mp4', 10, 5, 'libx264', 5000, str(tmp_path / 'sample.mp4'), encoder_args)
+    assert_caps_encoder(commands[0], 2)
@@ -0,0 +1,636 @@
+import os
+from array import array
+from operator import itemgetter
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt, QModelIndex
+from PyQt5.QtGui import QBrush, QColor, QFont
+
+from compress_core import VideoInfo, describe_rate_control, export_planner, needs_remux, save_new_filename, old_file_new_name
+
+# Item data role with the number behind a cell's text, the columns sort and filter on it instead of the text
+SORT_ROLE = Qt.UserRole + 1
+# internalId of the folder rows, video rows carry their folder number + 1
+FOLDER_ID = 0
+CHECK_HEADERS = ('Select', 'Force HQ')
+BOLD_HEADERS = ('Rating', 'New Bit Rate', 'Est. New Size', 'Compression %', 'Bit Rate', 'Size (MB)')
+GREEN_HEADERS = ('New Bit Rate', 'Est. New Size', 'Compression %')
+RED_HEADERS = ('Bit Rate', 'Size (MB)')
+GREY_HEADERS = ('Duration', 'Dimensions', 'FPS', 'Codec', 'New Codec', 'Rate Control')
+# Resolution filter value for the videos no row of the export table matches
+OTHER_RESOLUTION = 'other'
+# Probe state of a video row, rows are added from the folder scan and filled in once probed
+UNPROBED, PROBED, PROBE_FAILED = 0, 1, 2
+# Cells that are known before a video is probed
+SCAN_HEADERS = ('Name', 'Select', 'Force HQ', 'Input Bitrate', 'Converted File Name', 'Renamed Old File Name', 'Full File Path')
+
+NAN = float('nan')
+
+
+def format_bitrate(bitrate_mbps):
+    return 'N/A' if bitrate_mbps is None else f"{bitrate_mbps:.1f}"
+
+def format_size_mb(size_mb):
+    return 'N/A' if size_mb is None else f"{size_mb:.1f} MB"
+
+def format_percent(ratio):
+    return 'N/A' if ratio is None else f"{ratio:.1f}%"
+
+def optional(value):
+    # NaN marks a missing number in the float columns
+    return None if value != value else value
+
+
+class VideoTreeModel(QtCore.QAbstractItemModel):
+    """
+    Folders as top level rows with their videos below, for QTreeView. Every video is a row id into
+    flat columns (arrays for the numbers, lists for the strings, bytearrays for the checkboxes), the
+    display text, fonts and colours are only produced when the view asks for a cell it is drawing.
+    Videos are added with just their path and filled in by set_video_info() once probed, until then
+    only the SCAN_HEADERS cells show. Sorting reorders the per-folder lists of row ids on the numbers, see sort().
+    """
+
+    def __init__(self, headers, parent=None):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self.column = {header: column for column, header in enumerate(self.headers)}
+
+        # Folder number -> path, checkboxes, input bitrate, encoder chosen for it and its video row ids in display order
+        self.folders = []
+        self.folder_numbers = {}
+        self.folder_checks = {header: bytearray() for header in CHECK_HEADERS}
+        self.folder_bitrates = {}
+        self.folder_codecs = {}
+        self.children = []
+        # Display order of the folder numbers, and the position of each folder in it
+        self.folder_order = []
+        self.folder_rows = []
+
+        # One entry per video row id
+        self.paths = []
+        self.row_ids = {}
+        self.folder_of = array('i')
+        self.codecs = []
+        self.width = array('i')
+        self.height = array('i')
+        self.bitrate = array('d')
+        self.fps = array('d')
+        self.duration = array('d')
+        self.size_mb = array('d')
+        self.rating = array('b')  # -1 if the file has no rating
+        self.mtime = array('d')
+        self.resolutions = []
+        self.new_codecs = []
+        self.rate_controls = []
+        self.new_bitrate = array('d')
+        self.new_size = array('d')
+        self.compression = array('d')
+        self.checks = {header: bytearray() for header in CHECK_HEADERS}
+        self.greyed = bytearray()
+        self.probe_state = bytearray()
+        # Only the rows that have one
+        self.input_bitrates = {}
+        self.reasons = {}
+        self.predictions = {}
+        self.converted_names = {}
+        self.old_names = {}
+
+        # Shared by every cell, instead of a font and brush per cell
+        bold_font = QFont()
+        bold_font.setBold(True)
+        self.strike_font = QFont()
+        self.strike_font.setStrikeOut(True)
+        self.grey_brush = QBrush(QColor('grey'))
+        green_brush = QBrush(QColor('green'))
+        red_brush = QBrush(QColor('red'))
+        self.fonts = [bold_font if header in BOLD_HEADERS else None for header in self.headers]
+        self.brushes = [
+            green_brush if header in GREEN_HEADERS else red_brush if header in RED_HEADERS
+            else self.grey_brush if header in GREY_HEADERS else None
+            for header in self.headers
+        ]
+
+        column_flags = [
+            Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable if header in CHECK_HEADERS
+            else Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable if header == 'Input Bitrate'
+            else Qt.ItemIsEnabled | Qt.ItemIsSelectable
+            for header in self.headers
+        ]
+        self.folder_flags = column_flags
+        self.video_flags = [flags | Qt.ItemNeverHasChildren for flags in column_flags]
+
+        # Called with a row id, the folder checkboxes and set_checked() leave rows it returns False for alone
+        self.row_filter = None
+
+        display = {
+            'Name': lambda r: os.path.basename(self.paths[r]),
+            'Input Bitrate': lambda r: self.input_bitrates.get(r, ''),
+            'Rating': lambda r: '' if self.rating[r] < 0 else str(self.rating[r]),
+            'Duration': lambda r: self.video_info(r).duration_str,
+            'Dimensions': lambda r: self.video_info(r).dimensions,
+            'FPS': lambda r: 'N/A' if self.fps[r] != self.fps[r] else str(round(self.fps[r], 2)),
+            'Codec': lambda r: self.codecs[r],
+            'Bit Rate': lambda r: format_bitrate(optional(self.bitrate[r])),
+            'Size (MB)': lambda r: format_size_mb(optional(self.size_mb[r])),
+            'New Codec': lambda r: self.new_codecs[r],
+            'Rate Control': lambda r: self.rate_controls[r],
+            'New Bit Rate': lambda r: format_bitrate(optional(self.new_bitrate[r])),
+            'Est. New Size': lambda r: format_size_mb(optional(self.new_size[r])),
+            'Compression %': lambda r: format_percent(optional(self.compression[r])),
+            'Converted File Name': self.converted_file_name,
+            'Renamed Old File Name': self.renamed_old_file_name,
+            'Full File Path': lambda r: self.paths[r],
+            'Date Modified': lambda r: self.video_info(r).date_modified,
+        }
+        sort_value = {
+            'Name': lambda r: os.path.basename(self.paths[r]).lower(),
+            'Select': lambda r: self.checks['Select'][r],
+            'Force HQ': lambda r: self.checks['Force HQ'][r],
+            'Input Bitrate': self.input_bitrate,
+            'Rating': lambda r: None if self.rating[r] < 0 else self.rating[r],
+            'Duration': lambda r: optional(self.duration[r]),
+            'Dimensions': lambda r: self.width[r] * self.height[r] or None,
+            'FPS': lambda r: optional(self.fps[r]),
+            'Codec': lambda r: self.codecs[r],
+            'Bit Rate': lambda r: optional(self.bitrate[r]),
+            'Size (MB)': lambda r: optional(self.size_mb[r]),
+            'New Codec': lambda r: self.new_codecs[r],
+            'Rate Control': lambda r: self.rate_controls[r],
+            'New Bit Rate': lambda r: optional(self.new_bitrate[r]),
+            'Est. New Size': lambda r: optional(self.new_size[r]),
+            'Compression %': lambda r: optional(self.compression[r]),
+            'Converted File Name': lambda r: self.converted_file_name(r).lower(),
+            'Renamed Old File Name': lambda r: self.renamed_old_file_name(r).lower(),
+            'Full File Path': lambda r: self.paths[r].lower(),
+            'Date Modified': lambda r: self.mtime[r],
+        }
+        # Checkbox columns have no text
+        self.display = [display.get(header) for header in self.headers]
+        self.needs_probe = [header not in SCAN_HEADERS for header in self.headers]
+        self.sort_value = [sort_value[header] for header in self.headers]
+
+    # Qt model interface
+
+    def index(self, row, column, parent=QModelIndex()):
+        # Called several times per row whenever the view lays the tree out, so kept to the bare minimum
+        if row < 0 or column < 0:
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, FOLDER_ID) if row < len(self.folder_order) else QModelIndex()
+        if parent.internalId() != FOLDER_ID:
+            return QModelIndex()
+        folder = self.folder_order[parent.row()]
+        return self.createIndex(row, column, folder + 1) if row < len(self.children[folder]) else QModelIndex()
+
+    def parent(self, index):
+        if not index.isValid() or index.internalId() == FOLDER_ID:
+            return QModelIndex()
+        return self.createIndex(self.folder_rows[index.internalId() - 1], 0, FOLDER_ID)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self.folder_order)
+        if parent.internalId() == FOLDER_ID and parent.column() == 0:
+            return len(self.children[self.folder_order[parent.row()]])
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return None
+
+    def flags(self, index):
+        column = index.column()
+        if column < 0:
+            return Qt.NoItemFlags
+        # Video rows never have children, which saves the view asking
+        return self.folder_flags[column] if index.internalId() == FOLDER_ID else self.video_flags[column]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+        header = self.headers[column]
+        if index.internalId() == FOLDER_ID:
+            return self.folder_data(self.folder_order[index.row()], header, role)
+        r = self.children[index.internalId() - 1][index.row()]
+        if role == Qt.DisplayRole:
+            display = self.display[column]
+            if display is None or (self.needs_probe[column] and self.probe_state[r] != PROBED):
+                return None
+            return display(r)
+        if role == Qt.EditRole:
+            return self.input_bitrates.get(r, '') if header == 'Input Bitrate' else None
+        if role == Qt.CheckStateRole:
+            if header in CHECK_HEADERS:
+                return Qt.Checked if self.checks[header][r] else Qt.Unchecked
+            return None
+        if role == Qt.ForegroundRole:
+            return self.grey_brush if self.greyed[r] else self.brushes[column]
+        if role == Qt.FontRole:
+            return self.strike_font if self.greyed[r] else self.fonts[column]
+        if role == Qt.ToolTipRole:
+            if header == 'Name' and self.probe_state[r] == PROBE_FAILED:
+                return "ffprobe could not read this file"
+            if header == 'New Bit Rate':
+                return self.reasons.get(r)
+            if header in ('Est. New Size', 'Compression %'):
+                return self.predictions.get(r)
+            return None
+        if role == SORT_ROLE:
+            return self.sort_value[column](r)
+        return None
+
+    def folder_data(self, folder, header, role):
+        if role == Qt.DisplayRole:
+            if header == 'Name':
+                return os.path.basename(self.folders[folder])
+            if header == 'Input Bitrate':
+                return self.folder_bitrates.get(folder, '')
+            if header == 'New Codec':
+                return self.folder_codecs.get(folder)
+        elif role == Qt.EditRole and header == 'Input Bitrate':
+            return self.folder_bitrates.get(folder, '')
+        elif role == Qt.CheckStateRole and header in CHECK_HEADERS:
+            return Qt.Checked if self.folder_checks[header][folder] else Qt.Unchecked
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+        header = self.headers[index.column()]
+        is_folder = index.internalId() == FOLDER_ID
+        if role == Qt.CheckStateRole and header in CHECK_HEADERS:
+            checked = value == Qt.Checked
+            if is_folder:
+                # The folder checkbox ticks or clears every video in it that isn't greyed out
+                folder = self.folder_order[index.row()]
+                self.folder_checks[header][folder] = checked
+                self.dataChanged.emit(index, index, [role])
+                self.set_checked(header, checked, [folder])
+            else:
+                self.checks[header][self.children[index.internalId() - 1][index.row()]] = checked
+                self.dataChanged.emit(index, index, [role])
+            return True
+        if role == Qt.EditRole and header == 'Input Bitrate':
+            text = str(value).strip()
+            if is_folder:
+                # A folder bitrate is copied to all its videos
+                folder = self.folder_order[index.row()]
+                self.folder_bitrates[folder] = text
+                self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+                for r in self.children[folder]:
+                    self.set_input_bitrate(r, text)
+                self.emit_column_changed(folder, index.column())
+            else:
+                self.set_input_bitrate(self.children[index.internalId() - 1][index.row()], text)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+            return True
+        return False
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """
+        Sorts the videos of each folder on the column's SORT_ROLE value, rows without a value go last.
+        Folders are only reordered by the Name column. Runs over the arrays, no cell is formatted.
+        Selections and other persistent indexes move with their videos; if no row moved at all
+        nothing is emitted.
+        """
+        if not 0 <= column < len(self.headers):
+            return
+        reverse = order == Qt.DescendingOrder
+        sort_value = self.sort_value[column]
+        children = []
+        for rows in self.children:
+            keyed = [(sort_value(r), r) for r in rows]
+            present = [entry for entry in keyed if entry[0] is not None]
+            present.sort(key=itemgetter(0), reverse=reverse)
+            children.append(array('i', [r for _, r in present] + [r for value, r in keyed if value is None]))
+        folder_order = self.folder_order
+        if self.headers[column] == 'Name':
+            folder_order = sorted(folder_order, key=lambda folder: os.path.basename(self.folders[folder]).lower(), reverse=reverse)
+
+        if folder_order == self.folder_order and children == self.children:
+            return
+
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        saved = [
+            (index.internalId(), self.folder_order[index.row()] if index.internalId() == FOLDER_ID
+             else self.children[index.internalId() - 1][index.row()], index.column())
+            for index in persistent
+        ]
+        self.children = children
+        self.folder_order = folder_order
+        for row, folder in enumerate(folder_order):
+            self.folder_rows[folder] = row
+
+        positions = {}
+        moved = []
+        for internal_id, item, column in saved:
+            if internal_id == FOLDER_ID:
+                moved.append(self.createIndex(self.folder_rows[item], column, FOLDER_ID))
+                continue
+            folder = internal_id - 1
+            if folder not in positions:
+                positions[folder] = {r: row for row, r in enumerate(self.children[folder])}
+            moved.append(self.createIndex(positions[folder][item], column, internal_id))
+        self.changePersistentIndexList(persistent, moved)
+        self.layoutChanged.emit()
+
+    # Building and updating
+
+    def add_folder(self, folder_path):
+        # Returns the folder's number, folders are only added once
+        if folder_path in self.folder_numbers:
+            return self.folder_numbers[folder_path]
+        folder = len(self.folders)
+        self.beginInsertRows(QModelIndex(), len(self.folder_order), len(self.folder_order))
+        self.folders.append(folder_path)
+        self.folder_numbers[folder_path] = folder
+        for checks in self.folder_checks.values():
+            checks.append(0)
+        self.children.append(array('i'))
+        self.folder_rows.append(len(self.folder_order))
+        self.folder_order.append(folder)
+        self.endInsertRows()
+        return folder
+
+    def folder_index(self, folder_path):
+        folder = self.folder_numbers[folder_path]
+        return self.createIndex(self.folder_rows[folder], 0, FOLDER_ID)
+
+    def add_videos(self, video_paths):
+        """
+        Appends unprobed video rows for these paths, the folders must have been added first. Done
+        in bulk with one insert per folder, so a whole library shows as soon as it has been scanned.
+        """
+        by_folder = {}
+        for video_path in video_paths:
+            if video_path not in self.row_ids:
+                by_folder.setdefault(self.folder_numbers[os.path.dirname(video_path)], []).append(video_path)
+        for folder, folder_paths in by_folder.items():
+            count = len(folder_paths)
+            first = len(self.children[folder])
+            first_r = len(self.paths)
+            self.beginInsertRows(self.createIndex(self.folder_rows[folder], 0, FOLDER_ID), first, first + count - 1)
+            self.paths.extend(folder_paths)
+            self.row_ids.update(zip(folder_paths, range(first_r, first_r + count)))
+            self.folder_of.extend(array('i', [folder]) * count)
+            for column in (self.codecs, self.resolutions, self.new_codecs, self.rate_controls):
+                column.extend([None] * count)
+            for column in (self.width, self.height):
+                column.extend(array('i', [0]) * count)
+            for column in (self.bitrate, self.fps, self.duration, self.size_mb, self.new_bitrate, self.new_size, self.compression):
+                column.extend(array('d', [NAN]) * count)
+            self.rating.extend(array('b', [-1]) * count)
+            self.mtime.extend(array('d', [0]) * count)
+            for checks in self.checks.values():
+                checks.extend(bytearray(count))
+            self.greyed.extend(bytearray(count))
+            self.probe_state.extend(bytearray(count))
+            if folder in self.folder_bitrates:
+                for r in range(first_r, first_r + count):
+                    self.set_input_bitrate(r, self.folder_bitrates[folder])
+            self.children[folder].extend(range(first_r, first_r + count))
+            self.endInsertRows()
+
+    def set_video_info(self, rows, failed=()):
+        # Fills in probed rows, rows is a list of (video_path, video_info, export_settings, converted_file_data),
+        # and marks the paths in failed; only the folders these rows are in are repainted
+        folders = set()
+        for video_path, video_info, export_settings, converted_file_data in rows:
+            r = self.row_ids[video_path]
+            self.codecs[r] = video_info.video_codec
+            self.width[r] = video_info.width or 0
+            self.height[r] = video_info.height or 0
+            self.bitrate[r] = NAN if video_info.video_bitrate is None else video_info.video_bitrate
+            self.fps[r] = NAN if video_info.fps is None else video_info.fps
+            self.duration[r] = NAN if video_info.duration is None else video_info.duration
+            self.size_mb[r] = NAN if video_info.size_mb is None else video_info.size_mb
+            self.rating[r] = -1 if video_info.rating is None else video_info.rating
+            self.mtime[r] = video_info.mtime or 0
+            self.resolutions[r] = export_planner.resolution(video_info.width, video_info.height) or OTHER_RESOLUTION
+            self.set_export_columns(r, export_settings, converted_file_data)
+            self.probe_state[r] = PROBED
+            folders.add(self.folder_of[r])
+        for video_path in failed:
+            r = self.row_ids[video_path]
+            self.probe_state[r] = PROBE_FAILED
+            folders.add(self.folder_of[r])
+        self.emit_rows_changed(folders)
+
+    def set_export_columns(self, r, export_settings, converted_file_data):
+        # New Codec, Rate Control, New Bit Rate (tooltip in reasons), Est. New Size and Compression %
+        self.new_codecs[r] = 'copy' if export_settings.get('stream_copy') else export_settings['new_codec']
+        self.rate_controls[r] = describe_rate_control(export_settings)
+        self.new_bitrate[r] = NAN if export_settings['new_bitrate'] is None else export_settings['new_bitrate']
+        if export_settings.get('reason'):
+            self.reasons[r] = export_settings['reason']
+        elif export_settings.get('stream_copy') and needs_remux(self.paths[r]):
+            self.reasons[r] = "Already HEVC at or below this bitrate, re-encoding gains nothing; the streams are copied into an mp4 without re-encoding"
+        elif export_settings.get('stream_copy'):
+            self.reasons[r] = "Already HEVC at or below this bitrate and in an mp4, there is nothing to gain"
+        else:
+            self.reasons.pop(r, None)
+        self.set_size_columns(r, converted_file_data)
+
+    def set_exports(self, rows):
+        # Re-planned rows, rows is a list of (row id, export_settings, converted_file_data)
+        folders = set()
+        for r, export_settings, converted_file_data in rows:
+            self.set_export_columns(r, export_settings, converted_file_data)
+            folders.add(self.folder_of[r])
+        self.emit_rows_changed(folders)
+
+    def set_size_columns(self, r, converted_file_data):
+        # Est. New Size and Compression %, predictions from trial encodes and CRF estimates get a tooltip
+        self.new_size[r] = converted_file_data['new_file_size_mb'] if converted_file_data else NAN
+        self.compression[r] = converted_file_data['compression_ratio'] if converted_file_data else NAN
+        if converted_file_data and converted_file_data.get('predicted'):
+            self.predictions[r] = f"Predicted from trial encodes, about {converted_file_data['encode_seconds'] / 60:.1f} min to encode"
+        elif converted_file_data and converted_file_data.get('crf_samples'):
+            self.predictions[r] = f"CRF size learned from {converted_file_data['crf_samples']} earlier encodes at this resolution"
+        elif converted_file_data and 'crf_samples' in converted_file_data:
+            self.predictions[r] = "No CRF encodes at this resolution yet, estimated at the table bitrate"
+        else:
+            self.predictions.pop(r, None)
+
+    def set_prediction(self, video_path, converted_file_data):
+        r = self.row_ids.get(video_path)
+        if r is None:
+            return
+        self.set_size_columns(r, converted_file_data)
+        folder = self.folder_of[r]
+        row = self.children[folder].index(r)
+        parent = self.createIndex(self.folder_rows[folder], 0, FOLDER_ID)
+        self.dataChanged.emit(self.index(row, self.column['Est. New Size'], parent),
+                              self.index(row, self.column['Compression %'], parent))
+
+    def set_folder_codec(self, folder_path, label):
+        # Shown in the folder row's New Codec cell, None clears it
+        folder = self.folder_numbers[folder_path]
+        if label:
+            self.folder_codecs[folder] = label
+        else:
+            self.folder_codecs.pop(folder, None)
+        index = self.createIndex(self.folder_rows[folder], self.column['New Codec'], FOLDER_ID)
+        self.dataChanged.emit(index, index)
+
+    def set_input_bitrate(self, r, text):
+        if text:
+            self.input_bitrates[r] = text
+        else:
+            self.input_bitrates.pop(r, None)
+
+    def set_checked(self, header, checked, folders=None):
+        """
+        Ticks or clears a checkbox column ('Select' or 'Force HQ') for the videos of the given folder
+        numbers, all folders by default. Greyed out rows and rows row_filter rejects are left alone.
+        """
+        checks = self.checks[header]
+        row_filter = self.row_filter
+        for folder in range(len(self.folders)) if folders is None else folders:
+            rows = self.children[folder]
+            for r in rows:
+                if not self.greyed[r] and (row_filter is None or row_filter(r)):
+                    checks[r] = checked
+            self.emit_column_changed(folder, self.column[header])
+
+    def set_greyed(self, row_ids, among=None):
+        # Greys out and strikes through exactly these rows, or these of the rows in among; the rest keep their state
+        if among is None:
+            self.greyed = bytearray(len(self.paths))
+            folders = range(len(self.folders))
+        else:
+            for r in among:
+                self.greyed[r] = 0
+            folders = {self.folder_of[r] for r in among}
+        for r in row_ids:
+            self.greyed[r] = 1
+        self.emit_rows_changed(folders)
+
+    def clear_checks(self, row_ids, header='Select'):
+        folders = set()
+        for r in row_ids:
+            self.checks[header][r] = 0
+            folders.add(self.folder_of[r])
+        for folder in folders:
+            self.emit_column_changed(folder, self.column[header])
+
+    def emit_rows_changed(self, folders):
+        # Every video row of these folder numbers, the view only repaints the ones on screen
+        for folder in folders:
+            if self.children[folder]:
+                parent = self.createIndex(self.folder_rows[folder], 0, FOLDER_ID)
+                self.dataChanged.emit(self.index(0, 0, parent), self.index(len(self.children[folder]) - 1, len(self.headers) - 1, parent))
+
+    def emit_column_changed(self, folder, column):
+        rows = len(self.children[folder])
+        if rows:
+            parent = self.createIndex(self.folder_rows[folder], 0, FOLDER_ID)
+            self.dataChanged.emit(self.index(0, column, parent), self.index(rows - 1, column, parent))
+
+    # Row access, by row id
+
+    def row_id(self, index):
+        # Row id of a video index of this model, None for folder rows
+        if not index.isValid() or index.internalId() == FOLDER_ID:
+            return None
+        return self.children[index.internalId() - 1][index.row()]
+
+    def folder_path(self, index):
+        # Folder path of a folder index of this model, None for video rows
+        if not index.isValid() or index.internalId() != FOLDER_ID:
+            return None
+        return self.folders[self.folder_order[index.row()]]
+
+    def checked_rows(self, header='Select'):
+        # Row ids with the checkbox ticked, in display order
+        checks = self.checks[header]
+        return [r for folder in self.folder_order for r in self.children[folder] if checks[r]]
+
+    def video_info(self, r):
+        return VideoInfo(self.codecs[r], self.width[r] or None, self.height[r] or None, optional(self.bitrate[r]),
+                         optional(self.fps[r]), optional(self.duration[r]), optional(self.size_mb[r]),
+                         None if self.rating[r] < 0 else self.rating[r], self.mtime[r])
+
+    def input_bitrate(self, r):
+        text = self.input_bitrates.get(r, '')
+        return float(text) if text.isdigit() else None
+
+    def converted_file_name(self, r):
+        # Looked up on the disk when first needed, like the names the encode itself picks
+        if r not in self.converted_names:
+            self.converted_names[r] = save_new_filename(self.paths[r])
+        return self.converted_names[r]
+
+    def renamed_old_file_name(self, r):
+        if r not in self.old_names:
+            self.old_names[r] = old_file_new_name(self.paths[r])
+        return self.old_names[r]
+
+
+class VideoFilterProxy(QtCore.QSortFilterProxyModel):
+    """
+    Hides the videos of a VideoTreeModel below a rating or savings, or of another resolution;
+    while a filter is set, videos that haven't been probed yet are hidden too. Folder rows always
+    show. Sorting is passed on to the source model.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.min_rating = None
+        self.resolution = None  # a RESOLUTION_SIZES name or OTHER_RESOLUTION
+        self.min_savings = None
+        # Rows are only filtered again when the filters change or the source sorts, not on every edit
+        self.setDynamicSortFilter(False)
+
+    def set_filters(self, min_rating=None, resolution=None, min_savings=None):
+        self.min_rating = min_rating
+        self.resolution = resolution
+        self.min_savings = min_savings
+        # Select All and the folder checkboxes only tick the rows that are shown
+        self.sourceModel().row_filter = self.accepts if self.filtering() else None
+        self.invalidateFilter()
+
+    def filtering(self):
+        return self.min_rating is not None or self.resolution is not None or self.min_savings is not None
+
+    def accepts(self, r):
+        model = self.sourceModel()
+        if not self.filtering():
+            return True
+        # Not known to match until probed
+        if model.probe_state[r] != PROBED:
+            return False
+        if self.min_rating is not None and model.rating[r] < self.min_rating:
+            return False
+        if self.resolution is not None and model.resolutions[r] != self.resolution:
+            return False
+        # Rows without an estimate have NaN here, which never passes
+        if self.min_savings is not None and not model.compression[r] >= self.min_savings:
+            return False
+        return True
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if not source_parent.isValid():
+            return True
+        model = self.sourceModel()
+        return self.accepts(model.children[model.folder_order[source_parent.row()]][source_row])
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        model = self.sourceModel()
+        model.sort(column, order)
+        if model.row_filter is not None:
+            # Rows that only repainted now hold other videos
+            self.invalidateFilter()
+
+    def row_id(self, index):
+        # Row id behind an index of this proxy, None for folder rows
+        return self.sourceModel().row_id(self.mapToSource(index))
+
+    def folder_path(self, index):
+        return self.sourceModel().folder_path(self.mapToSource(index))
@@ -0,0 +1,65 @@
+import os
+import json
+import socket
+import threading
+
+# x265 presets, fastest first
+X265_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow', 'placebo']
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def host_profile_path(host=None):
+    # One file per host name, so nodes sharing a checkout over the network each keep their own
+    host = host or socket.gethostname() or 'localhost'
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f".compress_vid_x265_{host}.json")
+
+
+def load_host_profile(path=None):
+    """
+    Returns the x265 profile Additional_files/tune_x265.py saved for this host, or None if it
+    hasn't been tuned. The profile has 'preset', 'frame_threads' (0 lets x265 decide),
+    'pools' (threads per encode) and 'jobs' (concurrent encodes). Read once per process.
+    """
+    path = path or host_profile_path()
+    with _profiles_lock:
+        if path not in _profiles:
+            try:
+                with open(path) as f:
+                    _profiles[path] = json.load(f)
+            except (OSError, ValueError):
+                _profiles[path] = None
+        return _profiles[path]
+
+
+def save_host_profile(profile, path=None):
+    path = path or host_profile_path()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    with _profiles_lock:
+        _profiles[path] = profile
+    return path
+
+
+def x265_params(threads=None, profile=None):
+    # x265 "key=value" options for the profile, an explicit thread cap wins over the tuned pool size
+    params = []
+    if profile and profile.get('frame_threads'):
+        params.append(f"frame-threads={profile['frame_threads']}")
+    pools = threads or (profile or {}).get('pools')
+    if pools:
+        params.append(f"pools={pools}")
+    return params
+
+
+def x265_ffmpeg_args(threads=None, profile=None):
+    # ffmpeg options for libx265: the host profile's preset and threading, if this host was tuned
+    profile = profile if profile is not None else load_host_profile()
+    args = ['-preset', profile['preset']] if profile else []
+    params = x265_params(threads, profile)
+    if params:
+        args += ['-x265-params', ':'.join(params)]
+    return args